@@ -1,15 +1,16 @@
 import json
 import re
 
-import steampi.api
-
+from app_details_extraction import run_extractors
+from profiling import profiled_entry_point
 from steam_spy import get_previously_seen_app_ids_of_games, load_text_file
 
 
-def aggregate_game_descriptions_from_steam_data(
+def get_game_description_extractor(
     output_filename='aggregate.json',
     verbose=True,
 ):
+    # Output: an extractor of app_details_extraction.py, which updates the aggregate saved to output_filename
     try:
         with open(output_filename) as f:
             aggregate = json.load(f)
@@ -30,21 +31,19 @@ def aggregate_game_descriptions_from_steam_data(
 
     parsed_app_ids = set(parsed_app_ids).difference(aggregate.keys())
 
-    for app_id in sorted(parsed_app_ids, key=int):
-        app_details, _, _ = steampi.api.load_app_details(app_id)
-
+    def update(app_id, app_details):
         try:
             app_name = app_details['name']
         except KeyError:
             if verbose:
                 print(f'Name not found for appID = {app_id}')
                 app_id_errors.append(app_id)
-            continue
+            return
         except TypeError:
             if verbose:
                 print(f'File empty for appID = {app_id}')
                 app_id_errors.append(app_id)
-            continue
+            return
 
         try:
             app_type = app_details['type']
@@ -52,7 +51,7 @@ def aggregate_game_descriptions_from_steam_data(
             if verbose:
                 print(f'Missing type for appID = {app_id} ({app_name})')
                 app_id_errors.append(app_id)
-            continue
+            return
 
         if app_type == 'game':
             try:
@@ -66,7 +65,7 @@ def aggregate_game_descriptions_from_steam_data(
                         ),
                     )
                     app_id_errors.append(app_id)
-                continue
+                return
 
             parsed_supported_languages = re.split(r'\W+', supported_languages)
             if 'English' in parsed_supported_languages:
@@ -116,16 +115,31 @@ def aggregate_game_descriptions_from_steam_data(
                             app_name,
                         ),
                     )
-                continue
+                return
+
+    def finalize():
+        if verbose:
+            print(
+                '\nList of appIDs which were associated with erroneous or incomplete JSON app details:\n',
+            )
+            print(app_id_errors)
+
+        with open(output_filename, "w") as f:
+            json.dump(aggregate, f)
+
+        return aggregate
 
-    if verbose:
-        print(
-            '\nList of appIDs which were associated with erroneous or incomplete JSON app details:\n',
-        )
-        print(app_id_errors)
+    return {'app_ids': parsed_app_ids, 'update': update, 'finalize': finalize}
+
+
+@profiled_entry_point('aggregate_text', count_items=len)
+def aggregate_game_descriptions_from_steam_data(
+    output_filename='aggregate.json',
+    verbose=True,
+):
+    outputs = run_extractors({'text': get_game_description_extractor(output_filename, verbose=verbose)})
 
-    with open(output_filename, "w") as f:
-        json.dump(aggregate, f)
+    return outputs['text']
 
 
 if __name__ == '__main__':
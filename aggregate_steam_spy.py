@@ -1,10 +1,13 @@
-import steampi.api
 import steampi.json_utils
 
+from aggregate_game_text_descriptions import get_game_description_extractor
+from app_details_extraction import run_extractors
+from profiling import profile_stage, profiled_entry_point
 from steam_spy import get_previously_seen_app_ids_of_games, load_text_file
 
 
-def aggregate_steam_data(verbose=True):
+def get_steam_data_extractor(verbose=True):
+    # Output: an extractor of app_details_extraction.py, whose output is the tuple returned by aggregate_steam_data()
     success_filename = get_previously_seen_app_ids_of_games()
 
     parsed_app_ids = load_text_file(success_filename)
@@ -17,16 +20,14 @@ def aggregate_steam_data(verbose=True):
     all_categories = {}
     all_genres = {}
 
-    for appID in parsed_app_ids:
-        app_details, _, _ = steampi.api.load_app_details(appID)
-
+    def update(appID, app_details):
         if app_details is None or 'type' not in app_details:
             print(
                 'AppID {} does not have a "type" key, so we cannot check whether it matches a game.'.format(
                     appID,
                 ),
             )
-            continue
+            return
 
         if app_details['type'] == 'game':
             # Keep track of the kind of info which can be found through Steam API
@@ -132,12 +133,22 @@ def aggregate_steam_data(verbose=True):
                 'ext_user_account_notice' in app_details,
             )
 
-    if verbose:
-        print('All possible pieces of information which can be fetched via Steam API:')
-        print('\n'.join(all_possible_info_type))
-        print()
+    def finalize():
+        if verbose:
+            print('All possible pieces of information which can be fetched via Steam API:')
+            print('\n'.join(all_possible_info_type))
+            print()
+
+        return steam_database, all_categories, all_genres
+
+    return {'app_ids': parsed_app_ids, 'update': update, 'finalize': finalize}
 
-    return steam_database, all_categories, all_genres
+
+@profiled_entry_point('aggregate_steam_data', count_items=lambda output: len(output[0]))
+def aggregate_steam_data(verbose=True):
+    outputs = run_extractors({'steam_data': get_steam_data_extractor(verbose=verbose)})
+
+    return outputs['steam_data']
 
 
 def get_steam_database_filename():
@@ -158,11 +169,34 @@ def get_steam_genres_filename():
     return steam_genres_filename
 
 
-if __name__ == '__main__':
+@profiled_entry_point('aggregate')
+def main(verbose=True, text_output_filename=None):
     print('Aggregating data locally')
-    (steamspy_database, categories, genres) = aggregate_steam_data()
+    extractors = {'steam_data': get_steam_data_extractor(verbose=verbose)}
+    if text_output_filename is not None:
+        # Store descriptions are aggregated as well, in the same pass over app details
+        extractors['text'] = get_game_description_extractor(text_output_filename, verbose=verbose)
+
+    with profile_stage('extraction') as stage:
+        outputs = run_extractors(extractors)
+        (steamspy_database, categories, genres) = outputs['steam_data']
+        stage['num_items'] = len(steamspy_database)
 
     print('Saving')
-    steampi.json_utils.save_json_data(get_steam_database_filename(), steamspy_database)
-    steampi.json_utils.save_json_data(get_steam_categories_filename(), categories)
-    steampi.json_utils.save_json_data(get_steam_genres_filename(), genres)
+    with profile_stage('save', num_items=len(steamspy_database)):
+        steampi.json_utils.save_json_data(get_steam_database_filename(), steamspy_database)
+        steampi.json_utils.save_json_data(get_steam_categories_filename(), categories)
+        steampi.json_utils.save_json_data(get_steam_genres_filename(), genres)
+
+    # Imported here, so that numpy is not loaded when the aggregate subcommand starts.
+    from quantile_sketches import update_and_save_monthly_sketches
+
+    print('Updating monthly quantile sketches')
+    with profile_stage('quantile_sketches', num_items=len(steamspy_database)):
+        update_and_save_monthly_sketches(steamspy_database, verbose=verbose)
+
+    return True
+
+
+if __name__ == '__main__':
+    main()
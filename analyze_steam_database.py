@@ -1,24 +1,42 @@
 import datetime
+import itertools
+import os
 import pathlib
-from math import sqrt
+from concurrent.futures import ProcessPoolExecutor
 
-import matplotlib.dates as mdates
 import numpy as np
 import steampi.json_utils
 
-# Reference: https://stackoverflow.com/a/3054314
-from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
-from matplotlib.figure import Figure
-
 from aggregate_steam_spy import (
     get_steam_categories_filename,
     get_steam_database_filename,
     get_steam_genres_filename,
 )
+from compact_records import AppRecord, load_compact_steam_database
+from derived_data_cache import compute_code_fingerprint, load_or_compute
+from profiling import profile_stage, profiled_entry_point
+from quantile_sketches import get_monthly_quantiles, load_monthly_sketches
+from time_series_engine import (
+    aggregate_values,
+    build_multi_granularity_series,
+    compute_rolling_mean,
+    drop_partial_periods,
+    get_period_start,
+    group_by_period,
+)
+from time_series_export import (
+    export_plot_jobs,
+    load_plot_manifest,
+    save_plot_manifest,
+    select_plot_jobs_to_render,
+)
 
 
-def load_aggregated_database():
-    steam_database = steampi.json_utils.load_json_data(get_steam_database_filename())
+def load_aggregated_database(compact=False):
+    if compact:
+        steam_database = load_compact_steam_database(get_steam_database_filename())
+    else:
+        steam_database = steampi.json_utils.load_json_data(get_steam_database_filename())
     all_categories = steampi.json_utils.load_json_data(get_steam_categories_filename())
     all_genres = steampi.json_utils.load_json_data(get_steam_genres_filename())
 
@@ -40,6 +58,39 @@ def get_description_keywords(steam_database, verbose=False):
     return description_keywords
 
 
+# Granularities of the release series, built at once by compute_release_series()
+CHARTED_GRANULARITIES = ['week', 'month', 'quarter', 'year']
+
+RELEASE_DATE_FORMATS = ['%b %d %Y', '%d %b %Y', '%B %d %Y', '%d %B %Y', '%b %Y']
+
+
+def normalize_release_date(release_date_as_str):
+    release_date_as_str = release_date_as_str.replace(
+        ',',
+        '',
+    )  # "Nov 11, 2017" == "Nov 11 2017"
+    release_date_as_str = release_date_as_str.replace(
+        'сен.',
+        'September',
+    )  # Specifically for appID=689740
+
+    return release_date_as_str
+
+
+def parse_release_date(release_date_as_str):
+    # Output: the release date as a datetime, or None if the date cannot be parsed
+    release_date_as_str = normalize_release_date(release_date_as_str)
+
+    for date_format in RELEASE_DATE_FORMATS:
+        try:
+            # Reference: https://stackoverflow.com/a/6557568/
+            return datetime.datetime.strptime(release_date_as_str, date_format)
+        except ValueError:
+            continue
+
+    return None
+
+
 def build_steam_calendar(steam_database, verbose=False):
     # Objective: build a calendar of game releases, as a dict: datetime -> list of appIDs
 
@@ -56,61 +107,24 @@ def build_steam_calendar(steam_database, verbose=False):
         if not is_released:
             continue
 
-        release_date_as_str = release_date_as_str.replace(
-            ',',
-            '',
-        )  # "Nov 11, 2017" == "Nov 11 2017"
-        release_date_as_str = release_date_as_str.replace(
-            'сен.',
-            'September',
-        )  # Specifically for appID=689740
+        release_date_as_datetime = parse_release_date(release_date_as_str)
 
-        try:
-            # Reference: https://stackoverflow.com/a/6557568/
-            release_date_as_datetime = datetime.datetime.strptime(
-                release_date_as_str,
-                '%b %d %Y',
-            )
-        except ValueError:
-            try:
-                release_date_as_datetime = datetime.datetime.strptime(
-                    release_date_as_str,
-                    '%d %b %Y',
-                )
-            except ValueError:
-                try:
-                    release_date_as_datetime = datetime.datetime.strptime(
-                        release_date_as_str,
-                        '%B %d %Y',
+        if release_date_as_datetime is None:
+            weird_release_dates.add(normalize_release_date(release_date_as_str))
+            weird_counter += 1
+            if verbose:
+                if weird_counter == 1:
+                    print(
+                        '\nGames being sold with weird release dates:',
                     )
-                except ValueError:
-                    try:
-                        release_date_as_datetime = datetime.datetime.strptime(
-                            release_date_as_str,
-                            '%d %B %Y',
+                if steam_database[appID]['price_overview'] is not None:
+                    if not (steam_database[appID]['is_free']):
+                        sentence = (
+                            'appID={0:6}\t'
+                            + steam_database[appID]['name']
                         )
-                    except ValueError:
-                        try:
-                            release_date_as_datetime = datetime.datetime.strptime(
-                                release_date_as_str,
-                                '%b %Y',
-                            )
-                        except ValueError:
-                            weird_release_dates.add(release_date_as_str)
-                            weird_counter += 1
-                            if verbose:
-                                if weird_counter == 1:
-                                    print(
-                                        '\nGames being sold with weird release dates:',
-                                    )
-                                if steam_database[appID]['price_overview'] is not None:
-                                    if not (steam_database[appID]['is_free']):
-                                        sentence = (
-                                            'appID={0:6}\t'
-                                            + steam_database[appID]['name']
-                                        )
-                                        print(sentence.format(appID))
-                            continue
+                        print(sentence.format(appID))
+            continue
 
         try:
             release_calendar[release_date_as_datetime].append(appID)
@@ -183,6 +197,13 @@ def plot_x_y_time_series(
     max_ordinate=None,
     confidence_interval_data=None,
 ):
+    # Import matplotlib lazily, so that it is not loaded unless something is plotted
+    import matplotlib.dates as mdates
+
+    # Reference: https://stackoverflow.com/a/3054314
+    from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
+    from matplotlib.figure import Figure
+
     fig = Figure(dpi=300)
     FigureCanvas(fig)
     ax = fig.add_subplot(111)
@@ -223,39 +244,47 @@ def plot_x_y_time_series(
     return
 
 
-def simplify_calendar(release_calendar):
-    # Objective: merge daily dates into monthly dates
+def simplify_calendar(release_calendar, granularity='month'):
+    # Objective: merge daily dates into monthly dates (or weekly, quarterly, yearly dates)
 
     merged_calendar = {}
     for release_date in release_calendar:
-        merged_release_date = datetime.date(release_date.year, release_date.month, 1)
+        merged_release_date = get_period_start(release_date, granularity)
         try:
             merged_calendar[merged_release_date].extend(release_calendar[release_date])
         except KeyError:
-            merged_calendar[merged_release_date] = release_calendar[release_date]
+            merged_calendar[merged_release_date] = list(release_calendar[release_date])
 
     return merged_calendar
 
 
-def remove_current_date(release_calendar):
-    # Objective: remove partial data just before plotting time-series
+def restrict_calendar_to_app_ids(release_calendar, selected_app_ids):
+    # Objective: only keep a subset of games, e.g. the output of steam_query.query_app_ids()
 
-    now = datetime.datetime.now()
+    selected_app_ids = set(selected_app_ids)
 
-    this_day = datetime.date(now.year, now.month, now.day)
+    restricted_calendar = {}
+    for release_date, app_ids in release_calendar.items():
+        kept_app_ids = [app_id for app_id in app_ids if app_id in selected_app_ids]
+        if len(kept_app_ids) > 0:
+            restricted_calendar[release_date] = kept_app_ids
 
-    this_month = datetime.date(this_day.year, this_day.month, 1)
+    return restricted_calendar
 
-    # Start by copying the dictionary
-    # Reference: https://stackoverflow.com/a/5844692
-    filtered_calendar = dict(release_calendar)
-    try:
-        del filtered_calendar[this_day]
-    except KeyError:
-        try:
-            del filtered_calendar[this_month]
-        except KeyError:
-            print('No recent date could be removed from the calendar.')
+
+def remove_current_date(release_calendar, granularity='month'):
+    # Objective: remove partial data just before plotting time-series, i.e. the current period and any later one
+
+    current_period_start = get_period_start(datetime.date.today(), granularity)
+
+    filtered_calendar = {
+        release_date: app_ids
+        for release_date, app_ids in release_calendar.items()
+        if get_period_start(release_date, granularity) < current_period_start
+    }
+
+    if len(filtered_calendar) == len(release_calendar):
+        print('No recent date could be removed from the calendar.')
 
     return filtered_calendar
 
@@ -290,20 +319,64 @@ def plot_mean_and_confidence_interval(
     return
 
 
-def get_mean_and_confidence_interval(x_list, is_variable_of_interest_numeric=True):
-    # Reference: plot_time_series() in https://github.com/woctezuma/humble-monthly/blob/master/plot_time_series.py
+def flatten_feature_list(feature_list):
+    # Objective: convert a list of per-month lists into flat values, along with month offsets, so that values of the
+    # i-th month are values[offsets[i]:offsets[i+1]]
+
+    counts = np.array([len(features) for features in feature_list], dtype=np.int64)
+
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    values = np.fromiter(
+        itertools.chain.from_iterable(feature_list),
+        dtype=np.float64,
+        count=offsets[-1],
+    )
+
+    return values, offsets
+
+
+def get_segment_ids(offsets):
+    counts = np.diff(offsets)
+
+    return np.repeat(np.arange(len(counts)), counts)
+
+
+def get_segment_means(values, offsets):
+    counts = np.diff(offsets)
+    segment_ids = get_segment_ids(offsets)
 
-    x_vec = np.array([np.array(xi) for xi in x_list])
+    sums = np.bincount(segment_ids, weights=values, minlength=len(counts))
 
-    mean = np.array([np.mean(xi) for xi in x_vec])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = sums / counts
+
+    return means, sums, counts, segment_ids
+
+
+def get_mean_and_confidence_interval_from_segments(
+    values,
+    offsets,
+    is_variable_of_interest_numeric=True,
+):
+    # Reference: plot_time_series() in https://github.com/woctezuma/humble-monthly/blob/master/plot_time_series.py
+
+    mean, sums, counts, segment_ids = get_segment_means(values, offsets)
 
     # 0.95-Quantile of the normal distribution
     # Reference: https://en.wikipedia.org/wiki/Normal_distribution
     z_quantile = 1.95996398454
 
-    try:
+    with np.errstate(divide='ignore', invalid='ignore'):
         if is_variable_of_interest_numeric:
-            sig = np.array([np.std(xi) / np.sqrt(len(xi)) for xi in x_vec])
+            # Two-pass variance, to avoid the cancellation of E[x^2] - E[x]^2
+            deviations = values - mean[segment_ids]
+            variances = (
+                np.bincount(segment_ids, weights=deviations**2, minlength=len(counts))
+                / counts
+            )
+            sig = np.sqrt(variances) / np.sqrt(counts)
 
             confidence_factor = z_quantile
             ub = mean + confidence_factor * sig
@@ -312,8 +385,8 @@ def get_mean_and_confidence_interval(x_list, is_variable_of_interest_numeric=Tru
             # Reference:
             # computeWilsonScore() in https://github.com/woctezuma/hidden-gems/blob/master/compute_wilson_score.py
 
-            num_pos = np.array([np.sum(xi) for xi in x_vec])
-            num_neg = np.array([len(xi) - np.sum(xi) for xi in x_vec])
+            num_pos = sums
+            num_neg = counts - sums
 
             z2 = pow(z_quantile, 2)
             den = num_pos + num_neg + z2
@@ -321,19 +394,84 @@ def get_mean_and_confidence_interval(x_list, is_variable_of_interest_numeric=Tru
             mean = (num_pos + z2 / 2) / den
 
             inside_sqrt = num_pos * num_neg / (num_pos + num_neg) + z2 / 4
-            temp = np.array([sqrt(i) for i in inside_sqrt])
-            delta = (z_quantile * temp) / den
+            delta = (z_quantile * np.sqrt(inside_sqrt)) / den
             ub = mean + delta
             lb = mean - delta
 
-    except TypeError:
-        ub = None
-        lb = None
-
     return mean, lb, ub
 
 
-def plot_time_series_for_numeric_variable_of_interest(
+def get_mean_and_confidence_interval(x_list, is_variable_of_interest_numeric=True):
+    values, offsets = flatten_feature_list(x_list)
+
+    return get_mean_and_confidence_interval_from_segments(
+        values,
+        offsets,
+        is_variable_of_interest_numeric,
+    )
+
+
+def get_median_and_bootstrap_confidence_interval_from_segments(
+    values,
+    offsets,
+    num_resamples=1000,
+    seed=0,
+    confidence_level=0.95,
+):
+    # Objective: percentile bootstrap interval of the median of each segment.
+    #
+    # Instead of drawing every resample explicitly, draw the order statistics which define the median of a resample.
+    # If a segment has c values, then the k-th smallest of c uniform draws follows Beta(k, c-k+1), and the next one
+    # is obtained by drawing the minimum of the c-k remaining uniform draws, above the k-th one.
+    # Mapping a uniform draw u to the sorted value at index floor(u * c) is the same as resampling with replacement.
+    # The cost is thus O(num_resamples * num_segments), whatever the number of values.
+    # Reference: https://en.wikipedia.org/wiki/Order_statistic#Order_statistics_sampled_from_a_uniform_distribution
+
+    counts = np.diff(offsets)
+    segment_ids = get_segment_ids(offsets)
+    starts = offsets[:-1]
+
+    # Sort values within each segment
+    sorted_values = values[np.lexsort((values, segment_ids))]
+
+    median = np.full(len(counts), np.nan)
+    lb = np.full(len(counts), np.nan)
+    ub = np.full(len(counts), np.nan)
+
+    is_non_empty = counts > 0
+    c = counts[is_non_empty]
+    s = starts[is_non_empty]
+
+    # 1-based ranks of the order statistics which are averaged to compute the median
+    k_low = (c - 1) // 2 + 1
+    k_high = c // 2 + 1
+
+    median[is_non_empty] = 0.5 * (sorted_values[s + k_low - 1] + sorted_values[s + k_high - 1])
+
+    rng = np.random.default_rng(seed)
+
+    u_low = rng.beta(k_low, c - k_low + 1, size=(num_resamples, len(c)))
+    # For odd counts, k_high == k_low, so that the second order statistic is the first one.
+    u_next = u_low + (1 - u_low) * rng.beta(1, np.maximum(c - k_low, 1), size=(num_resamples, len(c)))
+    u_high = np.where(k_high > k_low, u_next, u_low)
+
+    index_low = np.minimum((u_low * c).astype(np.int64), c - 1)
+    index_high = np.minimum((u_high * c).astype(np.int64), c - 1)
+
+    bootstrap_medians = 0.5 * (sorted_values[s + index_low] + sorted_values[s + index_high])
+
+    alpha = 1 - confidence_level
+    if len(c) > 0:
+        lb[is_non_empty], ub[is_non_empty] = np.percentile(
+            bootstrap_medians,
+            [100 * alpha / 2, 100 * (1 - alpha / 2)],
+            axis=0,
+        )
+
+    return median, lb, ub
+
+
+def compute_time_series_for_numeric_variable_of_interest(
     release_calendar,
     steam_database=None,
     statistic_str=None,
@@ -343,6 +481,9 @@ def plot_time_series_for_numeric_variable_of_interest(
     is_variable_of_interest_numeric=True,
     max_ordinate=None,
     plot_confidence_interval_if_possible=True,
+    bootstrap_num_resamples=None,
+    bootstrap_seed=0,
+    monthly_sketches=None,
 ):
     # Get x: dates and y: a set of appIDs of games released for each date in x
     (x, y_raw) = get_x_y_time_series(
@@ -352,10 +493,27 @@ def plot_time_series_for_numeric_variable_of_interest(
         starting_year,
     )
 
+    # Medians can be read from the monthly quantile sketches, if available, instead of being computed from every value.
+    sketched_medians = None
+    if (
+        statistic_str == 'Median'
+        and monthly_sketches is not None
+        and bootstrap_num_resamples is None
+    ):
+        # The sketches are only used if they hold exactly the games of the calendar, e.g. not for the output of a query.
+        sketched_medians = get_monthly_quantiles(
+            monthly_sketches,
+            description_keyword,
+            x,
+            app_ids_per_month=y_raw,
+        )
+
     # Compute the value of interest y from y_raw
     feature_list = []
     for app_ids in y_raw:
-        if description_keyword is not None:
+        if sketched_medians is not None:
+            features = []
+        elif description_keyword is not None:
             if is_variable_of_interest_numeric:
                 # noinspection PyPep8
                 g = int
@@ -381,12 +539,31 @@ def plot_time_series_for_numeric_variable_of_interest(
             is_variable_of_interest_numeric,
         )
         # Thresholding of lower-bound of confidence interval so that it is non-negative
-        lb = np.array([max(i, 0) for i in lb])
+        lb = np.maximum(lb, 0)
 
         confidence_interval_data['mean'] = mean
         confidence_interval_data['lb'] = lb
         confidence_interval_data['ub'] = ub
 
+    if (
+        plot_confidence_interval_if_possible
+        and statistic_str == 'Median'
+        and bootstrap_num_resamples is not None
+        and description_keyword is not None
+    ):
+        (values, offsets) = flatten_feature_list(feature_list)
+        (median, lb, ub) = get_median_and_bootstrap_confidence_interval_from_segments(
+            values,
+            offsets,
+            num_resamples=bootstrap_num_resamples,
+            seed=bootstrap_seed,
+        )
+
+        # The key 'mean' refers to the central curve, which is the median here.
+        confidence_interval_data['mean'] = median
+        confidence_interval_data['lb'] = lb
+        confidence_interval_data['ub'] = ub
+
     if statistic_str == 'Median':
         # noinspection PyPep8
         f = np.median
@@ -401,8 +578,11 @@ def plot_time_series_for_numeric_variable_of_interest(
         f = len
 
     y = []
-    for features in feature_list:
-        value = f(features)
+    for i, features in enumerate(feature_list):
+        if sketched_medians is not None:
+            value = sketched_medians[i]
+        else:
+            value = f(features)
 
         if description_keyword == 'price_overview':
             # Convert from cents to euros
@@ -413,8 +593,8 @@ def plot_time_series_for_numeric_variable_of_interest(
     if description_keyword == 'price_overview':
         # Convert from cents to euros
         for entry in confidence_interval_data:
-            confidence_interval_data[entry] = np.array(
-                [i / 100 for i in confidence_interval_data[entry]],
+            confidence_interval_data[entry] = (
+                np.asarray(confidence_interval_data[entry]) / 100
             )
 
     # Plot legend
@@ -455,22 +635,77 @@ def plot_time_series_for_numeric_variable_of_interest(
 
     month_formatting = bool(starting_year is not None)
 
-    # Plot
-    plot_x_y_time_series(
-        x,
-        y,
-        my_title,
-        my_ylabel,
-        my_plot_filename,
-        month_formatting,
+    # Everything needed to render the figure, so that rendering can happen later, possibly in another process
+    plot_job = {
+        'x_list': x,
+        'y_list': y,
+        'chosen_title': my_title,
+        'chosen_ylabel': my_ylabel,
+        'base_plot_filename': my_plot_filename,
+        'month_formatting': month_formatting,
+        'is_variable_of_interest_numeric': is_variable_of_interest_numeric,
+        'max_ordinate': max_ordinate,
+        'confidence_interval_data': confidence_interval_data,
+    }
+
+    return plot_job
+
+
+def plot_time_series_for_numeric_variable_of_interest(
+    release_calendar,
+    steam_database=None,
+    statistic_str=None,
+    description_keyword=None,
+    legend_keyword=None,
+    starting_year=None,
+    is_variable_of_interest_numeric=True,
+    max_ordinate=None,
+    plot_confidence_interval_if_possible=True,
+    bootstrap_num_resamples=None,
+    bootstrap_seed=0,
+):
+    plot_job = compute_time_series_for_numeric_variable_of_interest(
+        release_calendar,
+        steam_database,
+        statistic_str,
+        description_keyword,
+        legend_keyword,
+        starting_year,
         is_variable_of_interest_numeric,
         max_ordinate,
-        confidence_interval_data,
+        plot_confidence_interval_if_possible,
+        bootstrap_num_resamples,
+        bootstrap_seed,
     )
 
+    render_plot_job(plot_job)
+
     return
 
 
+def render_plot_job(plot_job):
+    plot_x_y_time_series(**plot_job)
+
+    return plot_job['base_plot_filename']
+
+
+def render_plot_jobs(plot_jobs, num_workers=None):
+    # Objective: render figures in parallel, each worker process having its own matplotlib state
+
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+
+    num_workers = min(num_workers, len(plot_jobs))
+
+    if num_workers <= 1:
+        rendered_plot_filenames = [render_plot_job(plot_job) for plot_job in plot_jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            rendered_plot_filenames = list(executor.map(render_plot_job, plot_jobs))
+
+    return rendered_plot_filenames
+
+
 def generic_converter(my_boolean):
     # Objective: output either 0 or 1, with an input which is likely a boolean, but might be a str or an int.
 
@@ -481,7 +716,7 @@ def generic_converter(my_boolean):
     return x
 
 
-def plot_time_series_for_boolean_variable_of_interest(
+def compute_time_series_for_boolean_variable_of_interest(
     release_calendar,
     steam_database,
     description_keyword='controller_support',
@@ -492,7 +727,7 @@ def plot_time_series_for_boolean_variable_of_interest(
     statistic_str = 'Average'
     is_variable_of_interest_numeric = False
 
-    plot_time_series_for_numeric_variable_of_interest(
+    plot_job = compute_time_series_for_numeric_variable_of_interest(
         release_calendar,
         steam_database,
         statistic_str,
@@ -503,6 +738,28 @@ def plot_time_series_for_boolean_variable_of_interest(
         max_ordinate,
     )
 
+    return plot_job
+
+
+def plot_time_series_for_boolean_variable_of_interest(
+    release_calendar,
+    steam_database,
+    description_keyword='controller_support',
+    legend_keyword=None,
+    starting_year=None,
+    max_ordinate=1.0,
+):
+    plot_job = compute_time_series_for_boolean_variable_of_interest(
+        release_calendar,
+        steam_database,
+        description_keyword,
+        legend_keyword,
+        starting_year,
+        max_ordinate,
+    )
+
+    render_plot_job(plot_job)
+
     return
 
 
@@ -530,166 +787,248 @@ def fill_in_drm_support(steam_database):
     return steam_database
 
 
-def plot_every_time_series_based_on_steam_calendar(release_calendar, steam_database):
-    plot_time_series_for_numeric_variable_of_interest(
-        release_calendar,
+def compute_every_time_series_based_on_steam_calendar(
+    release_calendar,
+    steam_database,
+    bootstrap_num_resamples=None,
+    monthly_sketches=None,
+):
+    plot_jobs = []
+
+    plot_jobs.append(
+        compute_time_series_for_numeric_variable_of_interest(
+            release_calendar,
+        ),
     )  # Plot number of releases
 
-    plot_time_series_for_numeric_variable_of_interest(
-        release_calendar,
-        steam_database,
-        'Median',
-        'price_overview',
+    plot_jobs.append(
+        compute_time_series_for_numeric_variable_of_interest(
+            release_calendar,
+            steam_database,
+            'Median',
+            'price_overview',
+            bootstrap_num_resamples=bootstrap_num_resamples,
+            monthly_sketches=monthly_sketches,
+        ),
     )
 
-    plot_time_series_for_numeric_variable_of_interest(
-        release_calendar,
-        steam_database,
-        'Average',
-        'price_overview',
+    plot_jobs.append(
+        compute_time_series_for_numeric_variable_of_interest(
+            release_calendar,
+            steam_database,
+            'Average',
+            'price_overview',
+        ),
     )
 
-    plot_time_series_for_numeric_variable_of_interest(
-        release_calendar,
-        steam_database,
-        'Median',
-        'achievements',
+    plot_jobs.append(
+        compute_time_series_for_numeric_variable_of_interest(
+            release_calendar,
+            steam_database,
+            'Median',
+            'achievements',
+            bootstrap_num_resamples=bootstrap_num_resamples,
+            monthly_sketches=monthly_sketches,
+        ),
     )
 
-    plot_time_series_for_numeric_variable_of_interest(
-        release_calendar,
-        steam_database,
-        'Average',
-        'achievements',
+    plot_jobs.append(
+        compute_time_series_for_numeric_variable_of_interest(
+            release_calendar,
+            steam_database,
+            'Average',
+            'achievements',
+        ),
     )
 
-    plot_time_series_for_numeric_variable_of_interest(
-        release_calendar,
-        steam_database,
-        'Average',
-        'dlc',
+    plot_jobs.append(
+        compute_time_series_for_numeric_variable_of_interest(
+            release_calendar,
+            steam_database,
+            'Average',
+            'dlc',
+        ),
     )
 
-    plot_time_series_for_numeric_variable_of_interest(
-        release_calendar,
-        steam_database,
-        'Median',
-        'metacritic',
-        'Metacritic score',
+    plot_jobs.append(
+        compute_time_series_for_numeric_variable_of_interest(
+            release_calendar,
+            steam_database,
+            'Median',
+            'metacritic',
+            'Metacritic score',
+            bootstrap_num_resamples=bootstrap_num_resamples,
+            monthly_sketches=monthly_sketches,
+        ),
     )
 
-    plot_time_series_for_numeric_variable_of_interest(
-        release_calendar,
-        steam_database,
-        'Average',
-        'metacritic',
-        'Metacritic score',
+    plot_jobs.append(
+        compute_time_series_for_numeric_variable_of_interest(
+            release_calendar,
+            steam_database,
+            'Average',
+            'metacritic',
+            'Metacritic score',
+        ),
     )
 
-    plot_time_series_for_numeric_variable_of_interest(
-        release_calendar,
-        steam_database,
-        'Median',
-        'recommendations',
+    plot_jobs.append(
+        compute_time_series_for_numeric_variable_of_interest(
+            release_calendar,
+            steam_database,
+            'Median',
+            'recommendations',
+            bootstrap_num_resamples=bootstrap_num_resamples,
+            monthly_sketches=monthly_sketches,
+        ),
     )
 
-    plot_time_series_for_numeric_variable_of_interest(
-        release_calendar,
-        steam_database,
-        'Average',
-        'recommendations',
+    plot_jobs.append(
+        compute_time_series_for_numeric_variable_of_interest(
+            release_calendar,
+            steam_database,
+            'Average',
+            'recommendations',
+        ),
     )
 
     sentence_prefixe = 'Proportion of games with '
 
-    plot_time_series_for_boolean_variable_of_interest(
-        release_calendar,
-        steam_database,
-        'controller_support',
-        sentence_prefixe + 'controller support',
+    plot_jobs.append(
+        compute_time_series_for_boolean_variable_of_interest(
+            release_calendar,
+            steam_database,
+            'controller_support',
+            sentence_prefixe + 'controller support',
+        ),
     )
 
-    plot_time_series_for_boolean_variable_of_interest(
-        release_calendar,
-        steam_database,
-        'demos',
-        sentence_prefixe + 'a demo',
+    plot_jobs.append(
+        compute_time_series_for_boolean_variable_of_interest(
+            release_calendar,
+            steam_database,
+            'demos',
+            sentence_prefixe + 'a demo',
+        ),
     )
 
-    plot_time_series_for_boolean_variable_of_interest(
-        release_calendar,
-        steam_database,
-        'ext_user_account_notice',
-        sentence_prefixe + '3rd-party account',
+    plot_jobs.append(
+        compute_time_series_for_boolean_variable_of_interest(
+            release_calendar,
+            steam_database,
+            'ext_user_account_notice',
+            sentence_prefixe + '3rd-party account',
+        ),
     )
 
-    plot_time_series_for_boolean_variable_of_interest(
-        release_calendar,
-        steam_database,
-        'required_age',
-        sentence_prefixe + 'age check',
+    plot_jobs.append(
+        compute_time_series_for_boolean_variable_of_interest(
+            release_calendar,
+            steam_database,
+            'required_age',
+            sentence_prefixe + 'age check',
+        ),
     )
 
-    plot_time_series_for_boolean_variable_of_interest(
-        release_calendar,
-        steam_database,
-        'windows_support',
-        sentence_prefixe + 'Windows support',
+    plot_jobs.append(
+        compute_time_series_for_boolean_variable_of_interest(
+            release_calendar,
+            steam_database,
+            'windows_support',
+            sentence_prefixe + 'Windows support',
+        ),
     )
 
-    plot_time_series_for_boolean_variable_of_interest(
-        release_calendar,
-        steam_database,
-        'mac_support',
-        sentence_prefixe + 'Mac support',
+    plot_jobs.append(
+        compute_time_series_for_boolean_variable_of_interest(
+            release_calendar,
+            steam_database,
+            'mac_support',
+            sentence_prefixe + 'Mac support',
+        ),
     )
 
-    plot_time_series_for_boolean_variable_of_interest(
-        release_calendar,
-        steam_database,
-        'linux_support',
-        sentence_prefixe + 'Linux support',
+    plot_jobs.append(
+        compute_time_series_for_boolean_variable_of_interest(
+            release_calendar,
+            steam_database,
+            'linux_support',
+            sentence_prefixe + 'Linux support',
+        ),
+    )
+
+    plot_jobs.append(
+        compute_time_series_for_boolean_variable_of_interest(
+            release_calendar,
+            steam_database,
+            'drm_support',
+            sentence_prefixe + '3rd-party DRM',
+        ),
     )
 
-    plot_time_series_for_boolean_variable_of_interest(
+    return plot_jobs
+
+
+def plot_every_time_series_based_on_steam_calendar(
+    release_calendar,
+    steam_database,
+    num_workers=None,
+    bootstrap_num_resamples=None,
+):
+    plot_jobs = compute_every_time_series_based_on_steam_calendar(
         release_calendar,
         steam_database,
-        'drm_support',
-        sentence_prefixe + '3rd-party DRM',
+        bootstrap_num_resamples,
     )
 
+    render_plot_jobs(plot_jobs, num_workers)
+
     return
 
 
-def plot_durante_request(release_calendar, steam_database):
+def compute_durante_request(release_calendar, steam_database):
     # Reference: https://www.resetera.com/posts/6862653/
 
+    plot_jobs = []
+
     chosen_starting_year = 2016
     chosen_max_ordinate = None
 
     sentence_prefixe = 'Proportion of games with '
 
     # noinspection PyTypeChecker
-    plot_time_series_for_boolean_variable_of_interest(
-        release_calendar,
-        steam_database,
-        'drm_support',
-        sentence_prefixe + '3rd-party DRM',
-        chosen_starting_year,
-        chosen_max_ordinate,
+    plot_jobs.append(
+        compute_time_series_for_boolean_variable_of_interest(
+            release_calendar,
+            steam_database,
+            'drm_support',
+            sentence_prefixe + '3rd-party DRM',
+            chosen_starting_year,
+            chosen_max_ordinate,
+        ),
     )
 
     sentence_prefixe = 'Number of games with '
 
-    plot_time_series_for_numeric_variable_of_interest(
-        release_calendar,
-        steam_database,
-        'Sum',
-        'drm_support',
-        sentence_prefixe + '3rd-party DRM',
-        chosen_starting_year,
+    plot_jobs.append(
+        compute_time_series_for_numeric_variable_of_interest(
+            release_calendar,
+            steam_database,
+            'Sum',
+            'drm_support',
+            sentence_prefixe + '3rd-party DRM',
+            chosen_starting_year,
+        ),
     )
 
+    return plot_jobs
+
+
+def plot_durante_request(release_calendar, steam_database, num_workers=None):
+    plot_jobs = compute_durante_request(release_calendar, steam_database)
+
+    render_plot_jobs(plot_jobs, num_workers)
+
     return
 
 
@@ -719,7 +1058,7 @@ def fill_in_genre(steam_database, genre_keyword, genre_index):
     return steam_database
 
 
-def plot_time_series_categorie(
+def compute_time_series_categorie(
     release_calendar,
     steam_database,
     all_categories,
@@ -743,7 +1082,7 @@ def plot_time_series_categorie(
     chosen_max_ordinate = None
 
     # noinspection PyTypeChecker
-    plot_time_series_for_boolean_variable_of_interest(
+    plot_job = compute_time_series_for_boolean_variable_of_interest(
         release_calendar,
         steam_database,
         selected_categorie_keyword,
@@ -752,10 +1091,28 @@ def plot_time_series_categorie(
         chosen_max_ordinate,
     )
 
+    return plot_job
+
+
+def plot_time_series_categorie(
+    release_calendar,
+    steam_database,
+    all_categories,
+    selected_categorie_index,
+):
+    plot_job = compute_time_series_categorie(
+        release_calendar,
+        steam_database,
+        all_categories,
+        selected_categorie_index,
+    )
+
+    render_plot_job(plot_job)
+
     return
 
 
-def plot_time_series_genre(
+def compute_time_series_genre(
     release_calendar,
     steam_database,
     all_genres,
@@ -774,7 +1131,7 @@ def plot_time_series_genre(
     chosen_max_ordinate = None
 
     # noinspection PyTypeChecker
-    plot_time_series_for_boolean_variable_of_interest(
+    plot_job = compute_time_series_for_boolean_variable_of_interest(
         release_calendar,
         steam_database,
         selected_genre_keyword,
@@ -783,69 +1140,383 @@ def plot_time_series_genre(
         chosen_max_ordinate,
     )
 
+    return plot_job
+
+
+def plot_time_series_genre(
+    release_calendar,
+    steam_database,
+    all_genres,
+    selected_genre_index,
+):
+    plot_job = compute_time_series_genre(
+        release_calendar,
+        steam_database,
+        all_genres,
+        selected_genre_index,
+    )
+
+    render_plot_job(plot_job)
+
     return
 
 
-def plot_every_time_series_based_on_categories_and_genres(
+def compute_every_time_series_based_on_categories_and_genres(
     release_calendar,
     steam_database,
     categories_dict,
     genres_dict,
 ):
+    plot_jobs = []
+
     for categorie_key in categories_dict:
         print(categories_dict[categorie_key])
-        plot_time_series_categorie(
-            release_calendar,
-            steam_database,
-            categories_dict,
-            categorie_key,
+        plot_jobs.append(
+            compute_time_series_categorie(
+                release_calendar,
+                steam_database,
+                categories_dict,
+                categorie_key,
+            ),
         )
 
     for genre_key in genres_dict:
         print(genres_dict[genre_key])
-        plot_time_series_genre(release_calendar, steam_database, genres_dict, genre_key)
+        plot_jobs.append(
+            compute_time_series_genre(
+                release_calendar,
+                steam_database,
+                genres_dict,
+                genre_key,
+            ),
+        )
+
+    return plot_jobs
+
+
+def plot_every_time_series_based_on_categories_and_genres(
+    release_calendar,
+    steam_database,
+    categories_dict,
+    genres_dict,
+    num_workers=None,
+):
+    plot_jobs = compute_every_time_series_based_on_categories_and_genres(
+        release_calendar,
+        steam_database,
+        categories_dict,
+        genres_dict,
+    )
+
+    render_plot_jobs(plot_jobs, num_workers)
 
     return
 
 
-def get_steam_database(verbosity=True):
-    steam_database, categories, genres = load_aggregated_database()
+def prepare_steam_database(compact=False):
+    steam_database, categories, genres = load_aggregated_database(compact=compact)
 
     steam_database = fill_in_platform_support(steam_database)
 
     steam_database = fill_in_drm_support(steam_database)
 
+    return steam_database, categories, genres
+
+
+def get_aggregated_database_filenames():
+    aggregated_database_filenames = [
+        get_steam_database_filename(),
+        get_steam_categories_filename(),
+        get_steam_genres_filename(),
+    ]
+
+    return aggregated_database_filenames
+
+
+def get_steam_database(verbosity=True, use_cache=True, compact=False):
+    # If compact, games are stored as AppRecord objects, which behave like dicts, with a fraction of their memory.
+    code_functions = [
+        prepare_steam_database,
+        load_aggregated_database,
+        fill_in_platform_support,
+        fill_in_drm_support,
+    ]
+    if compact:
+        code_functions += [load_compact_steam_database, AppRecord]
+
+    steam_database, categories, genres = load_or_compute(
+        'prepared_database_compact' if compact else 'prepared_database',
+        get_aggregated_database_filenames(),
+        lambda: prepare_steam_database(compact=compact),
+        code_functions=code_functions,
+        use_cache=use_cache,
+        verbose=verbosity,
+    )
+
     _ = get_description_keywords(steam_database, verbose=verbosity)
 
     return steam_database, categories, genres
 
 
-def get_steam_calendar(steam_database, verbosity=False):
+def build_release_calendar(steam_database, verbosity=False, granularity='month'):
     release_calendar, _ = build_steam_calendar(steam_database, verbose=verbosity)
 
-    release_calendar = simplify_calendar(release_calendar)
+    release_calendar = simplify_calendar(release_calendar, granularity)
+
+    return release_calendar
 
-    release_calendar = remove_current_date(release_calendar)
+
+def get_steam_calendar(
+    steam_database,
+    verbosity=False,
+    use_cache=False,
+    granularity='month',
+    remove_current_period=True,
+):
+    # Caveat: the cache is keyed by the aggregated files, so it should only be used if steam_database was loaded from
+    # these files, e.g. with get_steam_database(). Moreover, the cache is bypassed in verbose mode, so that the weird
+    # release dates are printed.
+    #
+    # The daily calendar, i.e. granularity='day', is kept whole for the time-series engine and for queries, which
+    # handle the current period themselves.
+
+    if use_cache and not verbosity:
+        release_calendar = load_or_compute(
+            'release_calendar_' + granularity,
+            get_aggregated_database_filenames(),
+            lambda: build_release_calendar(steam_database, granularity=granularity),
+            code_functions=[
+                build_release_calendar,
+                build_steam_calendar,
+                parse_release_date,
+                normalize_release_date,
+                simplify_calendar,
+            ],
+        )
+    else:
+        release_calendar = build_release_calendar(
+            steam_database,
+            verbosity,
+            granularity,
+        )
+
+    if remove_current_period:
+        release_calendar = remove_current_date(release_calendar, granularity)
 
     return release_calendar
 
 
-def main():
-    steamspy_database, all_categories_dict, all_genres_dict = get_steam_database()
+def flatten_release_calendar(release_calendar):
+    # Output: the release date and the appID of every game, as two lists of the same length
+    release_dates = []
+    app_ids = []
+    for release_date in sorted(release_calendar):
+        for app_id in release_calendar[release_date]:
+            release_dates.append(release_date)
+            app_ids.append(app_id)
+
+    return release_dates, app_ids
+
+
+def compute_release_series(daily_calendar, granularities=None, today=None):
+    # Objective: aggregate releases at every charted granularity with the time-series engine, from a single conversion
+    # of the release dates of the daily calendar. Periods which are not over yet are dropped.
+    #
+    # Output: a dict granularity -> series, and the appID of each release, in the order of the period indices
+
+    if granularities is None:
+        granularities = CHARTED_GRANULARITIES
+
+    release_dates, app_ids = flatten_release_calendar(daily_calendar)
+
+    all_series = build_multi_granularity_series(release_dates, granularities=granularities, today=today)
+    for granularity in granularities:
+        all_series[granularity] = drop_partial_periods(all_series[granularity])
+
+    return all_series, app_ids
+
 
-    steam_calendar = get_steam_calendar(steamspy_database)
+def get_trend_plot_job(periods, y, chosen_title, chosen_ylabel, base_plot_filename, is_variable_of_interest_numeric=True):
+    # Periods without any value, e.g. trailing windows without any release, are skipped, as in get_x_y_time_series().
+    y = np.asarray(y, dtype=np.float64)
+    is_defined = ~np.isnan(y)
 
-    plot_every_time_series_based_on_steam_calendar(steam_calendar, steamspy_database)
+    plot_job = {
+        'x_list': periods[is_defined].astype(datetime.date).tolist(),
+        'y_list': y[is_defined].tolist(),
+        'chosen_title': chosen_title,
+        'chosen_ylabel': chosen_ylabel,
+        'base_plot_filename': base_plot_filename,
+        'month_formatting': False,
+        'is_variable_of_interest_numeric': is_variable_of_interest_numeric,
+        'max_ordinate': None,
+        'confidence_interval_data': {},
+    }
 
-    plot_durante_request(steam_calendar, steamspy_database)
+    return plot_job
 
-    plot_every_time_series_based_on_categories_and_genres(
-        steam_calendar,
-        steamspy_database,
-        all_categories_dict,
-        all_genres_dict,
+
+def compute_release_trends(release_series, app_ids, steam_database, window=3):
+    # Objective: chart the number of releases at every granularity except 'month', which is charted from the monthly
+    # calendar, and trailing means over the last few months, from the series of compute_release_series().
+
+    plot_jobs = []
+
+    for granularity, series in release_series.items():
+        if granularity == 'month':
+            continue
+
+        plot_jobs.append(
+            get_trend_plot_job(
+                series['periods'],
+                series['counts'],
+                'Number of games released on Steam each ' + granularity,
+                'Number of game releases',
+                'num_releases_per_' + granularity,
+            ),
+        )
+
+    monthly_series = release_series['month']
+
+    # Prices are converted from cents to euros. Games without a price, e.g. free games, are skipped, as for the median.
+    prices = [
+        np.nan if steam_database[app_id]['price_overview'] is None else int(steam_database[app_id]['price_overview']) / 100
+        for app_id in app_ids
+    ]
+    price_series = aggregate_values(monthly_series, prices)
+    plot_jobs.append(
+        get_trend_plot_job(
+            price_series['periods'],
+            compute_rolling_mean(price_series, window),
+            'Average price of games released on Steam during the last {} months'.format(window),
+            'Average price (in €)',
+            'rolling_average_price',
+        ),
+    )
+
+    drm_series = aggregate_values(monthly_series, [steam_database[app_id]['drm_support'] for app_id in app_ids])
+    plot_jobs.append(
+        get_trend_plot_job(
+            drm_series['periods'],
+            compute_rolling_mean(drm_series, window),
+            'Proportion of games with 3rd-party DRM among Steam releases of the last {} months'.format(window),
+            'Proportion of games with 3rd-party DRM',
+            'rolling_proportion_drm_support',
+            is_variable_of_interest_numeric=False,
+        ),
     )
 
+    return plot_jobs
+
+
+def get_plot_style_fingerprint():
+    # Any change to the plotting code should trigger a new rendering of every figure
+    return compute_code_fingerprint(
+        [plot_x_y_time_series, plot_mean_and_confidence_interval],
+    )
+
+
+def render_plot_jobs_incrementally(plot_jobs, num_workers=None, verbose=True):
+    # Objective: only render figures whose data or styling changed since the last run, based on a manifest of hashes
+
+    manifest = load_plot_manifest()
+    style_fingerprint = get_plot_style_fingerprint()
+
+    selected_plot_jobs, fingerprints = select_plot_jobs_to_render(
+        plot_jobs,
+        manifest,
+        get_full_plot_filename,
+        style_fingerprint,
+    )
+
+    if verbose:
+        print(
+            'Rendering {} out of {} figures.'.format(
+                len(selected_plot_jobs),
+                len(plot_jobs),
+            ),
+        )
+
+    rendered_plot_filenames = render_plot_jobs(selected_plot_jobs, num_workers)
+
+    for base_plot_filename in rendered_plot_filenames:
+        manifest[base_plot_filename] = fingerprints[base_plot_filename]
+    save_plot_manifest(manifest)
+
+    return rendered_plot_filenames
+
+
+@profiled_entry_point('analyze')
+def main(
+    num_workers=None,
+    bootstrap_num_resamples=None,
+    compute_only=False,
+    incremental=False,
+    query=None,
+    use_monthly_sketches=False,
+    use_compact_records=False,
+):
+    with profile_stage('load_database') as stage:
+        steamspy_database, all_categories_dict, all_genres_dict = get_steam_database(compact=use_compact_records)
+        stage['num_items'] = len(steamspy_database)
+
+        # Monthly medians can be read from the quantile sketches which are updated when data is aggregated.
+        monthly_sketches = load_monthly_sketches() if use_monthly_sketches else None
+
+    with profile_stage('build_calendar') as stage:
+        daily_calendar = get_steam_calendar(
+            steamspy_database,
+            use_cache=True,
+            granularity='day',
+            remove_current_period=False,
+        )
+
+        if query is not None:
+            # Only analyze the games which match the query, a dict of keyword arguments of steam_query.query_app_ids()
+            from steam_query import build_query_index, query_app_ids
+
+            selected_app_ids = query_app_ids(build_query_index(steamspy_database, daily_calendar), **query)
+            daily_calendar = restrict_calendar_to_app_ids(daily_calendar, selected_app_ids)
+
+            # The sketches hold every game of the database, so that medians of the selected games are computed exactly.
+            monthly_sketches = None
+
+        # Every charted granularity is aggregated at once, and the monthly calendar is read from the monthly series.
+        release_series, release_app_ids = compute_release_series(daily_calendar)
+        steam_calendar = group_by_period(release_series['month'], release_app_ids)
+
+        stage['num_items'] = len(steam_calendar)
+
+    # Compute every time series first, then render all the figures at once with a pool of processes
+    with profile_stage('compute_time_series') as stage:
+        plot_jobs = compute_every_time_series_based_on_steam_calendar(
+            steam_calendar,
+            steamspy_database,
+            bootstrap_num_resamples,
+            monthly_sketches,
+        )
+
+        plot_jobs += compute_durante_request(steam_calendar, steamspy_database)
+
+        plot_jobs += compute_every_time_series_based_on_categories_and_genres(
+            steam_calendar,
+            steamspy_database,
+            all_categories_dict,
+            all_genres_dict,
+        )
+
+        plot_jobs += compute_release_trends(release_series, release_app_ids, steamspy_database)
+
+        stage['num_items'] = len(plot_jobs)
+
+    with profile_stage('export' if compute_only else 'render', num_items=len(plot_jobs)):
+        if compute_only:
+            export_plot_jobs(plot_jobs)
+        elif incremental:
+            render_plot_jobs_incrementally(plot_jobs, num_workers)
+        else:
+            render_plot_jobs(plot_jobs, num_workers)
+
     return True
 
 
@@ -0,0 +1,44 @@
+# Objective: read each appdetails document once, and feed it to several extractors, e.g. the structured records of
+# steamspy.json and the English texts of aggregate.json, instead of loading and parsing the whole corpus once per output.
+#
+# An extractor is a dict with:
+# - 'app_ids': the appIDs which it needs,
+# - 'update': a function called with each appID and its app details, in the order of appIDs,
+# - 'finalize': a function called once every appID has been read, whose output is the output of the extractor.
+
+import steampi.api
+
+from steam_spy import load_quarantined_app_ids
+
+
+def get_extraction_order(extractors, skipped_app_ids=None):
+    # Every extractor sees its appIDs sorted as integers, as if it had iterated over them on its own.
+    all_app_ids = set()
+    for extractor in extractors.values():
+        all_app_ids.update(extractor['app_ids'])
+
+    if skipped_app_ids is not None:
+        all_app_ids.difference_update(skipped_app_ids)
+
+    return sorted(all_app_ids, key=int)
+
+
+def run_extractors(extractors, skip_quarantined_app_ids=True):
+    # Output: a dict with the output of each extractor
+    #
+    # AppIDs quarantined by profile_corpus.py, e.g. empty or truncated files, are skipped, rather than parsed.
+
+    app_ids_per_extractor = {name: set(extractor['app_ids']) for name, extractor in extractors.items()}
+
+    skipped_app_ids = load_quarantined_app_ids() if skip_quarantined_app_ids else None
+
+    for app_id in get_extraction_order(extractors, skipped_app_ids):
+        app_details, _, _ = steampi.api.load_app_details(app_id)
+
+        for name, extractor in extractors.items():
+            if app_id in app_ids_per_extractor[name]:
+                extractor['update'](app_id, app_details)
+
+    outputs = {name: extractor['finalize']() for name, extractor in extractors.items()}
+
+    return outputs
@@ -0,0 +1,127 @@
+# Objective: build requests to the appdetails endpoint of the Steam store, with the parameters which steampi does not
+# expose, i.e. several comma-separated appIDs, a country code for prices, and filters which restrict the fields.
+#
+# Caveat: the store only accepts several appIDs at once if the filters are restricted to 'price_overview'.
+#
+# A request profile is the list of fields which a job needs, passed to the store as filters, or None for the complete
+# document. Fields downloaded with a filtered profile are merged into the stored document, instead of overwriting it.
+
+import urllib.parse
+
+import steampi.api
+import steampi.json_utils
+
+APPDETAILS_URL = 'https://store.steampowered.com/api/appdetails'
+
+# Quota of the store: number of queries which can be successfully issued during a 4-minute time window
+QUERY_RATE_LIMIT = 200
+WAIT_TIME = (4 * 60) + 10  # 4 minutes plus a cushion
+
+REQUEST_PROFILES = {
+    # Complete documents, including long HTML descriptions, screenshots and movies
+    'full': None,
+    # Fields which change after the release of a game
+    'refresh': ['release_date', 'recommendations', 'achievements', 'price_overview', 'metacritic'],
+}
+
+# Fields which may be removed from a game by the store, e.g. the price of a game which became free. Other fields, e.g.
+# 'release_date', which the aggregation requires, are never removed from a stored document.
+REMOVABLE_FIELDS = ['price_overview', 'metacritic']
+
+
+def get_appdetails_url(app_ids, filters=None, country_code=None, base_url=None):
+    if base_url is None:
+        base_url = APPDETAILS_URL
+    if isinstance(app_ids, (str, int)):
+        app_ids = [app_ids]
+
+    parameters = {'appids': ','.join(str(app_id) for app_id in app_ids)}
+    if filters is not None:
+        parameters['filters'] = ','.join(filters)
+    if country_code is not None:
+        parameters['cc'] = country_code
+
+    # Commas are kept as-is, as in the URLs of the store.
+    url = base_url + '?' + urllib.parse.urlencode(parameters, safe=',')
+
+    return url
+
+
+def download_appdetails(app_ids, filters=None, country_code=None, base_url=None):
+    # Output: the response, i.e. a dict appID -> {'success': bool, 'data': ...}, or None, and the status code
+    url = get_appdetails_url(app_ids, filters, country_code, base_url)
+
+    data, status_code = steampi.json_utils.download_json_data(url)
+
+    return data, status_code
+
+
+def get_request_filters(request_profile='full'):
+    return REQUEST_PROFILES[request_profile]
+
+
+def download_filtered_app_details(app_id, request_profile='full', base_url=None):
+    # Output: the app details, the success flag and the status code, as with steampi.api.download_app_details()
+    filters = get_request_filters(request_profile)
+
+    data, status_code = download_appdetails(app_id, filters, base_url=base_url)
+
+    downloaded_app_details = {}
+    success_flag = False
+
+    if data is not None:
+        response = data.get(str(app_id), {})
+        success_flag = response.get('success', False)
+        # The store returns an empty list, instead of a dict, if none of the filtered fields exist for the app.
+        downloaded_app_details = response.get('data') or {}
+
+    return downloaded_app_details, success_flag, status_code
+
+
+def merge_app_details(stored_app_details, downloaded_app_details, filters):
+    # Removable fields which were requested, but which are missing from the response, e.g. a price for a game which
+    # became free, are removed from the stored document. Other fields are kept as-is.
+    #
+    # Caveat: an empty response, i.e. 'data' is an empty list, is not a proof that the fields are gone, so that there
+    # is nothing to merge.
+    merged_app_details = dict(stored_app_details)
+
+    if len(downloaded_app_details) == 0:
+        return merged_app_details
+
+    for field in filters:
+        if field in downloaded_app_details:
+            merged_app_details[field] = downloaded_app_details[field]
+        elif field in REMOVABLE_FIELDS:
+            merged_app_details.pop(field, None)
+
+    return merged_app_details
+
+
+def update_app_details(app_id, request_profile='full', base_url=None):
+    # Objective: download the app details with a request profile, and store them.
+    #
+    # With a filtered profile, the stored document is updated in place. If there is no valid stored document, e.g. a
+    # missing or truncated file, the complete document is downloaded instead, so that a stored document is never partial.
+    filters = get_request_filters(request_profile)
+    json_filename = steampi.api.get_appdetails_filename(app_id)
+
+    stored_app_details = None
+    if filters is not None:
+        try:
+            stored_app_details = steampi.json_utils.load_json_data(json_filename)
+        except (FileNotFoundError, ValueError):
+            pass
+
+        if not isinstance(stored_app_details, dict) or len(stored_app_details) == 0:
+            stored_app_details = None
+            request_profile = 'full'
+
+    app_details, success_flag, status_code = download_filtered_app_details(app_id, request_profile, base_url)
+
+    if success_flag:
+        if stored_app_details is not None:
+            app_details = merge_app_details(stored_app_details, app_details, filters)
+        steampi.json_utils.save_json_data(json_filename, app_details)
+
+    return app_details, success_flag, status_code
@@ -0,0 +1,156 @@
+# Objective: compare the embedding backends of build_tag_map.py, i.e. t-SNE, UMAP, and the PCA preview, on synthetic
+# tag x game matrices of increasing size, in terms of wall time, peak memory, and layout quality.
+#
+# Layout quality is measured in two ways, based on the distances between tags, which are the input of every backend:
+# - trustworthiness: whether neighbors in the layout are neighbors in the input,
+# - neighborhood preservation: the fraction of the k nearest neighbors in the input which are also in the layout.
+
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmark_similar_games import generate_synthetic_vectors
+from build_tag_map import fit_embedding, get_tag_correlation_distances
+
+BACKENDS = ['PCA', 't-SNE', 'u-MAP']
+
+SIZES = [(40, 2000), (100, 20000), (400, 50000), (1000, 100000)]
+
+
+def generate_synthetic_tag_joint_game_matrix(num_tags, num_games, seed=0):
+    # Tags come in clusters, e.g. genres, so that the layout has a structure to preserve.
+    game_vectors = generate_synthetic_vectors(
+        num_games,
+        num_tags=num_tags,
+        num_clusters=max(num_tags // 8, 2),
+        tags_per_game=min(6, num_tags),
+        seed=seed,
+    )
+
+    return game_vectors.T.tocsr().astype(np.uint8)
+
+
+def compute_neighborhood_preservation(distances, embedding, n_neighbors=5):
+    input_distances = np.array(distances, dtype=np.float64)
+    np.fill_diagonal(input_distances, np.inf)
+
+    output_distances = np.linalg.norm(embedding[:, None, :] - embedding[None, :, :], axis=2)
+    np.fill_diagonal(output_distances, np.inf)
+
+    input_neighbors = np.argsort(input_distances, axis=1)[:, :n_neighbors]
+    output_neighbors = np.argsort(output_distances, axis=1)[:, :n_neighbors]
+
+    num_shared_neighbors = [
+        len(np.intersect1d(input_row, output_row)) for input_row, output_row in zip(input_neighbors, output_neighbors)
+    ]
+
+    return float(np.mean(num_shared_neighbors) / n_neighbors)
+
+
+def measure(function, measure_memory=True):
+    # Output: the output of the function, its wall time, and its peak memory, traced in a second run, because
+    # tracemalloc slows down the code which it traces.
+
+    start = time.perf_counter()
+    output = function()
+    duration = time.perf_counter() - start
+
+    peak_memory = np.nan
+    if measure_memory:
+        tracemalloc.start()
+        function()
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return output, duration, peak_memory
+
+
+def benchmark_embeddings(sizes=None, backends=None, n_neighbors=5, measure_memory=True, verbose=True):
+    from sklearn.manifold import trustworthiness
+
+    if sizes is None:
+        sizes = SIZES
+    if backends is None:
+        backends = BACKENDS
+
+    results = []
+
+    for num_tags, num_games in sizes:
+        matrix = generate_synthetic_tag_joint_game_matrix(num_tags, num_games)
+
+        distances, duration, peak_memory = measure(
+            lambda: get_tag_correlation_distances(matrix, use_cache=False),
+            measure_memory,
+        )
+        results.append(
+            {
+                'num_tags': num_tags,
+                'num_games': num_games,
+                'backend': 'distances',
+                'time_s': duration,
+                'peak_memory_mb': peak_memory / 2**20,
+                'trustworthiness': np.nan,
+                'neighborhood_preservation': np.nan,
+            },
+        )
+
+        k = min(n_neighbors, num_tags // 2 - 1)
+
+        for backend in backends:
+            result = {'num_tags': num_tags, 'num_games': num_games, 'backend': backend}
+
+            try:
+                embedding, duration, peak_memory = measure(
+                    lambda: fit_embedding(distances, backend, verbose=False),
+                    measure_memory,
+                )
+            except Exception as error:
+                # e.g. umap-learn is not installed, or t-SNE is given fewer tags than its perplexity.
+                # The failure is kept in the table, so that it is not mistaken for a missing run.
+                if verbose:
+                    print('{} failed for {} tags: {!r}'.format(backend, num_tags, error))
+                result.update(
+                    {
+                        'time_s': np.nan,
+                        'peak_memory_mb': np.nan,
+                        'trustworthiness': np.nan,
+                        'neighborhood_preservation': np.nan,
+                        'error': repr(error),
+                    },
+                )
+                results.append(result)
+                continue
+
+            result['time_s'] = duration
+            result['peak_memory_mb'] = peak_memory / 2**20
+            result['trustworthiness'] = float(
+                trustworthiness(distances, embedding, n_neighbors=k, metric='precomputed'),
+            )
+            result['neighborhood_preservation'] = compute_neighborhood_preservation(distances, embedding, k)
+
+            results.append(result)
+
+    if verbose:
+        print_table(results)
+
+    return results
+
+
+def print_table(results):
+    columns = ['num_tags', 'num_games', 'backend', 'time_s', 'peak_memory_mb', 'trustworthiness', 'neighborhood_preservation']
+
+    print(''.join('{:>27}'.format(column) for column in columns))
+    for result in results:
+        print(
+            ''.join(
+                '{:>27.3f}'.format(result[column]) if isinstance(result[column], float) else '{:>27}'.format(result[column])
+                for column in columns
+            ),
+        )
+
+    return
+
+
+if __name__ == '__main__':
+    benchmark_embeddings()
@@ -0,0 +1,107 @@
+# Objective: measure the latency and the recall of the top-k queries of similar_games.py, on synthetic catalogs of
+# increasing size, so that the exact and the approximate indices can be compared.
+
+import time
+
+import numpy as np
+import scipy.sparse
+
+from similar_games import build_similarity_index, query_top_k, query_top_k_approximate
+
+
+def generate_synthetic_vectors(num_games, num_tags=60, num_clusters=50, tags_per_game=6, seed=0):
+    # Each game belongs to a cluster, e.g. a genre, which makes some tags more likely than others.
+    rng = np.random.default_rng(seed)
+
+    tag_probabilities = rng.dirichlet(0.2 * np.ones(num_tags), size=num_clusters)
+    clusters = rng.integers(num_clusters, size=num_games)
+
+    # Sample tags without replacement, for every game at once, with the Gumbel-top-k trick.
+    scores = np.log(tag_probabilities[clusters] + 1e-12) + rng.gumbel(size=(num_games, num_tags))
+    tags = np.argpartition(-scores, tags_per_game - 1, axis=1)[:, :tags_per_game]
+
+    vectors = scipy.sparse.csr_matrix(
+        (
+            np.ones(tags.size, dtype=np.float32),
+            (np.repeat(np.arange(num_games), tags_per_game), tags.ravel()),
+        ),
+        shape=(num_games, num_tags),
+    )
+
+    return vectors
+
+
+def compute_recall(exact_similarities, approximate_similarities, tolerance=1e-5):
+    # Many games share the same tags, hence ties. A neighbor counts as found if it is at least as similar as the k-th
+    # exact neighbor.
+    kth_similarities = exact_similarities[:, [-1]]
+
+    return float(np.mean(approximate_similarities >= kth_similarities - tolerance))
+
+
+def benchmark_similar_games(
+    sizes=(10000, 100000),
+    num_queries=1000,
+    k=10,
+    use_approximate_index=True,
+    seed=0,
+    verbose=True,
+):
+    rng = np.random.default_rng(seed)
+
+    results = []
+
+    for num_games in sizes:
+        vectors = generate_synthetic_vectors(num_games, seed=seed)
+        app_ids = np.arange(num_games)
+        names = ['Game {}'.format(i) for i in app_ids]
+
+        query_rows = rng.choice(num_games, size=min(num_queries, num_games), replace=False)
+
+        index = build_similarity_index(vectors, app_ids, names)
+
+        start = time.perf_counter()
+        _, exact_similarities = query_top_k(index, query_rows, k)
+        exact_batch_duration = time.perf_counter() - start
+
+        single_durations = []
+        for row in query_rows[:20]:
+            start = time.perf_counter()
+            query_top_k(index, [row], k)
+            single_durations.append(time.perf_counter() - start)
+
+        result = {
+            'num_games': int(num_games),
+            'exact_batch_ms_per_query': 1000 * exact_batch_duration / len(query_rows),
+            'exact_single_ms': 1000 * float(np.median(single_durations)),
+        }
+
+        if use_approximate_index:
+            start = time.perf_counter()
+            index = build_similarity_index(vectors, app_ids, names, use_approximate_index=True, seed=seed)
+            result['approximate_build_s'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            _, approximate_similarities = query_top_k_approximate(index, query_rows, k)
+            result['approximate_batch_ms_per_query'] = 1000 * (time.perf_counter() - start) / len(query_rows)
+
+            result['recall'] = compute_recall(exact_similarities, approximate_similarities)
+
+        results.append(result)
+
+    if verbose:
+        columns = list(results[0].keys())
+        print(''.join('{:>32}'.format(column) for column in columns))
+        for result in results:
+            print(
+                ''.join(
+                    '{:>32}'.format(result[column]) if isinstance(result[column], int) else '{:>32.3f}'.format(result[column])
+                    for column in columns
+                ),
+            )
+
+    return results
+
+
+if __name__ == '__main__':
+    benchmark_similar_games()
@@ -0,0 +1,297 @@
+# Objective: measure the time and the peak memory of each stage of the pipeline, on a fixed synthetic corpus, and fail
+# when a stage has regressed compared to a stored baseline.
+#
+# The baseline is committed as benchmark_baseline.json, next to this file. It was measured on a single CPU, so that a
+# new baseline should be stored before comparing results from a different machine.
+#
+# Usage:
+#   python benchmark_stages.py --num-apps 20000                   # exits with status 1 if a stage regressed
+#   python benchmark_stages.py --num-apps 20000 --save-baseline   # to store a new baseline, e.g. on another machine
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+import steampi.api
+
+import analyze_steam_database
+from aggregate_steam_spy import aggregate_steam_data
+from benchmark_embeddings import measure
+from build_tag_map import fit_embedding, get_tag_correlation_distances, plot_embedding, preprocess_data
+from generate_synthetic_corpus import generate_app_ids, generate_synthetic_corpus
+from steam_catalog_utils import parse_steam_catalog
+from steam_spy import get_previously_seen_app_ids_of_games, load_previously_seen_app_ids, load_text_file
+from time_series_engine import group_by_period
+
+# The corpus does not depend on the day when the benchmark is run.
+CORPUS_DATE = datetime.date(2020, 6, 15)
+
+NUM_RENDERED_PLOTS = 4
+
+
+def get_baseline_filename():
+    # The baseline is found next to this file, whatever the current directory.
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+
+def run_catalog_parsing(context):
+    app_ids = generate_app_ids(context['num_apps'], random.Random(0))
+    data = {'applist': {'apps': [{'appid': app_id, 'name': 'App {}'.format(app_id)} for app_id in app_ids]}}
+
+    return lambda: parse_steam_catalog(data)
+
+
+def run_seen_id_sets(context):
+    all_app_ids = list(context['catalog_parsing'].keys())
+
+    return lambda: sorted(set(all_app_ids).difference(load_previously_seen_app_ids()), key=int)
+
+
+def run_appdetails_loading(context):
+    app_ids = sorted(load_text_file(get_previously_seen_app_ids_of_games()), key=int)
+
+    return lambda: [steampi.api.load_app_details(app_id)[0] for app_id in app_ids]
+
+
+def run_aggregation(context):
+    def aggregate():
+        steam_database, categories, genres = aggregate_steam_data(verbose=False)
+        steam_database = analyze_steam_database.fill_in_platform_support(steam_database)
+        steam_database = analyze_steam_database.fill_in_drm_support(steam_database)
+        return steam_database, categories, genres
+
+    return aggregate
+
+
+def run_release_date_parsing(context):
+    steam_database, _, _ = context['aggregation']
+
+    return lambda: analyze_steam_database.build_steam_calendar(steam_database)[0]
+
+
+def run_calendar_building(context):
+    # As in analyze_steam_database.main(): every charted granularity at once, then the monthly calendar
+    daily_calendar = analyze_steam_database.simplify_calendar(context['release_date_parsing'], 'day')
+
+    def build_calendar():
+        release_series, app_ids = analyze_steam_database.compute_release_series(daily_calendar)
+        return group_by_period(release_series['month'], app_ids)
+
+    return build_calendar
+
+
+def run_monthly_statistics(context):
+    steam_database, _, _ = context['aggregation']
+    monthly_calendar = context['calendar_building']
+
+    return lambda: analyze_steam_database.compute_every_time_series_based_on_steam_calendar(
+        monthly_calendar,
+        steam_database,
+    )
+
+
+def run_tag_matrix(context):
+    steam_database, categories, genres = context['aggregation']
+
+    return lambda: preprocess_data(steam_database, categories, genres)
+
+
+def run_embedding(context):
+    tag_joint_game_matrix, _ = context['tag_matrix']
+
+    return lambda: fit_embedding(
+        get_tag_correlation_distances(tag_joint_game_matrix, use_cache=False),
+        't-SNE',
+        verbose=False,
+    )
+
+
+def run_rendering(context):
+    plot_jobs = context['monthly_statistics'][:NUM_RENDERED_PLOTS]
+    _, tags_list = context['tag_matrix']
+    embedding = context['embedding']
+
+    def render():
+        # Figures are rendered in this process, so that tracemalloc sees their memory.
+        for plot_job in plot_jobs:
+            analyze_steam_database.render_plot_job(plot_job)
+        plot_embedding(embedding, tags_list, 'tag_map.png')
+        return plot_jobs
+
+    return render
+
+
+STAGES = [
+    ('catalog_parsing', run_catalog_parsing),
+    ('seen_id_sets', run_seen_id_sets),
+    ('appdetails_loading', run_appdetails_loading),
+    ('aggregation', run_aggregation),
+    ('release_date_parsing', run_release_date_parsing),
+    ('calendar_building', run_calendar_building),
+    ('monthly_statistics', run_monthly_statistics),
+    ('tag_matrix', run_tag_matrix),
+    ('embedding', run_embedding),
+    ('rendering', run_rendering),
+]
+
+
+def count_items(output):
+    if isinstance(output, tuple):
+        output = output[0]
+
+    try:
+        return len(output)
+    except TypeError:
+        return output.shape[0]
+
+
+def benchmark_stages(num_apps=20000, seed=0, measure_memory=True, num_repeats=3, verbose=True):
+    # Each stage is given the outputs of the previous stages, in a context dict, and returns the function to measure.
+    # The time of a stage is the best of num_repeats runs, which is much less noisy than a single run.
+
+    results = {
+        'num_apps': num_apps,
+        'seed': seed,
+        'python': platform.python_version(),
+        'num_cpus': os.cpu_count(),
+        'num_repeats': num_repeats,
+        'stages': {},
+    }
+
+    current_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        os.chdir(temp_dir)
+        try:
+            generate_synthetic_corpus(num_apps=num_apps, seed=seed, today=CORPUS_DATE, verbose=False)
+
+            context = {'num_apps': num_apps}
+            for stage_name, get_stage_function in STAGES:
+                stage_function = get_stage_function(context)
+                output, duration, peak_memory = measure(stage_function, measure_memory)
+                for _ in range(num_repeats - 1):
+                    start = time.perf_counter()
+                    stage_function()
+                    duration = min(duration, time.perf_counter() - start)
+                context[stage_name] = output
+
+                results['stages'][stage_name] = {
+                    'time_s': duration,
+                    'peak_memory_mb': peak_memory / 2**20,
+                    'num_items': count_items(output),
+                }
+
+                if verbose:
+                    print(
+                        '{:<24}{:>10.3f} s{:>10.1f} MB{:>10} items'.format(
+                            stage_name,
+                            duration,
+                            peak_memory / 2**20,
+                            count_items(output),
+                        ),
+                    )
+        finally:
+            os.chdir(current_dir)
+
+    return results
+
+
+def compare_to_baseline(results, baseline, threshold=1.5, min_duration=0.05, min_memory_mb=1.0):
+    # Output: the list of regressions, i.e. (stage, metric, baseline value, new value).
+    # Very short stages, and very small allocations, are ignored, because they are dominated by noise.
+
+    regressions = []
+
+    if results['num_apps'] != baseline['num_apps']:
+        print(
+            'Caveat: the baseline was measured with {} apps, instead of {}.'.format(
+                baseline['num_apps'],
+                results['num_apps'],
+            ),
+        )
+
+    for stage_name, result in results['stages'].items():
+        if stage_name not in baseline['stages']:
+            continue
+        baseline_result = baseline['stages'][stage_name]
+
+        for metric, minimum_value in [('time_s', min_duration), ('peak_memory_mb', min_memory_mb)]:
+            value = result[metric]
+            baseline_value = baseline_result[metric]
+
+            # NaN values, i.e. memory which was not measured, never compare as regressions.
+            if value > minimum_value and value > threshold * baseline_value:
+                regressions.append((stage_name, metric, baseline_value, value))
+
+    return regressions
+
+
+def save_results(results, filename):
+    with open(filename, 'w', encoding='utf8') as f:
+        json.dump(results, f, indent=2)
+
+    return True
+
+
+def load_results(filename):
+    with open(filename, encoding='utf8') as f:
+        results = json.load(f)
+
+    return results
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Benchmark each stage of the pipeline on a synthetic corpus.')
+    parser.add_argument('--num-apps', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--results-filename', default='benchmark_results.json')
+    parser.add_argument('--baseline-filename', default=get_baseline_filename())
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the new baseline')
+    parser.add_argument(
+        '--threshold',
+        type=float,
+        default=1.5,
+        help='a stage regresses if its time or peak memory exceeds the baseline by this factor',
+    )
+    parser.add_argument('--no-memory', action='store_true', help='skip the second run of each stage with tracemalloc')
+    parser.add_argument('--num-repeats', type=int, default=3, help='the time of a stage is the best of these runs')
+
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+
+    results = benchmark_stages(
+        num_apps=args.num_apps,
+        seed=args.seed,
+        measure_memory=not args.no_memory,
+        num_repeats=args.num_repeats,
+    )
+    save_results(results, args.results_filename)
+
+    if args.save_baseline:
+        save_results(results, args.baseline_filename)
+        return []
+
+    try:
+        baseline = load_results(args.baseline_filename)
+    except FileNotFoundError:
+        print('No baseline found: run again with --save-baseline to store one.')
+        return []
+
+    regressions = compare_to_baseline(results, baseline, threshold=args.threshold)
+
+    for stage_name, metric, baseline_value, value in regressions:
+        print('Regression for {} ({}): {:.3f} -> {:.3f}'.format(stage_name, metric, baseline_value, value))
+
+    return regressions
+
+
+if __name__ == '__main__':
+    sys.exit(1 if main() else 0)
@@ -0,0 +1,46 @@
+# Objective: measure the start-up time of each subcommand of cli.py, i.e. the time to import its subsystem
+
+import statistics
+import subprocess
+import sys
+import time
+
+from cli import SUBSYSTEMS
+
+
+def time_python_snippet(snippet, num_repetitions=5):
+    durations = []
+
+    for _ in range(num_repetitions):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', snippet], check=True)
+        durations.append(time.perf_counter() - start)
+
+    return statistics.median(durations)
+
+
+def benchmark_startup(num_repetitions=5, verbose=True):
+    # The bare interpreter start-up is measured first, and subtracted from every other measure.
+    interpreter_duration = time_python_snippet('pass', num_repetitions)
+
+    results = {}
+
+    cli_duration = time_python_snippet('import cli', num_repetitions)
+    results['cli'] = cli_duration - interpreter_duration
+
+    for subcommand in SUBSYSTEMS:
+        snippet = 'import cli; cli.load_subsystem({!r})'.format(subcommand)
+        duration = time_python_snippet(snippet, num_repetitions)
+        results[subcommand] = duration - interpreter_duration
+
+    if verbose:
+        print('Interpreter start-up: {:.0f} ms'.format(1000 * interpreter_duration))
+        print('{:<16}{:>12}'.format('subcommand', 'import (ms)'))
+        for subcommand, duration in results.items():
+            print('{:<16}{:>12.0f}'.format(subcommand, 1000 * duration))
+
+    return results
+
+
+if __name__ == '__main__':
+    benchmark_startup()
@@ -0,0 +1,275 @@
+# Objective: create a map of Steam games, i.e. one point per game instead of one point per tag.
+#
+# Each game is a sparse vector of categories and genres, optionally with a few numeric features. UMAP works on the
+# sparse vectors with the cosine metric, and with approximate nearest neighbors, so that no dense matrix is ever built.
+# The memory footprint is bounded by fitting UMAP on a subsample of games, then placing the other games by chunks.
+# The map is rendered as a single raster image, built from 2D histograms, instead of one artist per game.
+
+import numpy as np
+import scipy.sparse
+
+from analyze_steam_database import get_steam_database
+from build_tag_map import preprocess_data
+
+NUMERIC_FEATURES = ['price_overview', 'metacritic', 'recommendations', 'achievements']
+
+
+def get_numeric_feature_matrix(steam_database, numeric_features):
+    columns = []
+
+    for feature in numeric_features:
+        values = np.array(
+            [np.nan if game[feature] is None else float(game[feature]) for game in steam_database.values()],
+            dtype=np.float64,
+        )
+
+        # Counts and prices are heavy-tailed, hence the log scale. Missing values are replaced with the median.
+        values = np.log1p(np.maximum(values, 0))
+        is_missing = np.isnan(values)
+        values[is_missing] = 0 if is_missing.all() else np.median(values[~is_missing])
+
+        standard_deviation = np.std(values)
+        values = (values - np.mean(values)) / (standard_deviation if standard_deviation > 0 else 1)
+
+        columns.append(values)
+
+    return np.column_stack(columns).astype(np.float32)
+
+
+def build_game_feature_matrix(
+    steam_database,
+    categories_dict,
+    genres_dict,
+    numeric_features=None,
+    numeric_weight=0.5,
+):
+    # Output: a sparse matrix with one row per game, and one column per tag, followed by one column per numeric feature
+
+    tag_joint_game_matrix, tags_list = preprocess_data(steam_database, categories_dict, genres_dict)
+
+    features = scipy.sparse.csr_matrix(tag_joint_game_matrix.T, dtype=np.float32)
+    feature_names = list(tags_list)
+
+    if numeric_features:
+        numeric_matrix = numeric_weight * get_numeric_feature_matrix(steam_database, numeric_features)
+        features = scipy.sparse.hstack(
+            [features, scipy.sparse.csr_matrix(numeric_matrix)],
+            format='csr',
+            dtype=np.float32,
+        )
+        feature_names += list(numeric_features)
+
+    return features, feature_names
+
+
+def get_primary_genres(steam_database, genres_dict):
+    # Output: the index of the first known genre of each game, or -1, and the list of genre names
+
+    genre_names = sorted(set(genres_dict.values()))
+    genre_to_index = {int(i): genre_names.index(genre) for i, genre in genres_dict.items()}
+
+    primary_genres = np.full(len(steam_database), -1, dtype=np.int64)
+    for game_counter, app_id in enumerate(steam_database):
+        for i in steam_database[app_id]['genres']:
+            if int(i) in genre_to_index:
+                primary_genres[game_counter] = genre_to_index[int(i)]
+                break
+
+    return primary_genres, genre_names
+
+
+def compute_game_embedding(
+    features,
+    embedding_name='u-MAP',
+    max_fit_games=50000,
+    chunk_size=10000,
+    n_neighbors=15,
+    seed=0,
+):
+    # Output: an array of shape (num_games, 2)
+
+    num_games = features.shape[0]
+
+    if embedding_name == 'SVD':
+        # Quick preview: a linear projection, in one pass over the sparse matrix
+        from sklearn.decomposition import TruncatedSVD
+
+        return TruncatedSVD(n_components=2, random_state=seed).fit_transform(features).astype(np.float32)
+
+    import umap
+
+    rng = np.random.default_rng(seed)
+    if num_games > max_fit_games:
+        fit_indices = np.sort(rng.choice(num_games, size=max_fit_games, replace=False))
+    else:
+        fit_indices = np.arange(num_games)
+
+    reducer = umap.UMAP(
+        n_neighbors=n_neighbors,
+        min_dist=0.1,
+        metric='cosine',
+        low_memory=True,
+        random_state=seed,
+        verbose=True,
+    )
+
+    embedding = np.zeros((num_games, 2), dtype=np.float32)
+    embedding[fit_indices] = reducer.fit_transform(features[fit_indices])
+
+    # Games which were left out of the fit are placed next to their nearest neighbors among fitted games.
+    other_indices = np.setdiff1d(np.arange(num_games), fit_indices)
+    for start in range(0, len(other_indices), chunk_size):
+        chunk_indices = other_indices[start:][:chunk_size]
+        embedding[chunk_indices] = reducer.transform(features[chunk_indices])
+
+    return embedding
+
+
+def get_raster_extent(embedding, margin_percentile=0.5):
+    # Ignore a few outliers, so that they do not squeeze the rest of the map into a corner.
+    x_min, x_max = np.percentile(embedding[:, 0], [margin_percentile, 100 - margin_percentile])
+    y_min, y_max = np.percentile(embedding[:, 1], [margin_percentile, 100 - margin_percentile])
+
+    if x_max <= x_min:
+        x_max = x_min + 1
+    if y_max <= y_min:
+        y_max = y_min + 1
+
+    return [float(x_min), float(x_max), float(y_min), float(y_max)]
+
+
+def rasterize_embedding(embedding, categories=None, num_categories=None, bins=512):
+    # Output: the number of games per pixel, and the most frequent categorie per pixel, or -1 for empty pixels.
+    # The memory footprint depends on the number of pixels and categories, not on the number of games.
+
+    extent = get_raster_extent(embedding)
+    x_min, x_max, y_min, y_max = extent
+
+    density, _, _ = np.histogram2d(
+        embedding[:, 0],
+        embedding[:, 1],
+        bins=bins,
+        range=[[x_min, x_max], [y_min, y_max]],
+    )
+
+    raster = {
+        'density': density,
+        'extent': extent,
+    }
+
+    if categories is not None:
+        categories = np.asarray(categories, dtype=np.int64)
+        if num_categories is None:
+            num_categories = int(categories.max(initial=-1)) + 1
+
+        # Same pixels as np.histogram2d(), except that points outside of the extent are clipped to the border.
+        x_bins = np.clip(((embedding[:, 0] - x_min) / (x_max - x_min) * bins).astype(np.int64), 0, bins - 1)
+        y_bins = np.clip(((embedding[:, 1] - y_min) / (y_max - y_min) * bins).astype(np.int64), 0, bins - 1)
+
+        has_categorie = categories >= 0
+        flat_indices = (x_bins * bins + y_bins)[has_categorie] * num_categories + categories[has_categorie]
+
+        counts = np.bincount(flat_indices, minlength=bins * bins * max(num_categories, 1))
+        counts = counts.reshape(bins, bins, max(num_categories, 1))
+
+        dominant_categories = np.argmax(counts, axis=2)
+        dominant_categories[counts.sum(axis=2) == 0] = -1
+
+        raster['dominant_categories'] = dominant_categories
+
+    return raster
+
+
+def plot_game_map(raster, base_plot_filename=None, title=None, category_names=None, max_legend_entries=12):
+    from matplotlib import colormaps
+    from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
+    from matplotlib.figure import Figure
+    from matplotlib.patches import Patch
+
+    fig = Figure(dpi=300)
+    FigureCanvas(fig)
+    ax = fig.add_subplot(111)
+
+    # np.histogram2d() puts x along the first axis, whereas imshow() expects rows along y.
+    log_density = np.log1p(raster['density']).T
+    opacity = log_density / max(log_density.max(), 1e-12)
+
+    if 'dominant_categories' in raster:
+        dominant_categories = raster['dominant_categories'].T
+        colormap = colormaps['tab20']
+
+        image = colormap(np.mod(dominant_categories, colormap.N))
+        image[..., 3] = opacity
+        image[dominant_categories < 0, 3] = 0
+
+        ax.imshow(image, origin='lower', extent=raster['extent'], aspect='auto', interpolation='nearest')
+
+        if category_names is not None:
+            pixel_counts = np.bincount(dominant_categories[dominant_categories >= 0], minlength=len(category_names))
+            legend_entries = [i for i in np.argsort(-pixel_counts)[:max_legend_entries] if pixel_counts[i] > 0]
+            ax.legend(
+                handles=[Patch(color=colormap(i % colormap.N), label=category_names[i]) for i in legend_entries],
+                loc='center left',
+                bbox_to_anchor=(1, 0.5),
+                fontsize='xx-small',
+            )
+    else:
+        ax.imshow(
+            log_density,
+            origin='lower',
+            extent=raster['extent'],
+            aspect='auto',
+            interpolation='nearest',
+            cmap='magma',
+        )
+
+    ax.axis('off')
+    if title is not None:
+        ax.set_title(title)
+
+    if base_plot_filename is not None:
+        fig.savefig(base_plot_filename, bbox_inches='tight')
+
+    return
+
+
+def main(method_name='u-MAP', max_fit_games=50000, use_numeric_features=False, bins=512):
+    steam_database, all_categories_dict, all_genres_dict = get_steam_database(
+        verbosity=False,
+    )
+
+    features, _ = build_game_feature_matrix(
+        steam_database,
+        all_categories_dict,
+        all_genres_dict,
+        numeric_features=NUMERIC_FEATURES if use_numeric_features else None,
+    )
+
+    # method_name is either 'u-MAP' or 'SVD'
+    game_embedding = compute_game_embedding(
+        features,
+        embedding_name=method_name,
+        max_fit_games=max_fit_games,
+    )
+
+    primary_genres, genre_names = get_primary_genres(steam_database, all_genres_dict)
+
+    raster = rasterize_embedding(
+        game_embedding,
+        categories=primary_genres,
+        num_categories=len(genre_names),
+        bins=bins,
+    )
+
+    plot_game_map(
+        raster,
+        base_plot_filename='game_map.png',
+        title='{} plot of games, colored by their first genre'.format(method_name),
+        category_names=genre_names,
+    )
+
+    return True
+
+
+if __name__ == '__main__':
+    main()
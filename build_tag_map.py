@@ -1,23 +1,27 @@
 # Objective: create a map of Steam tags
 # Reference: https://github.com/woctezuma/steam-tag-mapping/blob/master/map_tags.py
 
-import numpy as np
-import umap
+import hashlib
 
-# Reference: https://stackoverflow.com/a/3054314
-from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
-from matplotlib.figure import Figure
-from sklearn.manifold import TSNE
+import numpy as np
+import scipy.sparse
 
 from analyze_steam_database import get_steam_database
+from derived_data_cache import (
+    compute_array_fingerprint,
+    compute_code_fingerprint,
+    load_or_compute_with_key,
+)
+from embedding_cache import load_or_compute_embedding
+from label_placement import place_labels
+from profiling import profile_stage, profiled_entry_point
 
 
 def preprocess_data(steam_database, categories_dict, genres_dict):
     categories = list(categories_dict.values())
     genres = list(genres_dict.values())
 
-    tags = categories
-    tags.extend(genres)
+    tags = categories + genres
 
     num_games = len(steam_database.keys())
     print("#games = %d" % num_games)
@@ -29,31 +33,40 @@ def preprocess_data(steam_database, categories_dict, genres_dict):
     tags_list = list(tags)
     tags_list.sort()
 
-    tag_joint_game_matrix = np.zeros([num_tags, num_games])
-
-    game_counter = 0
-
-    for appid in steam_database:
-        categories = [
-            categories_dict[str(i)]
-            for i in steam_database[appid]['categories']
-            if str(i) in categories_dict
-        ]
-        genres = [
-            genres_dict[str(i)]
-            for i in steam_database[appid]['genres']
-            if str(i) in genres_dict
-        ]
-
-        current_tags = categories
-        current_tags.extend(genres)
-
-        for tag in current_tags:
-            i = tags_list.index(tag)
-            j = game_counter
-            tag_joint_game_matrix[i][j] += 1
-
-        game_counter += 1
+    # Precompute the row of each tag, and then the row of each categorie ID and genre ID, so that each occurrence of a
+    # tag is a dictionary lookup, instead of a linear scan of tags_list. If a tag is listed twice, its first row is used.
+    tag_to_row = {}
+    for row, tag in enumerate(tags_list):
+        tag_to_row.setdefault(tag, row)
+
+    categorie_to_row = {int(i): tag_to_row[tag] for i, tag in categories_dict.items()}
+    genre_to_row = {int(i): tag_to_row[tag] for i, tag in genres_dict.items()}
+
+    row_indices = []
+    column_indices = []
+
+    for game_counter, appid in enumerate(steam_database):
+        for i in steam_database[appid]['categories']:
+            row = categorie_to_row.get(i)
+            if row is not None:
+                row_indices.append(row)
+                column_indices.append(game_counter)
+
+        for i in steam_database[appid]['genres']:
+            row = genre_to_row.get(i)
+            if row is not None:
+                row_indices.append(row)
+                column_indices.append(game_counter)
+
+    # Duplicate entries are summed, as if the matrix was incremented for each occurrence.
+    tag_joint_game_matrix = scipy.sparse.csr_matrix(
+        (
+            np.ones(len(row_indices), dtype=np.uint8),
+            (np.array(row_indices, dtype=np.int32), np.array(column_indices, dtype=np.int32)),
+        ),
+        shape=(num_tags, num_games),
+        dtype=np.uint8,
+    )
 
     return tag_joint_game_matrix, tags_list
 
@@ -67,10 +80,19 @@ def plot_embedding(
     title=None,
     highlighted_tags=None,
     delta_font=0.003,
+    hide_colliding_labels=None,
 ):
+    # Reference: https://stackoverflow.com/a/3054314
+    from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
+    from matplotlib.figure import Figure
+
     if highlighted_tags is None:
         highlighted_tags = []
 
+    if hide_colliding_labels is None:
+        # A few hundred labels can all be drawn. Beyond that, labels which would overlap others are hidden.
+        hide_colliding_labels = len(str_list) > 500
+
     # Code copied from: plot_embedding() in https://github.com/woctezuma/steam-tag-mapping/blob/master/map_tags.py
     x_min, x_max = np.min(X, 0), np.max(X, 0)
     # noinspection PyPep8Naming
@@ -88,39 +110,31 @@ def plot_embedding(
     # References:
     # * https://stackoverflow.com/a/40729950/
     # * http://scikit-learn.org/stable/auto_examples/applications/plot_stock_market.html
-    for index, (label, x, y) in enumerate(zip(str_list, X[:, 0], X[:, 1])):
-        dx = x - X[:, 0]
-        dx[index] = 1
-        dy = y - X[:, 1]
-        dy[index] = 1
-        this_dx = dx[np.argmin(np.abs(dy))]
-        this_dy = dy[np.argmin(np.abs(dx))]
-        if this_dx > 0:
-            horizontalalignment = 'left'
-            x = x + delta_font
-        else:
-            horizontalalignment = 'right'
-            x = x - delta_font
-        if this_dy > 0:
-            verticalalignment = 'bottom'
-            y = y + delta_font
-        else:
-            verticalalignment = 'top'
-            y = y - delta_font
+    placement = place_labels(
+        X,
+        str_list,
+        delta=delta_font,
+        priorities=[label in highlighted_tags for label in str_list],
+        hide_colliding_labels=hide_colliding_labels,
+    )
 
-        my_color = "red" if label in highlighted_tags else "black"
+    my_font_size = "xx-small"
+    my_weight = 'normal'
+    my_stretch = "condensed"
 
-        my_font_size = "xx-small"
-        my_weight = 'normal'
-        my_stretch = "condensed"
+    for index, label in enumerate(str_list):
+        if not placement['is_visible'][index]:
+            continue
+
+        my_color = "red" if label in highlighted_tags else "black"
 
         ax.text(
-            x,
-            y,
+            placement['x'][index],
+            placement['y'][index],
             label,
             color=my_color,
-            horizontalalignment=horizontalalignment,
-            verticalalignment=verticalalignment,
+            horizontalalignment=placement['horizontal_alignments'][index],
+            verticalalignment=placement['vertical_alignments'][index],
             fontdict={
                 'family': 'serif',
                 'weight': my_weight,
@@ -165,41 +179,173 @@ def display_tag_map(
     return
 
 
-def compute_tag_map(tag_joint_game_matrix, embedding_name='t-SNE'):
+def compute_tag_correlation_distances(tag_joint_game_matrix):
+    # Objective: compute the correlation distance between every pair of tags, i.e. rows, with one sparse matrix product.
+    # This is the same as scipy.spatial.distance.pdist(X, metric='correlation'), without densifying X.
+
+    x = scipy.sparse.csr_matrix(tag_joint_game_matrix, dtype=np.float64)
+    num_games = x.shape[1]
+
+    co_occurrence = (x @ x.T).toarray()
+    means = np.asarray(x.sum(axis=1)).ravel() / num_games
+
+    covariance = co_occurrence / num_games - np.outer(means, means)
+    standard_deviations = np.sqrt(np.maximum(np.diag(covariance), 0))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        correlation = covariance / np.outer(standard_deviations, standard_deviations)
+
+    # A tag which no game has, or which every game has, is not correlated with any other tag.
+    correlation[~np.isfinite(correlation)] = 0
+
+    distances = np.clip(1 - correlation, 0, 2)
+    distances = (distances + distances.T) / 2
+    np.fill_diagonal(distances, 0)
+
+    return distances
+
+
+def get_tag_correlation_distances(tag_joint_game_matrix, use_cache=True):
+    x = scipy.sparse.csr_matrix(tag_joint_game_matrix)
+
+    if not use_cache:
+        return compute_tag_correlation_distances(x)
+
+    # The cache key is based on the content of the sparse matrix, and on the code which computes the distances.
+    cache_key = hashlib.sha256(
+        (
+            compute_array_fingerprint([x.indptr, x.indices, x.data, np.array(x.shape)])
+            + compute_code_fingerprint([compute_tag_correlation_distances])
+        ).encode('utf8'),
+    ).hexdigest()[:16]
+
+    distances = load_or_compute_with_key(
+        'tag_correlation_distances',
+        cache_key,
+        lambda: compute_tag_correlation_distances(x),
+    )
+
+    return distances
+
+
+def compute_classical_scaling(distances, n_components=2):
+    # Objective: initialize t-SNE, as with init='pca', which scikit-learn does not allow with precomputed distances.
+    # Classical multidimensional scaling of the distances is the same as a PCA of the points.
+    # Reference: https://en.wikipedia.org/wiki/Multidimensional_scaling#Classical_multidimensional_scaling
+
+    num_points = distances.shape[0]
+    centering = np.eye(num_points) - np.ones((num_points, num_points)) / num_points
+    gram_matrix = -0.5 * centering @ (distances**2) @ centering
+
+    eigenvalues, eigenvectors = np.linalg.eigh(gram_matrix)
+    top_indices = np.argsort(eigenvalues)[::-1][:n_components]
+
+    embedding = eigenvectors[:, top_indices] * np.sqrt(
+        np.maximum(eigenvalues[top_indices], 0),
+    )
+
+    # Same scaling as scikit-learn for its PCA initialization
+    embedding = embedding / np.std(embedding[:, 0]) * 1e-4
+
+    return embedding.astype(np.float32)
+
+
+def fit_embedding(distances, embedding_name='t-SNE', init=None, verbose=True):
+    if embedding_name == 'PCA':
+        # Quick preview: the classical scaling used to initialize t-SNE, i.e. a linear projection, without optimization
+        return compute_classical_scaling(distances)
+
+    # Import the embedding backends lazily: umap pulls in numba and pynndescent, which are slow to load.
     if embedding_name == 't-SNE':
-        embedding = TSNE(
-            n_components=2,
-            random_state=0,
-            verbose=2,
-            init='pca',
-            metric='correlation',
-        )
+        from sklearn.manifold import TSNE
+
+        if init is None:
+            embedding = TSNE(
+                n_components=2,
+                random_state=0,
+                verbose=2 if verbose else 0,
+                init=compute_classical_scaling(distances),
+                metric='precomputed',
+            )
+        else:
+            # Warm start: the layout is already spread out, so early exaggeration is skipped, and few iterations
+            # are needed. scikit-learn requires at least 250 iterations.
+            embedding = TSNE(
+                n_components=2,
+                random_state=0,
+                verbose=2 if verbose else 0,
+                init=init,
+                metric='precomputed',
+                early_exaggeration=1.0,
+                max_iter=300,
+            )
     else:
+        import umap
+
         embedding = umap.UMAP(
             n_neighbors=20,
             min_dist=0.15,
-            metric='correlation',
-            verbose=True,
+            metric='precomputed',
+            verbose=verbose,
+            init='spectral' if init is None else init,
+            n_epochs=None if init is None else 100,
         )
 
-    embedded_data = embedding.fit_transform(tag_joint_game_matrix)
+    embedded_data = embedding.fit_transform(distances)
 
     return embedded_data
 
 
-def main():
-    steamspy_database, all_categories_dict, all_genres_dict = get_steam_database(
-        verbosity=False,
+def compute_tag_map(tag_joint_game_matrix, embedding_name='t-SNE', tags_list=None, use_cache=True):
+    # The embedding works on the matrix of distances between tags, so that its cost depends on the number of tags,
+    # and not on the number of games.
+    distances = get_tag_correlation_distances(tag_joint_game_matrix, use_cache=use_cache)
+
+    if tags_list is None:
+        tags_list = list(range(distances.shape[0]))
+
+    # The layout is re-used if nothing has changed, and warm-started from the previous layout if little has changed.
+    parameters = {
+        'embedding_name': embedding_name,
+        'code': compute_code_fingerprint([fit_embedding, compute_classical_scaling]),
+    }
+
+    embedded_data, _ = load_or_compute_embedding(
+        'tag_map_' + embedding_name,
+        distances,
+        tags_list,
+        parameters,
+        lambda init: fit_embedding(distances, embedding_name, init),
+        use_cache=use_cache,
+        verbose=True,
     )
 
-    joint_matrix, tags_list_sorted = preprocess_data(
-        steamspy_database,
-        all_categories_dict,
-        all_genres_dict,
-    )
+    return embedded_data
 
-    method_name = 't-SNE'  # Either 't-SNE' or 'u-MAP'
-    tag_embedding = compute_tag_map(joint_matrix, embedding_name=method_name)
+
+@profiled_entry_point('tag_map')
+def main(method_name='t-SNE'):
+    with profile_stage('load_database') as stage:
+        steamspy_database, all_categories_dict, all_genres_dict = get_steam_database(
+            verbosity=False,
+        )
+        stage['num_items'] = len(steamspy_database)
+
+    with profile_stage('tag_matrix') as stage:
+        joint_matrix, tags_list_sorted = preprocess_data(
+            steamspy_database,
+            all_categories_dict,
+            all_genres_dict,
+        )
+        stage['num_items'] = len(tags_list_sorted)
+
+    # method_name is either 't-SNE', 'u-MAP', or 'PCA' for a quick preview
+    with profile_stage('embedding', num_items=len(tags_list_sorted)):
+        tag_embedding = compute_tag_map(
+            joint_matrix,
+            embedding_name=method_name,
+            tags_list=tags_list_sorted,
+        )
 
     plot_filename = 'tag_map.png'
     plot_title = '{} plot of categories (in black) and genres (in red)'.format(
@@ -207,13 +353,14 @@ def main():
     )
     red_tags = list(all_genres_dict.values())
 
-    display_tag_map(
-        tag_embedding,
-        tags_list_sorted,
-        plot_filename,
-        plot_title,
-        red_tags,
-    )
+    with profile_stage('render', num_items=len(tags_list_sorted)):
+        display_tag_map(
+            tag_embedding,
+            tags_list_sorted,
+            plot_filename,
+            plot_title,
+            red_tags,
+        )
 
     return True
 
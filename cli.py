@@ -0,0 +1,356 @@
+# Objective: one entry point for every step of the pipeline, which only imports the subsystem of the chosen subcommand
+
+import argparse
+import importlib
+
+SUBSYSTEMS = {
+    'catalog': 'steam_catalog_utils',
+    'scrape': 'steam_spy',
+    'prices': 'steam_prices',
+    'aggregate': 'aggregate_steam_spy',
+    'aggregate-text': 'aggregate_game_text_descriptions',
+    'analyze': 'analyze_steam_database',
+    'tag-map': 'build_tag_map',
+    'game-map': 'build_game_map',
+    'query': 'steam_query',
+    'similar': 'similar_games',
+    'entities': 'publisher_analytics',
+    'profile-corpus': 'profile_corpus',
+    'synthetic-corpus': 'generate_synthetic_corpus',
+}
+
+
+def load_subsystem(subcommand):
+    # Import the module lazily, so that the start-up time only depends on the chosen subcommand
+    return importlib.import_module(SUBSYSTEMS[subcommand])
+
+
+def run_catalog(args):
+    return load_subsystem('catalog').main()
+
+
+def run_scrape(args):
+    load_subsystem('scrape').scrape_steam_data(
+        import_my_own_steam_catalog=not args.use_steamspy_catalog,
+        try_again_faulty_app_ids=args.try_again_faulty_app_ids,
+        allow_to_overwrite_existing_app_details=args.overwrite,
+        focus_on_probable_games=not args.all_app_ids,
+        request_profile=args.request_profile,
+    )
+    return True
+
+
+def run_aggregate(args):
+    return load_subsystem('aggregate').main(verbose=not args.quiet, text_output_filename=args.with_text)
+
+
+def run_aggregate_text(args):
+    load_subsystem('aggregate-text').aggregate_game_descriptions_from_steam_data(
+        output_filename=args.output,
+        verbose=not args.quiet,
+    )
+    return True
+
+
+def run_analyze(args):
+    return load_subsystem('analyze').main(
+        num_workers=args.num_workers,
+        bootstrap_num_resamples=args.bootstrap_num_resamples,
+        compute_only=args.compute_only,
+        incremental=args.incremental,
+        use_monthly_sketches=args.use_monthly_sketches,
+        use_compact_records=args.compact_records,
+    )
+
+
+def run_tag_map(args):
+    return load_subsystem('tag-map').main(method_name=args.method)
+
+
+def run_game_map(args):
+    return load_subsystem('game-map').main(
+        method_name=args.method,
+        max_fit_games=args.max_fit_games,
+        use_numeric_features=args.numeric_features,
+        bins=args.bins,
+    )
+
+
+def run_query(args):
+    load_subsystem('query').main(args)
+    return True
+
+
+def run_similar(args):
+    load_subsystem('similar').main(args)
+    return True
+
+
+def run_prices(args):
+    load_subsystem('prices').main(args)
+    return True
+
+
+def run_entities(args):
+    load_subsystem('entities').main(args)
+    return True
+
+
+def run_profile_corpus(args):
+    load_subsystem('profile-corpus').main(args)
+    return True
+
+
+def run_synthetic_corpus(args):
+    load_subsystem('synthetic-corpus').main(args)
+    return True
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Download, aggregate and analyze data from the Steam store.',
+    )
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='time each stage of the subcommand, and save a run report in the profiles folder',
+    )
+    parser.add_argument('--profile-memory', action='store_true', help='also trace the peak memory of each stage')
+    parser.add_argument('--cprofile', action='store_true', help='also save a cProfile dump of the whole run')
+    subparsers = parser.add_subparsers(dest='subcommand', required=True)
+
+    subparser = subparsers.add_parser('catalog', help='download the list of Steam appIDs')
+    subparser.set_defaults(func=run_catalog)
+
+    subparser = subparsers.add_parser('scrape', help='download app details')
+    subparser.add_argument(
+        '--use-steamspy-catalog',
+        action='store_true',
+        help='use the SteamSpy catalog instead of the home-made Steam catalog',
+    )
+    subparser.add_argument(
+        '--try-again-faulty-app-ids',
+        action='store_true',
+        help='query again appIDs which previously failed',
+    )
+    subparser.add_argument(
+        '--overwrite',
+        action='store_true',
+        help='download app details even if they are already stored',
+    )
+    subparser.add_argument(
+        '--all-app-ids',
+        action='store_true',
+        help='do not focus on appIDs ending with a zero',
+    )
+    subparser.add_argument(
+        '--request-profile',
+        choices=['full', 'refresh'],
+        default='full',
+        help='with refresh, only download release state, recommendations, achievements, price and Metacritic score of '
+        'previously seen games, and merge them into the stored app details',
+    )
+    subparser.set_defaults(func=run_scrape)
+
+    subparser = subparsers.add_parser('aggregate', help='aggregate app details into steamspy.json')
+    subparser.add_argument('--quiet', action='store_true')
+    subparser.add_argument(
+        '--with-text',
+        nargs='?',
+        const='aggregate.json',
+        default=None,
+        help='also aggregate store descriptions into this file, in the same pass over app details',
+    )
+    subparser.set_defaults(func=run_aggregate)
+
+    subparser = subparsers.add_parser(
+        'aggregate-text',
+        help='aggregate English store descriptions into aggregate.json',
+    )
+    subparser.add_argument('--output', default='aggregate.json')
+    subparser.add_argument('--quiet', action='store_true')
+    subparser.set_defaults(func=run_aggregate_text)
+
+    subparser = subparsers.add_parser('analyze', help='plot time series of store attributes')
+    subparser.add_argument(
+        '--num-workers',
+        type=int,
+        default=None,
+        help='number of processes used to render figures (default: number of cores)',
+    )
+    subparser.add_argument(
+        '--bootstrap-num-resamples',
+        type=int,
+        default=None,
+        help='number of bootstrap resamples for confidence intervals of medians (default: none)',
+    )
+    subparser.add_argument(
+        '--compute-only',
+        action='store_true',
+        help='export time series to exports/ as CSV, JSON and NPZ files, without rendering any figure',
+    )
+    subparser.add_argument(
+        '--incremental',
+        action='store_true',
+        help='only render figures whose data or styling changed since the last run',
+    )
+    subparser.add_argument(
+        '--use-monthly-sketches',
+        action='store_true',
+        help='read monthly medians from the quantile sketches updated by the aggregate subcommand',
+    )
+    subparser.add_argument(
+        '--compact-records',
+        action='store_true',
+        help='hold games as compact records, which use a fraction of the memory of dicts',
+    )
+    subparser.set_defaults(func=run_analyze)
+
+    subparser = subparsers.add_parser('tag-map', help='embed categories and genres in 2D')
+    subparser.add_argument('--method', choices=['t-SNE', 'u-MAP', 'PCA'], default='t-SNE')
+    subparser.set_defaults(func=run_tag_map)
+
+    subparser = subparsers.add_parser('game-map', help='embed games in 2D, and render them as a density raster')
+    subparser.add_argument('--method', choices=['u-MAP', 'SVD'], default='u-MAP')
+    subparser.add_argument(
+        '--max-fit-games',
+        type=int,
+        default=50000,
+        help='number of games used to fit UMAP, which bounds memory usage; other games are placed afterwards',
+    )
+    subparser.add_argument(
+        '--numeric-features',
+        action='store_true',
+        help='append price, Metacritic score, recommendations and achievements to categories and genres',
+    )
+    subparser.add_argument('--bins', type=int, default=512, help='resolution of the raster image')
+    subparser.set_defaults(func=run_game_map)
+
+    subparser = subparsers.add_parser(
+        'query',
+        help='list games matching every filter',
+        description='Example: query --flag is_free --flag linux_support --flag controller_support '
+        '--since 2016-01-01 --min metacritic=80',
+    )
+    subparser.add_argument(
+        '--flag',
+        action='append',
+        default=[],
+        help='boolean attribute which must be true, e.g. is_free, linux_support, controller_support',
+    )
+    subparser.add_argument(
+        '--no-flag',
+        action='append',
+        default=[],
+        help='boolean attribute which must be false',
+    )
+    subparser.add_argument('--categorie', action='append', type=int, default=[], help='categorie ID')
+    subparser.add_argument('--genre', action='append', type=int, default=[], help='genre ID')
+    subparser.add_argument(
+        '--min',
+        action='append',
+        default=[],
+        help='inclusive lower bound, e.g. metacritic=80 or price_overview=500 (in cents)',
+    )
+    subparser.add_argument('--max', action='append', default=[], help='inclusive upper bound')
+    subparser.add_argument('--since', help='earliest release date, as YYYY-MM-DD')
+    subparser.add_argument('--until', help='latest release date, as YYYY-MM-DD')
+    subparser.add_argument('--limit', type=int, default=20, help='number of games to print')
+    subparser.set_defaults(func=run_query)
+
+    subparser = subparsers.add_parser(
+        'similar',
+        help='list the games most similar to given games',
+        description='Example: similar 400 "Stardew Valley" --k 5',
+    )
+    subparser.add_argument('queries', nargs='+', help='appID or name of a game')
+    subparser.add_argument('--k', type=int, default=10, help='number of similar games per query')
+    subparser.add_argument(
+        '--use-text',
+        action='store_true',
+        help='add TF-IDF features of the store descriptions, aggregated by the aggregate-text subcommand',
+    )
+    subparser.add_argument('--text-filename', default='aggregate.json')
+    subparser.add_argument(
+        '--approximate',
+        action='store_true',
+        help='use an approximate nearest-neighbor index (pynndescent), for large catalogs',
+    )
+    subparser.set_defaults(func=run_similar)
+
+    subparser = subparsers.add_parser(
+        'prices',
+        help='refresh the prices of every game, with batched requests filtered to price_overview',
+        description='Example: prices --country-code us --country-code fr',
+    )
+    subparser.add_argument(
+        '--country-code',
+        action='append',
+        default=[],
+        help='country code of the store, e.g. us or fr. Repeat for several countries. Default: us',
+    )
+    subparser.add_argument('--batch-size', type=int, default=100, help='number of appIDs per request')
+    subparser.set_defaults(func=run_prices)
+
+    subparser = subparsers.add_parser(
+        'entities',
+        help='rank developers or publishers',
+        description='Example: entities --key publishers --metric releases --since 2018 --top 100',
+    )
+    subparser.add_argument('--key', choices=['developers', 'publishers'], default='publishers')
+    subparser.add_argument(
+        '--metric',
+        choices=['releases', 'num_games', 'recommendations', 'mean_metacritic', 'median_price'],
+        default='releases',
+    )
+    subparser.add_argument('--since', type=int, help='earliest release year, for the number of releases')
+    subparser.add_argument('--until', type=int, help='latest release year, for the number of releases')
+    subparser.add_argument('--top', type=int, default=20, help='number of entities to print')
+    subparser.add_argument('--min-games', type=int, default=1, help='minimum number of games of an entity')
+    subparser.add_argument('--entity', help='print the summary of this developer or publisher instead')
+    subparser.set_defaults(func=run_entities)
+
+    subparser = subparsers.add_parser(
+        'profile-corpus',
+        help='report key coverage, value types and bad files of app details, and quarantine bad files',
+    )
+    subparser.add_argument('--num-workers', type=int, default=None)
+    subparser.add_argument('--chunk-size', type=int, default=500, help='number of files per task of the pool')
+    subparser.add_argument('--report-filename', default=None, help='data/corpus_profile.json by default')
+    subparser.add_argument('--no-quarantine', action='store_true', help='do not update the quarantine list')
+    subparser.set_defaults(func=run_profile_corpus)
+
+    subparser = subparsers.add_parser(
+        'synthetic-corpus',
+        help='write a synthetic corpus of app details, logs and catalog to the data folder, for scale testing',
+    )
+    subparser.add_argument('--num-apps', type=int, default=10000)
+    subparser.add_argument('--seed', type=int, default=0)
+    subparser.add_argument(
+        '--overwrite',
+        action='store_true',
+        help='overwrite the logs of an existing corpus in the data folder',
+    )
+    subparser.set_defaults(func=run_synthetic_corpus)
+
+    return parser
+
+
+def main(argv=None):
+    parser = get_parser()
+    args = parser.parse_args(argv)
+
+    if not (args.profile or args.profile_memory or args.cprofile):
+        return args.func(args)
+
+    import profiling
+
+    profiling.start_run(args.subcommand, trace_memory=args.profile_memory, use_cprofile=args.cprofile)
+    try:
+        return args.func(args)
+    finally:
+        profiling.finish_run()
+
+
+if __name__ == '__main__':
+    main()
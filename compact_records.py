@@ -0,0 +1,295 @@
+# Objective: hold the records of the in-memory steam database compactly, without changing the code which reads them.
+#
+# Each game of steamspy.json is a dict of about 20 keys, with nested dicts for 'platforms' and 'release_date', and
+# the analysis adds a boolean key per categorie and per genre. An AppRecord behaves like this dict, but:
+# - its fields are stored in __slots__, instead of a hash table per game,
+# - boolean values, including the platforms, the release status, and the keys added by the analysis, are packed into
+#   the bits of a single integer,
+# - strings, e.g. names of developers and publishers or release dates, are interned, and lists of developers,
+#   publishers, categories and genres are shared, as tuples, between the games which have the same lists.
+#
+# Nested dicts and lists are rebuilt on access, so changes made to them are not stored. Values which do not fit the
+# compact layout, e.g. a 'platforms' dict with other keys, or unknown keys, are kept as-is in a dict of extra values.
+#
+# Caveat: json.dump() requires plain dicts, e.g. dict(record) or to_plain_steam_database().
+
+import json
+import sys
+from collections.abc import MutableMapping
+
+# Keys of the records written by aggregate_steam_spy.py, in the same order
+BASE_KEYS = [
+    'name',
+    'steam_appid',
+    'required_age',
+    'is_free',
+    'developers',
+    'publishers',
+    'price_overview',
+    'platforms',
+    'metacritic',
+    'categories',
+    'genres',
+    'recommendations',
+    'achievements',
+    'release_date',
+    'dlc',
+    'demos',
+    'controller_support',
+    'drm_notice',
+    'ext_user_account_notice',
+]
+
+SLOT_KEYS = [
+    'name',
+    'steam_appid',
+    'required_age',
+    'developers',
+    'publishers',
+    'price_overview',
+    'metacritic',
+    'categories',
+    'genres',
+    'recommendations',
+    'achievements',
+    'release_date',
+    'dlc',
+    'drm_notice',
+]
+
+LIST_KEYS = ['developers', 'publishers', 'categories', 'genres']
+
+# Sets, for fast membership tests when keys are accessed
+_slot_keys = frozenset(SLOT_KEYS)
+_list_keys = frozenset(LIST_KEYS)
+
+PLATFORMS = ['windows', 'mac', 'linux']
+
+# Bits of the flags which are reserved for the nested dicts
+PLATFORM_BITS = {platform: bit for bit, platform in enumerate(PLATFORMS)}
+IS_RELEASED_BIT = 3
+
+# Bits of boolean keys, which are assigned the first time a key is stored, e.g. by fill_in_categorie()
+_flag_bits = {
+    'is_free': 4,
+    'demos': 5,
+    'controller_support': 6,
+    'ext_user_account_notice': 7,
+}
+
+# Tuples shared between records
+_interned_tuples = {}
+
+# Placeholder for a slot whose key is absent from the record
+_MISSING = object()
+
+
+def get_flag_bit(key):
+    try:
+        bit = _flag_bits[key]
+    except KeyError:
+        bit = max(_flag_bits.values()) + 1
+        _flag_bits[key] = bit
+
+    return bit
+
+
+def intern_value(value):
+    if isinstance(value, str):
+        return sys.intern(value)
+
+    return value
+
+
+def intern_tuple(values):
+    values = tuple(intern_value(value) for value in values)
+
+    return _interned_tuples.setdefault(values, values)
+
+
+def is_packable_platforms(value):
+    return isinstance(value, dict) and list(value) == PLATFORMS and all(type(value[p]) is bool for p in PLATFORMS)
+
+
+def is_packable_release_date(value):
+    return (
+        isinstance(value, dict)
+        and list(value) == ['date', 'is_released']
+        and isinstance(value['date'], str)
+        and type(value['is_released']) is bool
+    )
+
+
+class AppRecord(MutableMapping):
+    __slots__ = SLOT_KEYS + ['_flags', '_present_flags', '_extra']
+
+    def __init__(self, record=None):
+        for key in SLOT_KEYS:
+            setattr(self, key, _MISSING)
+        self._flags = 0
+        self._present_flags = 0
+        self._extra = None
+
+        if record is not None:
+            for key, value in record.items():
+                self._store(key, value)
+
+    def _set_bit(self, bit, value):
+        mask = 1 << bit
+        self._present_flags |= mask
+        if value:
+            self._flags |= mask
+        else:
+            self._flags &= ~mask
+
+    def _get_bit(self, bit):
+        return bool(self._flags >> bit & 1)
+
+    def _has_bit(self, bit):
+        return bool(self._present_flags >> bit & 1)
+
+    def _clear_bit(self, bit):
+        self._present_flags &= ~(1 << bit)
+        self._flags &= ~(1 << bit)
+
+    def _set_extra(self, key, value):
+        if self._extra is None:
+            self._extra = {}
+        self._extra[key] = value
+
+    def _pop_extra(self, key):
+        if self._extra is not None and key in self._extra:
+            del self._extra[key]
+            return True
+
+        return False
+
+    def __setitem__(self, key, value):
+        # Fast path for boolean keys, e.g. the keys added by fill_in_categorie() to every record
+        if type(value) is bool and key in _flag_bits and (self._extra is None or key not in self._extra):
+            self._set_bit(_flag_bits[key], value)
+            return
+
+        # A key is stored in a single place: first, remove any previous value, which may be stored elsewhere.
+        if key in self:
+            del self[key]
+
+        self._store(key, value)
+
+    def _store(self, key, value):
+        if key == 'platforms' and is_packable_platforms(value):
+            for platform in PLATFORMS:
+                self._set_bit(PLATFORM_BITS[platform], value[platform])
+        elif key == 'release_date' and is_packable_release_date(value):
+            self.release_date = sys.intern(value['date'])
+            self._set_bit(IS_RELEASED_BIT, value['is_released'])
+        elif key in _list_keys and isinstance(value, list):
+            setattr(self, key, intern_tuple(value))
+        elif key in _slot_keys and key != 'release_date' and not isinstance(value, (tuple, dict)):
+            setattr(self, key, intern_value(value))
+        elif type(value) is bool and key not in ['platforms', 'release_date']:
+            self._set_bit(get_flag_bit(key), value)
+        else:
+            self._set_extra(key, value)
+
+    def __getitem__(self, key):
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+
+        if key == 'platforms':
+            if self._has_bit(PLATFORM_BITS['windows']):
+                return {platform: self._get_bit(PLATFORM_BITS[platform]) for platform in PLATFORMS}
+        elif key == 'release_date':
+            if self.release_date is not _MISSING:
+                return {'date': self.release_date, 'is_released': self._get_bit(IS_RELEASED_BIT)}
+        elif key in _slot_keys:
+            value = getattr(self, key)
+            if value is not _MISSING:
+                return list(value) if key in _list_keys and isinstance(value, tuple) else value
+        elif key in _flag_bits and self._has_bit(_flag_bits[key]):
+            return self._get_bit(_flag_bits[key])
+
+        raise KeyError(key)
+
+    def __delitem__(self, key):
+        if self._pop_extra(key):
+            return
+
+        if key == 'platforms' and self._has_bit(PLATFORM_BITS['windows']):
+            for platform in PLATFORMS:
+                self._clear_bit(PLATFORM_BITS[platform])
+        elif key in _slot_keys and getattr(self, key) is not _MISSING:
+            setattr(self, key, _MISSING)
+            if key == 'release_date':
+                self._clear_bit(IS_RELEASED_BIT)
+        elif key in _flag_bits and self._has_bit(_flag_bits[key]):
+            self._clear_bit(_flag_bits[key])
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        if self._extra is not None and key in self._extra:
+            return True
+
+        if key == 'platforms':
+            return self._has_bit(PLATFORM_BITS['windows'])
+        if key in _slot_keys:
+            return getattr(self, key) is not _MISSING
+        if key in _flag_bits:
+            return self._has_bit(_flag_bits[key])
+
+        return False
+
+    def __iter__(self):
+        # The keys of steamspy.json come first, in the same order, then the keys added later.
+        for key in BASE_KEYS:
+            if key in self:
+                yield key
+
+        for key in list(_flag_bits):
+            if key not in BASE_KEYS and self._has_bit(_flag_bits[key]):
+                yield key
+
+        if self._extra is not None:
+            for key in list(self._extra):
+                if key not in BASE_KEYS:
+                    yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return 'AppRecord({!r})'.format(dict(self))
+
+    def __reduce__(self):
+        # Records are pickled as plain dicts, because bits of flags are only valid within a process.
+        return AppRecord, (dict(self),)
+
+
+def compact_steam_database(steam_database):
+    compact_database = {}
+
+    for app_id, record in steam_database.items():
+        compact_database[sys.intern(app_id)] = AppRecord(record)
+
+    return compact_database
+
+
+def to_plain_steam_database(steam_database):
+    return {app_id: dict(record) for app_id, record in steam_database.items()}
+
+
+def compact_record_hook(record):
+    # Records are the dicts with a 'steam_appid' key. The other dicts, e.g. 'platforms', are packed by their record.
+    if 'steam_appid' in record:
+        return AppRecord(record)
+
+    return record
+
+
+def load_compact_steam_database(filename):
+    # Records are compacted while the JSON file is parsed, so that the plain database is never fully in memory.
+    with open(filename, encoding='utf8') as f:
+        steam_database = json.load(f, object_hook=compact_record_hook)
+
+    return {sys.intern(app_id): record for app_id, record in steam_database.items()}
@@ -0,0 +1,163 @@
+import hashlib
+import inspect
+import pathlib
+import pickle
+import re
+
+import numpy as np
+import steampi.json_utils
+
+# Bump this number whenever the layout of cached files changes.
+CACHE_FORMAT_VERSION = 1
+
+
+def get_cache_folder():
+    cache_folder = steampi.json_utils.get_data_path() + 'cache/'
+
+    pathlib.Path(cache_folder).mkdir(parents=True, exist_ok=True)
+
+    return cache_folder
+
+
+def compute_file_fingerprint(filenames, chunk_size=2**20):
+    # Objective: hash the content of input files, so that any change to the inputs invalidates the cache
+
+    hasher = hashlib.sha256()
+
+    for filename in filenames:
+        hasher.update(str(filename).encode('utf8'))
+
+        try:
+            with open(filename, 'rb') as f:
+                for chunk in iter(lambda: f.read(chunk_size), b''):
+                    hasher.update(chunk)
+        except FileNotFoundError:
+            hasher.update(b'<missing>')
+
+    return hasher.hexdigest()
+
+
+def compute_code_fingerprint(functions):
+    # Objective: hash the source code of the functions which produce the derived data
+
+    hasher = hashlib.sha256()
+    hasher.update(str(CACHE_FORMAT_VERSION).encode('utf8'))
+
+    for function in functions:
+        hasher.update(inspect.getsource(function).encode('utf8'))
+
+    return hasher.hexdigest()
+
+
+def compute_array_fingerprint(arrays):
+    # Objective: hash in-memory inputs, e.g. the arrays of a sparse matrix, when there is no input file to hash
+
+    hasher = hashlib.sha256()
+
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        hasher.update(str(array.dtype).encode('utf8'))
+        hasher.update(str(array.shape).encode('utf8'))
+        hasher.update(array.tobytes())
+
+    return hasher.hexdigest()
+
+
+def get_cache_key(input_filenames, code_functions=None):
+    if code_functions is None:
+        code_functions = []
+
+    hasher = hashlib.sha256()
+    hasher.update(compute_file_fingerprint(input_filenames).encode('utf8'))
+    hasher.update(compute_code_fingerprint(code_functions).encode('utf8'))
+
+    return hasher.hexdigest()[:16]
+
+
+def get_cache_filename(cache_name, cache_key):
+    cache_filename = get_cache_folder() + cache_name + '_' + cache_key + '.pickle'
+
+    return cache_filename
+
+
+def remove_stale_cache_files(cache_name, cache_key):
+    pattern = re.compile(re.escape(cache_name) + r'_[0-9a-f]{16}\.pickle')
+
+    for cache_file in pathlib.Path(get_cache_folder()).glob(cache_name + '_*.pickle'):
+        if pattern.fullmatch(cache_file.name) and cache_file.name != pathlib.Path(
+            get_cache_filename(cache_name, cache_key),
+        ).name:
+            cache_file.unlink()
+
+    return
+
+
+def load_from_cache(cache_name, cache_key):
+    cache_filename = get_cache_filename(cache_name, cache_key)
+
+    try:
+        with open(cache_filename, 'rb') as f:
+            data = pickle.load(f)
+        is_cache_hit = True
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        data = None
+        is_cache_hit = False
+
+    return data, is_cache_hit
+
+
+def save_to_cache(cache_name, cache_key, data):
+    cache_filename = get_cache_filename(cache_name, cache_key)
+
+    # Write to a temporary file first, so that an interrupted run cannot leave a truncated cache file behind
+    temp_filename = cache_filename + '.tmp'
+    with open(temp_filename, 'wb') as f:
+        pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+    pathlib.Path(temp_filename).replace(cache_filename)
+
+    remove_stale_cache_files(cache_name, cache_key)
+
+    return True
+
+
+def load_or_compute(
+    cache_name,
+    input_filenames,
+    compute_function,
+    code_functions=None,
+    use_cache=True,
+    verbose=False,
+):
+    # Objective: return derived data, computed from input files, which is re-used as long as neither the inputs nor
+    # the code which derives the data have changed.
+
+    if not use_cache:
+        return compute_function()
+
+    if code_functions is None:
+        code_functions = [compute_function]
+
+    cache_key = get_cache_key(input_filenames, code_functions)
+
+    data = load_or_compute_with_key(cache_name, cache_key, compute_function, verbose)
+
+    return data
+
+
+def load_or_compute_with_key(cache_name, cache_key, compute_function, verbose=False):
+    data, is_cache_hit = load_from_cache(cache_name, cache_key)
+
+    if verbose:
+        print(
+            'Cache {} for {} (key = {})'.format(
+                'hit' if is_cache_hit else 'miss',
+                cache_name,
+                cache_key,
+            ),
+        )
+
+    if not is_cache_hit:
+        data = compute_function()
+        save_to_cache(cache_name, cache_key, data)
+
+    return data
@@ -0,0 +1,175 @@
+# Objective: re-use the layout of a map from one run to the next.
+#
+# The latest layout is saved along with the labels and the distances which produced it. If neither the distances nor
+# the parameters have changed, the layout is returned as is. If the distances have changed only slightly, e.g. after a
+# new snapshot of the database, the embedding is warm-started from the previous layout, which takes fewer iterations.
+# In any case, the new layout is rotated to match the previous one, so that consecutive maps can be compared.
+# Reference: https://en.wikipedia.org/wiki/Orthogonal_Procrustes_problem
+
+import hashlib
+import json
+import pathlib
+
+import numpy as np
+from scipy.linalg import orthogonal_procrustes
+
+from derived_data_cache import compute_array_fingerprint, get_cache_folder
+
+
+def get_layout_filename(cache_name):
+    layout_filename = get_cache_folder() + cache_name + '_layout.npz'
+
+    return layout_filename
+
+
+def get_embedding_cache_key(distances, labels, parameters):
+    hasher = hashlib.sha256()
+    hasher.update(compute_array_fingerprint([distances, np.array(labels, dtype=str)]).encode('utf8'))
+    hasher.update(json.dumps(parameters, sort_keys=True).encode('utf8'))
+
+    return hasher.hexdigest()[:16]
+
+
+def load_previous_layout(cache_name):
+    try:
+        with np.load(get_layout_filename(cache_name)) as data:
+            previous_layout = {key: data[key] for key in data.files}
+    except (FileNotFoundError, OSError, ValueError):
+        previous_layout = None
+
+    return previous_layout
+
+
+def save_layout(cache_name, cache_key, distances, labels, embedding):
+    layout_filename = get_layout_filename(cache_name)
+
+    # Write to a temporary file first, so that an interrupted run cannot leave a truncated layout behind
+    temp_filename = layout_filename + '.tmp'
+    with open(temp_filename, 'wb') as f:
+        np.savez(
+            f,
+            cache_key=np.array(cache_key),
+            distances=distances,
+            labels=np.array(labels, dtype=str),
+            embedding=embedding,
+        )
+    pathlib.Path(temp_filename).replace(layout_filename)
+
+    return True
+
+
+def match_labels(previous_labels, labels):
+    # Output: the indices of the labels which are shared by both layouts, in the previous layout and in the new one
+
+    previous_index = {label: i for i, label in enumerate(previous_labels)}
+
+    new_indices = np.array([i for i, label in enumerate(labels) if label in previous_index], dtype=np.int64)
+    previous_indices = np.array([previous_index[labels[i]] for i in new_indices], dtype=np.int64)
+
+    return previous_indices, new_indices
+
+
+def measure_change(previous_layout, distances, labels):
+    # Output: the fraction of labels which are shared with the previous layout, and the mean absolute change of the
+    # distances between shared labels
+
+    previous_indices, new_indices = match_labels(list(previous_layout['labels']), labels)
+
+    overlap = len(new_indices) / max(len(labels), 1)
+
+    if len(new_indices) < 2:
+        return overlap, np.inf
+
+    previous_distances = previous_layout['distances'][np.ix_(previous_indices, previous_indices)]
+    new_distances = distances[np.ix_(new_indices, new_indices)]
+
+    change = float(np.mean(np.abs(new_distances - previous_distances)))
+
+    return overlap, change
+
+
+def get_warm_start_init(previous_layout, distances, labels, num_neighbors=3):
+    # Shared labels start where they were. New labels start at the mean position of their closest shared labels.
+
+    previous_indices, new_indices = match_labels(list(previous_layout['labels']), labels)
+
+    init = np.zeros((len(labels), previous_layout['embedding'].shape[1]), dtype=np.float32)
+    init[new_indices] = previous_layout['embedding'][previous_indices]
+
+    missing_indices = np.setdiff1d(np.arange(len(labels)), new_indices)
+    if len(missing_indices) > 0:
+        closest = np.argsort(distances[np.ix_(missing_indices, new_indices)], axis=1)[:, :num_neighbors]
+        init[missing_indices] = init[new_indices][closest].mean(axis=1)
+
+    return init
+
+
+def align_layout(embedding, previous_layout, labels):
+    # Rotate, or reflect, and translate the new layout, so that shared labels are as close as possible to their
+    # previous positions. The scale is left untouched.
+
+    previous_indices, new_indices = match_labels(list(previous_layout['labels']), labels)
+
+    if len(new_indices) < embedding.shape[1] + 1:
+        return embedding
+
+    source = embedding[new_indices]
+    target = previous_layout['embedding'][previous_indices]
+
+    source_mean = source.mean(axis=0)
+    target_mean = target.mean(axis=0)
+
+    rotation, _ = orthogonal_procrustes(source - source_mean, target - target_mean)
+
+    aligned_embedding = (embedding - source_mean) @ rotation + target_mean
+
+    return aligned_embedding.astype(embedding.dtype)
+
+
+def load_or_compute_embedding(
+    cache_name,
+    distances,
+    labels,
+    parameters,
+    compute_function,
+    min_overlap=0.9,
+    max_change=0.05,
+    use_cache=True,
+    verbose=False,
+):
+    # Input:
+    # - distances: the matrix of distances between labels, which is the input of the embedding
+    # - parameters: a JSON-serializable dict, e.g. the name of the embedding and a fingerprint of its code
+    # - compute_function: a function init -> embedding, with init=None for a cold start
+    # Output: the embedding, and how it was obtained, i.e. 'hit', 'warm' or 'cold'
+
+    labels = [str(label) for label in labels]
+
+    if not use_cache:
+        return compute_function(None), 'cold'
+
+    cache_key = get_embedding_cache_key(distances, labels, parameters)
+    previous_layout = load_previous_layout(cache_name)
+
+    if previous_layout is not None and str(previous_layout['cache_key']) == cache_key:
+        status = 'hit'
+        embedding = previous_layout['embedding']
+    else:
+        init = None
+        if previous_layout is not None:
+            overlap, change = measure_change(previous_layout, distances, labels)
+            if overlap >= min_overlap and change <= max_change:
+                init = get_warm_start_init(previous_layout, distances, labels)
+
+        status = 'cold' if init is None else 'warm'
+        embedding = compute_function(init)
+
+        if previous_layout is not None:
+            embedding = align_layout(embedding, previous_layout, labels)
+
+        save_layout(cache_name, cache_key, distances, labels, embedding)
+
+    if verbose:
+        print('Layout of {}: {} (key = {})'.format(cache_name, status, cache_key))
+
+    return embedding, status
@@ -0,0 +1,386 @@
+# Objective: write a synthetic corpus of app details, laid out as if it had been downloaded by steam_spy.py, so that
+# every stage of the pipeline, from aggregate_steam_spy.py to build_tag_map.py, can be run at scale without the network.
+#
+# The corpus is seeded, hence reproducible, and written one app at a time, so that memory usage does not grow with the
+# number of apps. It mimics the quirks of the real corpus:
+# - a mix of app types, with games being about half of the apps,
+# - appIDs which mostly end with a '0',
+# - release dates in several formats, including the Russian abbreviation handled by build_steam_calendar(), and dates
+#   which cannot be parsed at all,
+# - optional keys which are missing, e.g. price_overview or genres, and files which are empty, i.e. {} or null,
+# - appIDs which failed, listed in faulty_appIDs.txt, and appIDs which have not been scraped yet.
+
+import datetime
+import json
+import pathlib
+import random
+import sys
+
+import steampi.api
+import steampi.json_utils
+
+from steam_catalog_utils import get_json_filename_for_steam_catalog
+from steam_spy import get_previously_seen_app_ids_of_games, get_previously_seen_app_ids_of_non_games
+
+APP_TYPES = {
+    'game': 0.55,
+    'dlc': 0.3,
+    'demo': 0.05,
+    'video': 0.04,
+    'music': 0.04,
+    'advertising': 0.02,
+}
+
+# Outcome of the download of app details
+OUTCOMES = {
+    'success': 0.83,
+    'faulty': 0.1,
+    'not_scraped': 0.04,
+    'empty_dict': 0.015,
+    'null': 0.005,
+    'missing_type': 0.01,
+}
+
+# Probability of each categorie and genre, for games. Other categories and genres are rare.
+CATEGORIE_PROBABILITIES = {
+    2: 0.9,
+    22: 0.5,
+    23: 0.35,
+    29: 0.3,
+    1: 0.2,
+    9: 0.15,
+    18: 0.15,
+    28: 0.12,
+    49: 0.1,
+    36: 0.08,
+    37: 0.08,
+    38: 0.06,
+    24: 0.06,
+    25: 0.05,
+}
+
+GENRE_PROBABILITIES = {
+    23: 0.6,
+    1: 0.4,
+    25: 0.35,
+    4: 0.35,
+    28: 0.2,
+    2: 0.2,
+    3: 0.18,
+    70: 0.1,
+    18: 0.05,
+    9: 0.04,
+    29: 0.03,
+}
+
+RARE_PROBABILITY = 0.005
+
+# Release date formats, with their frequency. The formats of build_steam_calendar() are all represented.
+RELEASE_DATE_FORMATS = {
+    '%b %d, %Y': 0.8,
+    '%d %b, %Y': 0.1,
+    '%B %d, %Y': 0.03,
+    '%d %B, %Y': 0.02,
+    '%b %Y': 0.02,
+    'russian': 0.01,
+    'unparsed': 0.02,
+}
+
+UNPARSED_RELEASE_DATES = ['Coming soon', 'To be announced', 'Q4 2018', '2019', 'Early 2020', 'When it is done']
+
+LANGUAGES = ['French', 'German', 'Spanish - Spain', 'Russian', 'Japanese', 'Simplified Chinese', 'Italian', 'Polish']
+
+WORDS_BY_GENRE = {
+    1: ['fight', 'shoot', 'enemies', 'weapons', 'fast', 'combat', 'boss'],
+    2: ['build', 'army', 'resources', 'empire', 'tactics', 'conquer', 'turn'],
+    3: ['quest', 'character', 'level', 'story', 'dungeon', 'loot', 'party'],
+    4: ['relax', 'match', 'puzzle', 'cute', 'simple', 'colorful', 'family'],
+    9: ['race', 'cars', 'track', 'speed', 'drift', 'championship', 'tuning'],
+    18: ['team', 'football', 'league', 'season', 'players', 'match', 'stadium'],
+    23: ['pixel', 'handcrafted', 'unique', 'art', 'retro', 'small', 'studio'],
+    25: ['explore', 'world', 'mystery', 'journey', 'discover', 'secrets', 'island'],
+    28: ['manage', 'realistic', 'farm', 'city', 'simulation', 'career', 'vehicles'],
+    29: ['online', 'players', 'guild', 'server', 'massive', 'raid', 'community'],
+    70: ['early', 'access', 'development', 'feedback', 'roadmap', 'update', 'alpha'],
+}
+
+COMMON_WORDS = ['game', 'play', 'new', 'experience', 'fun', 'friends', 'hours', 'levels', 'mode', 'challenge']
+
+
+def load_tag_names(filename, default_names):
+    # The names of categories and genres are shipped in the data folder of the repository.
+    try:
+        with open(filename, encoding='utf8') as f:
+            tag_names = {int(k): v for k, v in json.load(f).items()}
+    except FileNotFoundError:
+        tag_names = default_names
+
+    return tag_names
+
+
+def get_repository_data_path():
+    return str(pathlib.Path(__file__).resolve().parent / 'data') + '/'
+
+
+def choose(rng, weights):
+    return rng.choices(list(weights.keys()), weights=list(weights.values()))[0]
+
+
+def sample_tags(rng, probabilities, tag_names):
+    return [tag_id for tag_id in tag_names if rng.random() < probabilities.get(tag_id, RARE_PROBABILITY)]
+
+
+def format_release_date(rng, release_date):
+    date_format = choose(rng, RELEASE_DATE_FORMATS)
+
+    if date_format == 'unparsed':
+        return rng.choice(UNPARSED_RELEASE_DATES)
+
+    if date_format == 'russian':
+        # e.g. appID=689740, with 'сен.' for September: the day of the month comes first, and the month is forced.
+        return '{} сен. {}'.format(min(release_date.day, 30), release_date.year)
+
+    # Days of the month are not zero-padded on the store, e.g. 'Nov 1, 2017'.
+    return release_date.strftime(date_format.replace('%d', str(release_date.day)))
+
+
+def sample_release_date(rng, today, first_year=2006):
+    # The number of releases grows every year.
+    years = list(range(first_year, today.year + 1))
+    year = rng.choices(years, weights=[1.25 ** (year - first_year) for year in years])[0]
+
+    first_day = datetime.date(year, 1, 1)
+    last_day = min(datetime.date(year, 12, 31), today)
+
+    return first_day + datetime.timedelta(days=rng.randrange((last_day - first_day).days + 1))
+
+
+def generate_text(rng, genres, num_words=40):
+    vocabulary = list(COMMON_WORDS)
+    for genre in genres:
+        vocabulary += WORDS_BY_GENRE.get(genre, []) * 3
+
+    return ' '.join(rng.choice(vocabulary) for _ in range(num_words)).capitalize() + '.'
+
+
+def generate_game_details(rng, app_id, categorie_names, genre_names, today):
+    name = 'Synthetic Game {}'.format(app_id)
+    is_free = rng.random() < 0.1
+
+    genres = sample_tags(rng, GENRE_PROBABILITIES, genre_names)
+    if is_free and 37 in genre_names:
+        genres.append(37)
+    if len(genres) == 0:
+        genres = [23]
+
+    app_details = {
+        'type': 'game',
+        'name': name,
+        'steam_appid': app_id,
+        'required_age': rng.choices([0, 12, 16, 18], weights=[0.9, 0.02, 0.03, 0.05])[0],
+        'is_free': is_free,
+        'supported_languages': ', '.join(
+            (['English<strong>*</strong>'] if rng.random() < 0.95 else [])
+            + rng.sample(LANGUAGES, rng.randrange(len(LANGUAGES))),
+        ),
+        'short_description': generate_text(rng, genres, num_words=15),
+        'about_the_game': generate_text(rng, genres),
+        'publishers': ['Publisher {}'.format(rng.randrange(1000))] if rng.random() < 0.97 else [''],
+        'platforms': {
+            'windows': rng.random() < 0.98,
+            'mac': rng.random() < 0.25,
+            'linux': rng.random() < 0.18,
+        },
+        'release_date': {},
+    }
+
+    # Optional keys, which the aggregation handles when they are missing
+    if rng.random() < 0.97:
+        app_details['developers'] = ['Developer {}'.format(rng.randrange(2000))]
+
+    if not is_free and rng.random() < 0.85:
+        initial_price = rng.choice([99, 199, 299, 499, 799, 999, 1499, 1999, 2999, 3999, 5999])
+        discount_percent = rng.choice([0, 0, 0, 10, 25, 50, 75])
+        final_price = initial_price * (100 - discount_percent) // 100
+        app_details['price_overview'] = {
+            'currency': 'EUR',
+            'initial': initial_price,
+            'final': final_price,
+            'discount_percent': discount_percent,
+            'initial_formatted': '{:.2f}€'.format(initial_price / 100) if discount_percent else '',
+            'final_formatted': '{:.2f}€'.format(final_price / 100),
+        }
+
+    if rng.random() < 0.08:
+        score = min(100, max(20, int(rng.gauss(72, 10))))
+        app_details['metacritic'] = {'score': score, 'url': 'https://www.metacritic.com/game/pc/synthetic'}
+
+    if rng.random() < 0.98:
+        app_details['categories'] = [
+            {'id': i, 'description': categorie_names[i]}
+            for i in sample_tags(rng, CATEGORIE_PROBABILITIES, categorie_names)
+        ]
+
+    if rng.random() < 0.98:
+        # Genre IDs are strings in the Steam API, unlike categorie IDs.
+        app_details['genres'] = [{'id': str(i), 'description': genre_names[i]} for i in genres]
+
+    if rng.random() < 0.4:
+        app_details['recommendations'] = {'total': int(rng.lognormvariate(5, 2)) + 1}
+
+    if rng.random() < 0.5:
+        app_details['achievements'] = {'total': rng.randrange(1, 100), 'highlighted': []}
+
+    if rng.random() < 0.15:
+        app_details['dlc'] = [app_id + 10 * (i + 1) + 1 for i in range(rng.randrange(1, 6))]
+
+    if rng.random() < 0.05:
+        app_details['demos'] = [{'appid': app_id + 1, 'description': ''}]
+
+    if rng.random() < 0.25:
+        app_details['controller_support'] = rng.choice(['full', 'partial'])
+
+    if rng.random() < 0.03:
+        app_details['drm_notice'] = 'Denuvo Anti-tamper'
+
+    if rng.random() < 0.03:
+        app_details['ext_user_account_notice'] = 'Synthetic Account (Supports Linking to Steam Account)'
+
+    is_coming_soon = rng.random() < 0.05
+    if is_coming_soon:
+        release_date = today + datetime.timedelta(days=rng.randrange(1, 365))
+    else:
+        release_date = sample_release_date(rng, today)
+
+    app_details['release_date'] = {
+        'coming_soon': is_coming_soon,
+        'date': format_release_date(rng, release_date),
+    }
+
+    return app_details
+
+
+def generate_other_app_details(rng, app_id, app_type, today):
+    app_details = {
+        'type': app_type,
+        'name': 'Synthetic {} {}'.format(app_type.capitalize(), app_id),
+        'steam_appid': app_id,
+        'required_age': 0,
+        'is_free': app_type in ['demo', 'advertising'],
+        'platforms': {'windows': True, 'mac': rng.random() < 0.2, 'linux': rng.random() < 0.15},
+        'release_date': {
+            'coming_soon': False,
+            'date': format_release_date(rng, sample_release_date(rng, today)),
+        },
+    }
+
+    if app_type in ['dlc', 'demo', 'music']:
+        full_game_app_id = 10 * (app_id // 10)
+        app_details['fullgame'] = {'appid': str(full_game_app_id), 'name': 'Synthetic Game {}'.format(full_game_app_id)}
+
+    return app_details
+
+
+def generate_app_ids(num_apps, rng):
+    # Most appIDs end with a '0', as noted in steam_spy.py. appIDs are unique, because each one is in its own decade.
+    for i in range(num_apps):
+        offset = 0 if rng.random() < 0.72 else rng.randrange(1, 10)
+        yield 10 * (i + 1) + offset
+
+
+def is_corpus_present():
+    try:
+        return pathlib.Path(get_previously_seen_app_ids_of_games()).stat().st_size > 0
+    except FileNotFoundError:
+        return False
+
+
+def generate_synthetic_corpus(num_apps=10000, seed=0, today=None, overwrite=False, verbose=True):
+    # Output: a dict of counts, e.g. the number of games, of faulty appIDs, and of empty files
+
+    if is_corpus_present() and not overwrite:
+        raise FileExistsError(
+            '{} is not empty: refusing to overwrite an existing corpus.'.format(get_previously_seen_app_ids_of_games()),
+        )
+
+    if today is None:
+        today = datetime.date.today()
+
+    rng = random.Random(seed)
+
+    categorie_names = load_tag_names(get_repository_data_path() + 'categories.json', {2: 'Single-player'})
+    genre_names = load_tag_names(get_repository_data_path() + 'genres.json', {23: 'Indie'})
+
+    pathlib.Path(steampi.json_utils.get_data_path()).mkdir(parents=True, exist_ok=True)
+
+    counts = {outcome: 0 for outcome in OUTCOMES}
+    counts.update({app_type: 0 for app_type in APP_TYPES})
+
+    with open(get_previously_seen_app_ids_of_games(), 'w') as success_file, open(
+        get_previously_seen_app_ids_of_non_games(),
+        'w',
+    ) as faulty_file, open(get_json_filename_for_steam_catalog(), 'w', encoding='utf8') as catalog_file:
+        # The catalog is written entry by entry, so that it never has to be held in memory.
+        catalog_file.write('{')
+
+        for app_counter, app_id in enumerate(generate_app_ids(num_apps, rng)):
+            app_type = choose(rng, APP_TYPES)
+
+            if app_type == 'game':
+                app_details = generate_game_details(rng, app_id, categorie_names, genre_names, today)
+            else:
+                app_details = generate_other_app_details(rng, app_id, app_type, today)
+
+            catalog_file.write(
+                '{}{}: {}'.format(
+                    ', ' if app_counter > 0 else '',
+                    json.dumps(str(app_id)),
+                    json.dumps({'name': app_details['name']}),
+                ),
+            )
+
+            outcome = choose(rng, OUTCOMES)
+            counts[outcome] += 1
+
+            if outcome == 'not_scraped':
+                continue
+
+            if outcome == 'faulty':
+                faulty_file.write(str(app_id) + '\n')
+                continue
+
+            if outcome == 'empty_dict':
+                app_details = {}
+            elif outcome == 'null':
+                app_details = None
+            elif outcome == 'missing_type':
+                del app_details['type']
+            else:
+                counts[app_type] += 1
+
+            steampi.json_utils.save_json_data(steampi.api.get_appdetails_filename(app_id), app_details)
+            success_file.write(str(app_id) + '\n')
+
+            if verbose and (app_counter + 1) % 100000 == 0:
+                print('{} apps written'.format(app_counter + 1))
+
+        catalog_file.write('}\n')
+
+    if verbose:
+        print(counts)
+
+    return counts
+
+
+def main(args):
+    return generate_synthetic_corpus(
+        num_apps=args.num_apps,
+        seed=args.seed,
+        overwrite=args.overwrite,
+    )
+
+
+if __name__ == '__main__':
+    from cli import main as cli_main
+
+    cli_main(['synthetic-corpus'] + sys.argv[1:])
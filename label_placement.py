@@ -0,0 +1,182 @@
+# Objective: place text labels next to points of a 2D map, while avoiding overlaps, for thousands of labels.
+#
+# Each label has a few candidate positions around its point, e.g. above and to the right. Every candidate is scored at
+# once, with a KD-tree, by the number of points which its text would hide. Then labels are placed greedily, with a grid
+# of the boxes already placed, so that a label is shifted to its best free candidate, or hidden if none is free.
+
+import math
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+# (dx, dy, horizontal alignment, vertical alignment), with offsets as multiples of the distance between point and text
+CANDIDATE_OFFSETS = [
+    (1, 1, 'left', 'bottom'),
+    (-1, 1, 'right', 'bottom'),
+    (1, -1, 'left', 'top'),
+    (-1, -1, 'right', 'top'),
+    (1, 0, 'left', 'center'),
+    (-1, 0, 'right', 'center'),
+    (0, 1, 'center', 'bottom'),
+    (0, -1, 'center', 'top'),
+]
+
+# Candidates further away from the point, used to shift labels which collide with their neighbours
+SHIFT_FACTORS = [1, 3]
+
+
+def get_candidate_boxes(points, label_widths, label_height, delta):
+    # Output: arrays of shape (num_labels, num_candidates) for the anchor of the text, and for its bounding box
+
+    candidates = [
+        (factor * dx, factor * dy, ha, va)
+        for factor in SHIFT_FACTORS
+        for (dx, dy, ha, va) in CANDIDATE_OFFSETS
+    ]
+
+    dx = np.array([c[0] for c in candidates], dtype=np.float64)
+    dy = np.array([c[1] for c in candidates], dtype=np.float64)
+    horizontal_alignments = [c[2] for c in candidates]
+    vertical_alignments = [c[3] for c in candidates]
+
+    anchor_x = points[:, [0]] + delta * dx[None, :]
+    anchor_y = points[:, [1]] + delta * dy[None, :]
+
+    # Fraction of the box which lies to the left of, and below, the anchor
+    left_fraction = np.array([{'left': 0, 'center': 0.5, 'right': 1}[ha] for ha in horizontal_alignments])
+    bottom_fraction = np.array([{'bottom': 0, 'center': 0.5, 'top': 1}[va] for va in vertical_alignments])
+
+    widths = label_widths[:, None] * np.ones((1, len(candidates)))
+    x_min = anchor_x - left_fraction[None, :] * widths
+    y_min = anchor_y - bottom_fraction[None, :] * label_height
+
+    boxes = {
+        'anchor_x': anchor_x,
+        'anchor_y': anchor_y,
+        'x_min': x_min,
+        'x_max': x_min + widths,
+        'y_min': y_min,
+        'y_max': y_min + label_height,
+        'horizontal_alignments': horizontal_alignments,
+        'vertical_alignments': vertical_alignments,
+        'distance_ranks': np.repeat(np.arange(len(SHIFT_FACTORS)), len(CANDIDATE_OFFSETS)),
+    }
+
+    return boxes
+
+
+def score_candidates(points, boxes, tree):
+    # Objective: count, for every candidate, the points which its text would hide, approximating each box by the circle
+    # which circumscribes it. Candidates closer to their point are preferred, and so are candidates which point away
+    # from the nearest neighbour, as in the former placement of labels.
+
+    center_x = (boxes['x_min'] + boxes['x_max']) / 2
+    center_y = (boxes['y_min'] + boxes['y_max']) / 2
+    radii = 0.5 * np.hypot(boxes['x_max'] - boxes['x_min'], boxes['y_max'] - boxes['y_min'])
+
+    centers = np.stack([center_x.ravel(), center_y.ravel()], axis=1)
+    num_hidden_points = tree.query_ball_point(centers, radii.ravel(), return_length=True).reshape(center_x.shape)
+
+    scores = num_hidden_points + 0.5 * boxes['distance_ranks'][None, :]
+
+    if len(points) > 1:
+        _, neighbour_indices = tree.query(points, k=2)
+        away_from_neighbour = points - points[neighbour_indices[:, 1]]
+        direction_x = np.sign(center_x - points[:, [0]])
+        direction_y = np.sign(center_y - points[:, [1]])
+        agreement = direction_x * np.sign(away_from_neighbour[:, [0]]) + direction_y * np.sign(
+            away_from_neighbour[:, [1]],
+        )
+        scores = scores - 0.1 * agreement
+
+    return scores
+
+
+def get_grid_cells(x_min, y_min, x_max, y_max, cell_size):
+    return [
+        (i, j)
+        for i in range(math.floor(x_min / cell_size), math.floor(x_max / cell_size) + 1)
+        for j in range(math.floor(y_min / cell_size), math.floor(y_max / cell_size) + 1)
+    ]
+
+
+def is_overlapping(box, other_box):
+    return not (
+        box[2] <= other_box[0] or other_box[2] <= box[0] or box[3] <= other_box[1] or other_box[3] <= box[1]
+    )
+
+
+def place_labels(
+    points,
+    labels,
+    delta=0.003,
+    char_width=0.007,
+    label_height=0.018,
+    priorities=None,
+    hide_colliding_labels=True,
+):
+    # Input: points in the unit square, e.g. after the min-max scaling of plot_embedding(), and their labels.
+    # Sizes are in the same unit as points. Labels with a higher priority are placed first.
+    # Output: a dict of arrays: anchor coordinates, alignments, and whether each label is visible.
+
+    points = np.asarray(points, dtype=np.float64)
+    num_labels = len(labels)
+
+    if priorities is None:
+        priorities = np.zeros(num_labels)
+    priorities = np.asarray(priorities, dtype=np.float64)
+
+    label_widths = char_width * np.array([len(str(label)) for label in labels], dtype=np.float64)
+
+    tree = cKDTree(points)
+    boxes = get_candidate_boxes(points, label_widths, label_height, delta)
+    scores = score_candidates(points, boxes, tree)
+    candidate_orders = np.argsort(scores, axis=1, kind='stable')
+
+    # The greedy loop below runs in Python, where lists are much faster to index than arrays.
+    candidate_boxes = np.stack(
+        [boxes['x_min'], boxes['y_min'], boxes['x_max'], boxes['y_max']],
+        axis=2,
+    ).tolist()
+    candidate_orders_list = candidate_orders.tolist()
+
+    cell_size = max(label_height, float(label_widths.max(initial=0))) + 1e-9
+    grid = {}
+
+    placement = {
+        'x': np.empty(num_labels),
+        'y': np.empty(num_labels),
+        'horizontal_alignments': [None] * num_labels,
+        'vertical_alignments': [None] * num_labels,
+        'is_visible': np.zeros(num_labels, dtype=bool),
+    }
+
+    # Place labels with the highest priority first, then labels with the fewest options, i.e. in dense areas.
+    label_order = np.lexsort((scores.min(axis=1), -priorities))
+
+    for index in label_order.tolist():
+        chosen_candidate = None
+
+        for candidate in candidate_orders_list[index]:
+            box = candidate_boxes[index][candidate]
+            cells = get_grid_cells(*box, cell_size)
+            if not any(is_overlapping(box, other_box) for cell in cells for other_box in grid.get(cell, [])):
+                chosen_candidate = candidate
+                break
+
+        is_free = chosen_candidate is not None
+
+        if is_free:
+            for cell in get_grid_cells(*box, cell_size):
+                grid.setdefault(cell, []).append(box)
+        else:
+            # Every candidate collides: the label is either hidden, or drawn at its best candidate nonetheless.
+            chosen_candidate = candidate_orders_list[index][0]
+
+        placement['x'][index] = boxes['anchor_x'][index, chosen_candidate]
+        placement['y'][index] = boxes['anchor_y'][index, chosen_candidate]
+        placement['horizontal_alignments'][index] = boxes['horizontal_alignments'][chosen_candidate]
+        placement['vertical_alignments'][index] = boxes['vertical_alignments'][chosen_candidate]
+        placement['is_visible'][index] = is_free or not hide_colliding_labels
+
+    return placement
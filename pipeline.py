@@ -0,0 +1,384 @@
+# Objective: run the steps of the pipeline in order, as declared by their inputs and outputs, so that:
+# - a stage is skipped if its inputs, and its code, have not changed since it last succeeded, and its outputs exist,
+# - independent stages, e.g. analyze and tag-map, run side by side.
+#
+#   catalog -> scrape -> profile-corpus -> aggregate -> analyze
+#                                                    -> tag-map
+#
+# The aggregate stage writes both steamspy.json and aggregate.json, in a single pass over app details.
+#
+# Usage:
+#   python pipeline.py                      # every stage
+#   python pipeline.py aggregate analyze    # only these stages, e.g. offline
+#   python pipeline.py --force aggregate    # run a stage even if it is up-to-date
+#   python pipeline.py --dry-run            # only print which stages would run
+
+import argparse
+import ast
+import datetime
+import hashlib
+import importlib.util
+import json
+import os
+import pathlib
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import steampi.json_utils
+
+from derived_data_cache import compute_file_fingerprint
+
+
+def get_pipeline_state_filename():
+    pipeline_state_filename = steampi.json_utils.get_data_path() + 'pipeline_state.json'
+
+    return pipeline_state_filename
+
+
+def get_stages():
+    # Output: a dict of stages, in the order of the pipeline. Each stage is a subcommand of cli.py, along with its input
+    # and output paths. A path is either a file or a folder. Paths depend on the data folder, hence this function.
+    from aggregate_steam_spy import (
+        get_steam_categories_filename,
+        get_steam_database_filename,
+        get_steam_genres_filename,
+    )
+    from profile_corpus import get_corpus_profile_filename
+    from quantile_sketches import get_monthly_sketches_filename
+    from steam_catalog_utils import get_json_filename_for_steam_catalog
+    from steam_spy import (
+        get_previously_seen_app_ids_of_games,
+        get_previously_seen_app_ids_of_non_games,
+        get_quarantined_app_ids_filename,
+    )
+
+    # The catalog is downloaded once a day, because its filename includes the current date.
+    steam_catalog_filename = get_json_filename_for_steam_catalog()
+    app_details_folder = steampi.json_utils.get_data_path() + 'appdetails/'
+    steam_database_filenames = [
+        get_steam_database_filename(),
+        get_steam_categories_filename(),
+        get_steam_genres_filename(),
+    ]
+
+    stages = {
+        'catalog': {
+            'subcommand': 'catalog',
+            'inputs': [],
+            'outputs': [steam_catalog_filename],
+        },
+        'scrape': {
+            'subcommand': 'scrape',
+            'inputs': [steam_catalog_filename],
+            'outputs': [
+                get_previously_seen_app_ids_of_games(),
+                get_previously_seen_app_ids_of_non_games(),
+                app_details_folder,
+            ],
+        },
+        'profile-corpus': {
+            'subcommand': 'profile-corpus',
+            'inputs': [get_previously_seen_app_ids_of_games(), app_details_folder],
+            'outputs': [get_corpus_profile_filename(), get_quarantined_app_ids_filename()],
+        },
+        'aggregate': {
+            'subcommand': 'aggregate',
+            'args': ['--with-text', 'aggregate.json'],
+            'inputs': [get_previously_seen_app_ids_of_games(), app_details_folder, get_quarantined_app_ids_filename()],
+            'outputs': steam_database_filenames + [get_monthly_sketches_filename(), 'aggregate.json'],
+        },
+        'analyze': {
+            'subcommand': 'analyze',
+            'inputs': steam_database_filenames + [get_monthly_sketches_filename()],
+            'outputs': ['plots/'],
+        },
+        'tag-map': {
+            'subcommand': 'tag-map',
+            'inputs': steam_database_filenames,
+            'outputs': ['tag_map.png'],
+        },
+    }
+
+    return stages
+
+
+def get_dependencies(stages):
+    # Output: for each stage, the set of previous stages which write one of its inputs
+    dependencies = {}
+
+    outputs = {stage_name: {os.path.normpath(path) for path in stage['outputs']} for stage_name, stage in stages.items()}
+
+    for stage_name, stage in stages.items():
+        inputs = {os.path.normpath(path) for path in stage['inputs']}
+
+        dependencies[stage_name] = {
+            other_stage_name
+            for other_stage_name in stages
+            if other_stage_name != stage_name and len(inputs.intersection(outputs[other_stage_name])) > 0
+        }
+
+    return dependencies
+
+
+def compute_folder_fingerprint(folder_name):
+    # Objective: hash the listing of a folder, with the size and the modification time of each file, rather than the
+    # content of tens of thousands of files.
+
+    hasher = hashlib.sha256()
+
+    try:
+        entries = sorted(os.scandir(folder_name), key=lambda entry: entry.name)
+    except FileNotFoundError:
+        entries = []
+        hasher.update(b'<missing>')
+
+    for entry in entries:
+        stat = entry.stat()
+        hasher.update('{}:{}:{}\n'.format(entry.name, stat.st_size, stat.st_mtime_ns).encode('utf8'))
+
+    return hasher.hexdigest()
+
+
+def get_local_imports(filename):
+    # Output: the modules of the repository imported by a file, including the imports inside functions
+    folder_name = os.path.dirname(filename)
+
+    with open(filename, encoding='utf8') as f:
+        tree = ast.parse(f.read(), filename)
+
+    module_names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            module_names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module is not None and node.level == 0:
+            module_names.add(node.module)
+
+    local_filenames = set()
+    for module_name in module_names:
+        local_filename = os.path.join(folder_name, module_name.split('.')[0] + '.py')
+        if os.path.isfile(local_filename):
+            local_filenames.add(local_filename)
+
+    return local_filenames
+
+
+def get_stage_code_filenames(stage):
+    # Output: the module of the subcommand, located without being imported, and every module of the repository which it
+    # imports, directly or not, so that a change to any code run by the stage is detected.
+    from cli import SUBSYSTEMS
+
+    code_filename = importlib.util.find_spec(SUBSYSTEMS[stage['subcommand']]).origin
+
+    code_filenames = set()
+    filenames_to_visit = [code_filename]
+    while len(filenames_to_visit) > 0:
+        filename = filenames_to_visit.pop()
+        if filename in code_filenames:
+            continue
+        code_filenames.add(filename)
+        filenames_to_visit.extend(get_local_imports(filename))
+
+    return sorted(code_filenames)
+
+
+def compute_stage_fingerprint(stage, code_filenames=None):
+    hasher = hashlib.sha256()
+
+    hasher.update(json.dumps(stage.get('args', [])).encode('utf8'))
+
+    for path in stage['inputs']:
+        if os.path.isdir(path):
+            hasher.update(compute_folder_fingerprint(path).encode('utf8'))
+        else:
+            hasher.update(compute_file_fingerprint([path]).encode('utf8'))
+
+    if code_filenames is not None:
+        hasher.update(compute_file_fingerprint(code_filenames).encode('utf8'))
+
+    return hasher.hexdigest()
+
+
+def are_outputs_present(stage):
+    for path in stage['outputs']:
+        if path.endswith('/'):
+            if not os.path.isdir(path) or len(os.listdir(path)) == 0:
+                return False
+        elif not os.path.exists(path):
+            return False
+
+    return True
+
+
+def load_pipeline_state():
+    try:
+        with open(get_pipeline_state_filename(), encoding='utf8') as f:
+            pipeline_state = json.load(f)
+    except FileNotFoundError:
+        pipeline_state = {}
+
+    return pipeline_state
+
+
+def save_pipeline_state(pipeline_state):
+    pipeline_state_filename = get_pipeline_state_filename()
+    pathlib.Path(pipeline_state_filename).parent.mkdir(parents=True, exist_ok=True)
+
+    # Write to a temporary file first, so that an interrupted run cannot leave a truncated state file behind
+    temp_filename = pipeline_state_filename + '.tmp'
+    with open(temp_filename, 'w', encoding='utf8') as f:
+        json.dump(pipeline_state, f, indent=2)
+    pathlib.Path(temp_filename).replace(pipeline_state_filename)
+
+    return True
+
+
+def run_stage(stage_name, stage):
+    # Each stage runs in a process of its own, through the same entry point as on the command line.
+    import cli
+
+    return cli.main([stage['subcommand']] + stage.get('args', []))
+
+
+def run_pipeline(
+    stages=None,
+    stage_names=None,
+    force=None,
+    max_workers=None,
+    dry_run=False,
+    run_function=None,
+    use_code_fingerprint=True,
+    verbose=True,
+):
+    # Output: the status of each stage, among 'up-to-date', 'done', 'failed', 'blocked' (by a failed stage), and
+    # 'to-run' (dry run).
+    #
+    # stage_names restricts the run to some stages. The other stages are assumed to be up-to-date.
+
+    if stages is None:
+        stages = get_stages()
+    if stage_names is not None:
+        stages = {stage_name: stages[stage_name] for stage_name in stages if stage_name in stage_names}
+    if force is None:
+        force = []
+    if run_function is None:
+        run_function = run_stage
+
+    dependencies = get_dependencies(stages)
+
+    pipeline_state = load_pipeline_state()
+
+    statuses = {}
+    fingerprints = {}
+    pending_stage_names = list(stages)
+    running_futures = {}
+
+    def is_ready(stage_name):
+        return all(statuses.get(dependency) in ['up-to-date', 'done', 'to-run'] for dependency in dependencies[stage_name])
+
+    def is_blocked(stage_name):
+        return any(statuses.get(dependency) in ['failed', 'blocked'] for dependency in dependencies[stage_name])
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        while len(pending_stage_names) > 0 or len(running_futures) > 0:
+            for stage_name in list(pending_stage_names):
+                if is_blocked(stage_name):
+                    statuses[stage_name] = 'blocked'
+                    pending_stage_names.remove(stage_name)
+                    continue
+
+                if not is_ready(stage_name):
+                    continue
+
+                pending_stage_names.remove(stage_name)
+                stage = stages[stage_name]
+
+                # The fingerprint is computed once the previous stages are over, because they may change the inputs.
+                code_filenames = get_stage_code_filenames(stage) if use_code_fingerprint else None
+                fingerprints[stage_name] = compute_stage_fingerprint(stage, code_filenames)
+
+                is_up_to_date = (
+                    stage_name not in force
+                    and pipeline_state.get(stage_name, {}).get('fingerprint') == fingerprints[stage_name]
+                    and are_outputs_present(stage)
+                )
+
+                # In a dry run, the inputs of a stage after a stage to run are bound to change.
+                if dry_run and any(statuses[dependency] == 'to-run' for dependency in dependencies[stage_name]):
+                    is_up_to_date = False
+
+                if is_up_to_date:
+                    statuses[stage_name] = 'up-to-date'
+                elif dry_run:
+                    statuses[stage_name] = 'to-run'
+                else:
+                    if verbose:
+                        print('Running stage {}'.format(stage_name))
+                    running_futures[executor.submit(run_function, stage_name, stage)] = stage_name
+                    continue
+
+                if verbose:
+                    print('Stage {}: {}'.format(stage_name, statuses[stage_name]))
+
+            if len(running_futures) == 0:
+                if len(pending_stage_names) > 0 and not any(is_ready(name) for name in pending_stage_names):
+                    raise ValueError('Cyclic dependencies between stages: {}'.format(pending_stage_names))
+                continue
+
+            done_futures, _ = wait(running_futures, return_when=FIRST_COMPLETED)
+
+            for future in done_futures:
+                stage_name = running_futures.pop(future)
+
+                try:
+                    future.result()
+                    statuses[stage_name] = 'done'
+                    pipeline_state[stage_name] = {
+                        'fingerprint': fingerprints[stage_name],
+                        'completed_at': datetime.datetime.now().isoformat(timespec='seconds'),
+                    }
+                    # The state is saved after each stage, so that an interrupted run does not lose finished stages.
+                    save_pipeline_state(pipeline_state)
+                except Exception as error:
+                    statuses[stage_name] = 'failed'
+                    print('Stage {} failed: {!r}'.format(stage_name, error))
+
+                if verbose:
+                    print('Stage {}: {}'.format(stage_name, statuses[stage_name]))
+
+    return statuses
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Run the stages of the pipeline which are not up-to-date.')
+    parser.add_argument('stages', nargs='*', help='stages to run, among all of them by default')
+    parser.add_argument('--force', action='append', default=[], help='stage to run even if it is up-to-date')
+    parser.add_argument('--force-all', action='store_true', help='run every stage')
+    parser.add_argument('--max-workers', type=int, default=None, help='number of stages run side by side')
+    parser.add_argument('--dry-run', action='store_true', help='only print which stages would run')
+
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+
+    stages = get_stages()
+
+    unknown_stage_names = set(args.stages + args.force).difference(stages)
+    if len(unknown_stage_names) > 0:
+        raise ValueError('Unknown stages: {}. Choose among: {}'.format(sorted(unknown_stage_names), list(stages)))
+
+    statuses = run_pipeline(
+        stages=stages,
+        stage_names=args.stages if len(args.stages) > 0 else None,
+        force=list(stages) if args.force_all else args.force,
+        max_workers=args.max_workers,
+        dry_run=args.dry_run,
+    )
+
+    return statuses
+
+
+if __name__ == '__main__':
+    statuses = main()
+    sys.exit(1 if any(status in ['failed', 'blocked'] for status in statuses.values()) else 0)
@@ -0,0 +1,285 @@
+# Objective: scan every appdetails file with a pool of processes, and report:
+# - for each key path, e.g. 'price_overview.initial' or 'genres[].description', how many documents have it, the types
+#   of its values, and their sizes (length of strings, lists and dicts),
+# - which files are empty, invalid JSON (e.g. truncated), null, empty dicts, unsuccessful responses, or without 'type'.
+#
+# The report is saved as JSON. The appIDs of bad files are written to a quarantine list, which is skipped by the
+# aggregation, so that bad files are not parsed again and again.
+
+import json
+import os
+import pathlib
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import steampi.json_utils
+
+from steam_spy import get_quarantined_app_ids_filename
+
+# Statuses of files, other than 'ok', which are quarantined
+BAD_STATUSES = ['empty_file', 'invalid_json', 'null', 'not_a_dict', 'empty_dict', 'unsuccessful', 'missing_type']
+
+APPDETAILS_FILENAME_PATTERN = re.compile(r'appID_(\d+)\.json')
+
+
+def get_appdetails_folder():
+    return steampi.json_utils.get_data_path() + 'appdetails/'
+
+
+def get_corpus_profile_filename():
+    corpus_profile_filename = steampi.json_utils.get_data_path() + 'corpus_profile.json'
+
+    return corpus_profile_filename
+
+
+def list_appdetails_files(folder_name=None):
+    # Output: a list of (appID, filename), sorted by appID
+    if folder_name is None:
+        folder_name = get_appdetails_folder()
+
+    files = []
+    try:
+        for entry in os.scandir(folder_name):
+            match = APPDETAILS_FILENAME_PATTERN.fullmatch(entry.name)
+            if match is not None:
+                files.append((match.group(1), entry.path))
+    except FileNotFoundError:
+        pass
+
+    return sorted(files, key=lambda file: int(file[0]))
+
+
+def get_type_name(value):
+    if value is None:
+        return 'null'
+
+    return type(value).__name__
+
+
+def get_document_status(app_id, document):
+    if document is None:
+        return 'null'
+    if not isinstance(document, dict):
+        return 'not_a_dict'
+    if len(document) == 0:
+        return 'empty_dict'
+
+    # Raw responses of the API are wrapped in a dict keyed by appID.
+    response = document.get(app_id, document)
+    if isinstance(response, dict) and response.get('success') is False:
+        return 'unsuccessful'
+
+    if 'type' not in document:
+        return 'missing_type'
+
+    return 'ok'
+
+
+def collect_key_paths(value, path, paths):
+    # Objective: list the key paths of a document, with the type and the size of each value. Elements of lists share
+    # the path of the list, followed by '[]'.
+    size = len(value) if isinstance(value, (str, list, dict)) else None
+    paths.append((path, get_type_name(value), size))
+
+    if isinstance(value, dict):
+        for key, child in value.items():
+            collect_key_paths(child, key if path == '' else path + '.' + key, paths)
+    elif isinstance(value, list):
+        for child in value:
+            collect_key_paths(child, path + '[]', paths)
+
+    return paths
+
+
+def get_empty_profile():
+    profile = {
+        'num_files': 0,
+        'statuses': {},
+        'bad_files': {},
+        'bad_file_stats': {},
+        'key_paths': {},
+    }
+
+    return profile
+
+
+def scan_files(files):
+    # Output: the profile of a chunk of files, to be merged with the profiles of the other chunks
+
+    profile = get_empty_profile()
+
+    for app_id, filename in files:
+        profile['num_files'] += 1
+
+        # The file is stat-ed before it is read, so that a later change releases it from the quarantine.
+        file_stats = os.stat(filename)
+
+        document = None
+        if file_stats.st_size == 0:
+            status = 'empty_file'
+        else:
+            try:
+                with open(filename, encoding='utf8') as f:
+                    document = json.load(f)
+                status = get_document_status(app_id, document)
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                status = 'invalid_json'
+
+        profile['statuses'][status] = profile['statuses'].get(status, 0) + 1
+        if status != 'ok':
+            profile['bad_files'].setdefault(status, []).append(app_id)
+            profile['bad_file_stats'][app_id] = [file_stats.st_size, file_stats.st_mtime_ns]
+
+        if status not in ['ok', 'missing_type']:
+            continue
+
+        # A key path is counted once per document, however many times it appears in lists.
+        seen_paths = set()
+        for path, type_name, size in collect_key_paths(document, '', []):
+            if path == '':
+                continue
+
+            path_stats = profile['key_paths'].setdefault(
+                path,
+                {'num_documents': 0, 'num_values': 0, 'types': {}, 'num_sized_values': 0, 'total_size': 0, 'max_size': 0},
+            )
+            if path not in seen_paths:
+                seen_paths.add(path)
+                path_stats['num_documents'] += 1
+            path_stats['num_values'] += 1
+            path_stats['types'][type_name] = path_stats['types'].get(type_name, 0) + 1
+            if size is not None:
+                path_stats['num_sized_values'] += 1
+                path_stats['total_size'] += size
+                path_stats['max_size'] = max(path_stats['max_size'], size)
+
+    return profile
+
+
+def merge_profiles(profile, other_profile):
+    profile['num_files'] += other_profile['num_files']
+
+    for status, count in other_profile['statuses'].items():
+        profile['statuses'][status] = profile['statuses'].get(status, 0) + count
+
+    for status, app_ids in other_profile['bad_files'].items():
+        profile['bad_files'].setdefault(status, []).extend(app_ids)
+
+    profile['bad_file_stats'].update(other_profile['bad_file_stats'])
+
+    for path, other_stats in other_profile['key_paths'].items():
+        if path not in profile['key_paths']:
+            profile['key_paths'][path] = other_stats
+            continue
+
+        stats = profile['key_paths'][path]
+        stats['num_documents'] += other_stats['num_documents']
+        stats['num_values'] += other_stats['num_values']
+        stats['num_sized_values'] += other_stats['num_sized_values']
+        stats['total_size'] += other_stats['total_size']
+        stats['max_size'] = max(stats['max_size'], other_stats['max_size'])
+        for type_name, count in other_stats['types'].items():
+            stats['types'][type_name] = stats['types'].get(type_name, 0) + count
+
+    return profile
+
+
+def finalize_profile(profile):
+    # Key paths are sorted by path, and their coverage is relative to the documents which could be parsed.
+    num_documents = profile['statuses'].get('ok', 0) + profile['statuses'].get('missing_type', 0)
+
+    key_paths = {}
+    for path in sorted(profile['key_paths']):
+        stats = profile['key_paths'][path]
+        stats['coverage'] = stats['num_documents'] / num_documents if num_documents > 0 else 0.0
+        num_sized_values = stats['num_sized_values']
+        stats['mean_size'] = stats['total_size'] / num_sized_values if num_sized_values > 0 else 0.0
+        key_paths[path] = stats
+
+    profile['key_paths'] = key_paths
+    profile['bad_files'] = {status: sorted(app_ids, key=int) for status, app_ids in sorted(profile['bad_files'].items())}
+    profile['bad_file_stats'] = {
+        app_id: profile['bad_file_stats'][app_id] for app_id in sorted(profile['bad_file_stats'], key=int)
+    }
+
+    return profile
+
+
+def profile_corpus(folder_name=None, num_workers=None, chunk_size=500, verbose=True):
+    files = list_appdetails_files(folder_name)
+
+    chunks = []
+    for start in range(0, len(files), chunk_size):
+        end = start + chunk_size
+        chunks.append(files[start:end])
+
+    profile = get_empty_profile()
+
+    if num_workers == 1 or len(chunks) <= 1:
+        for partial_profile in map(scan_files, chunks):
+            merge_profiles(profile, partial_profile)
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            for partial_profile in executor.map(scan_files, chunks):
+                merge_profiles(profile, partial_profile)
+
+    profile = finalize_profile(profile)
+
+    if verbose:
+        print('#files = {}'.format(profile['num_files']))
+        for status, count in sorted(profile['statuses'].items()):
+            print('{:<16}{:>10}'.format(status, count))
+
+    return profile
+
+
+def get_quarantined_app_ids(profile):
+    return sorted(
+        {app_id for status in BAD_STATUSES for app_id in profile['bad_files'].get(status, [])},
+        key=int,
+    )
+
+
+def save_profile(profile, filename=None):
+    if filename is None:
+        filename = get_corpus_profile_filename()
+
+    pathlib.Path(filename).parent.mkdir(parents=True, exist_ok=True)
+    with open(filename, 'w', encoding='utf8') as f:
+        json.dump(profile, f, indent=2)
+
+    return filename
+
+
+def save_quarantine(profile):
+    # The quarantine list is replaced, so that files which were fixed since the previous scan are released. The size and
+    # the modification time of each file are stored along with its appID, so that a file which changes after the scan,
+    # e.g. after a new download, is released as well.
+    quarantined_app_ids = get_quarantined_app_ids(profile)
+
+    with open(get_quarantined_app_ids_filename(), 'w') as f:
+        for app_id in quarantined_app_ids:
+            size, mtime_ns = profile['bad_file_stats'][app_id]
+            f.write('{}\t{}\t{}\n'.format(app_id, size, mtime_ns))
+
+    return quarantined_app_ids
+
+
+def main(args):
+    profile = profile_corpus(num_workers=args.num_workers, chunk_size=args.chunk_size)
+
+    filename = save_profile(profile, args.report_filename)
+    print('Report saved to {}'.format(filename))
+
+    if not args.no_quarantine:
+        quarantined_app_ids = save_quarantine(profile)
+        print('{} appIDs quarantined in {}'.format(len(quarantined_app_ids), get_quarantined_app_ids_filename()))
+
+    return profile
+
+
+if __name__ == '__main__':
+    from cli import main as cli_main
+
+    cli_main(['profile-corpus'] + sys.argv[1:])
@@ -0,0 +1,224 @@
+# Objective: opt-in profiling of the entry points of the pipeline, so that slow runs can be diagnosed without wrapping
+# scripts in cProfile by hand.
+#
+# A run is made of named stages, which can be nested. For each stage, the report lists its wall time, CPU time, number
+# of items, e.g. appIDs or plots, and optionally its peak memory, traced with tracemalloc. A cProfile dump of the whole
+# run can be added as well. The run report is one JSON file in the profiles/ folder.
+#
+# Profiling is disabled by default, and costs nothing then. It is enabled either with the --profile flag of cli.py, or
+# with the environment variable STEAM_API_PROFILE=1 (plus STEAM_API_PROFILE_MEMORY=1 and STEAM_API_PROFILE_CPROFILE=1).
+
+import contextlib
+import cProfile
+import datetime
+import functools
+import json
+import os
+import pathlib
+import platform
+import pstats
+import sys
+import time
+import tracemalloc
+
+# The current run, if any. A single run is profiled at a time.
+_run = None
+
+
+def get_profile_folder():
+    profile_folder = 'profiles/'
+
+    pathlib.Path(profile_folder).mkdir(parents=True, exist_ok=True)
+
+    return profile_folder
+
+
+def is_enabled_in_environment(variable_name):
+    return os.environ.get(variable_name, '0') not in ['', '0', 'false', 'False']
+
+
+def is_profiling():
+    return _run is not None
+
+
+def start_run(name, trace_memory=False, use_cprofile=False):
+    global _run
+
+    if _run is not None:
+        return _run
+
+    _run = {
+        'name': name,
+        'started_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'argv': sys.argv,
+        'trace_memory': trace_memory,
+        'start_time': time.perf_counter(),
+        'stages': [],
+        'stack': [],
+        'profiler': None,
+    }
+
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _run['is_tracemalloc_owner'] = True
+
+    if use_cprofile:
+        _run['profiler'] = cProfile.Profile()
+        _run['profiler'].enable()
+
+    return _run
+
+
+def get_top_functions(profiler, num_functions=30):
+    # Output: the functions with the highest cumulative time, as a list of dicts
+    stats = pstats.Stats(profiler)
+
+    rows = []
+    for (filename, line_number, function_name), (_, num_calls, total_time, cumulative_time, _) in stats.stats.items():
+        rows.append(
+            {
+                'function': '{}:{}({})'.format(filename, line_number, function_name),
+                'num_calls': num_calls,
+                'total_time_s': total_time,
+                'cumulative_time_s': cumulative_time,
+            },
+        )
+
+    rows.sort(key=lambda row: row['cumulative_time_s'], reverse=True)
+
+    return rows[:num_functions]
+
+
+def finish_run(report_filename=None, verbose=True):
+    # Output: the run report, which is also saved as JSON
+    global _run
+
+    if _run is None:
+        return None
+
+    run = _run
+    _run = None
+
+    timestamp = run['started_at'].replace(':', '').replace('-', '')
+    base_filename = get_profile_folder() + '{}_{}'.format(run['name'], timestamp)
+    if report_filename is None:
+        report_filename = base_filename + '.json'
+
+    report = {
+        'name': run['name'],
+        'started_at': run['started_at'],
+        'python': run['python'],
+        'argv': run['argv'],
+        'duration_s': time.perf_counter() - run['start_time'],
+        'stages': run['stages'],
+    }
+
+    if run['profiler'] is not None:
+        run['profiler'].disable()
+        report['cprofile_filename'] = base_filename + '.pstats'
+        run['profiler'].dump_stats(report['cprofile_filename'])
+        report['top_functions'] = get_top_functions(run['profiler'])
+
+    if run.get('is_tracemalloc_owner'):
+        report['peak_memory_mb'] = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+
+    with open(report_filename, 'w', encoding='utf8') as f:
+        json.dump(report, f, indent=2)
+
+    if verbose:
+        print('Profiling report saved to {}'.format(report_filename))
+        for stage in report['stages']:
+            print(
+                '{:<48}{:>10.3f} s{:>12} items'.format(
+                    stage['path'],
+                    stage['duration_s'],
+                    '-' if stage['num_items'] is None else stage['num_items'],
+                ),
+            )
+
+    return report
+
+
+@contextlib.contextmanager
+def profile_stage(name, num_items=None):
+    # Usage:
+    #   with profile_stage('aggregation') as stage:
+    #       ...
+    #       stage['num_items'] = len(steam_database)
+    # Outside of a profiled run, this does nothing.
+
+    if _run is None:
+        yield {}
+        return
+
+    run = _run
+    parent = run['stack'][-1] if len(run['stack']) > 0 else None
+
+    stage = {
+        'name': name,
+        'path': name if parent is None else parent['path'] + '/' + name,
+        'start_offset_s': time.perf_counter() - run['start_time'],
+        'num_items': num_items,
+    }
+
+    if run['trace_memory']:
+        # The peak of the parent stage so far is kept aside, before the peak is reset for this stage.
+        current_peak = tracemalloc.get_traced_memory()[1]
+        if parent is not None:
+            parent['_peak'] = max(parent['_peak'], current_peak)
+        tracemalloc.reset_peak()
+        stage['_peak'] = 0
+
+    run['stack'].append(stage)
+    start_time = time.perf_counter()
+    start_cpu_time = time.process_time()
+
+    try:
+        yield stage
+    finally:
+        stage['duration_s'] = time.perf_counter() - start_time
+        stage['cpu_time_s'] = time.process_time() - start_cpu_time
+        run['stack'].pop()
+
+        if run['trace_memory']:
+            peak = max(stage.pop('_peak'), tracemalloc.get_traced_memory()[1])
+            stage['peak_memory_mb'] = peak / 2**20
+            if parent is not None:
+                parent['_peak'] = max(parent['_peak'], peak)
+
+        run['stages'].append(stage)
+
+
+def profiled_entry_point(name, count_items=None):
+    # Decorator for the entry points of the pipeline. If a run is being profiled, the call is one more stage.
+    # Otherwise, if profiling is enabled in the environment, the call starts a run of its own, and saves its report.
+    # count_items is an optional function which counts the items processed, from the output of the entry point.
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            is_run_owner = _run is None and is_enabled_in_environment('STEAM_API_PROFILE')
+
+            if is_run_owner:
+                start_run(
+                    name,
+                    trace_memory=is_enabled_in_environment('STEAM_API_PROFILE_MEMORY'),
+                    use_cprofile=is_enabled_in_environment('STEAM_API_PROFILE_CPROFILE'),
+                )
+
+            try:
+                with profile_stage(name) as stage:
+                    output = function(*args, **kwargs)
+                    if count_items is not None and _run is not None:
+                        stage['num_items'] = count_items(output)
+            finally:
+                if is_run_owner:
+                    finish_run()
+
+            return output
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,321 @@
+# Objective: rank developers and publishers, e.g. the top 100 publishers by number of releases since 2018, by median
+# price, by mean Metacritic score, or by total number of recommendations.
+#
+# Entities, i.e. developers or publishers, are dictionary-encoded into integer IDs, and the games of each entity are
+# stored as a CSR index: the games of entity i are game_positions[indptr[i]:indptr[i + 1]]. Per-entity aggregates are
+# then computed at once for every entity, with NumPy, and release counts per year are stored as suffix sums over years,
+# so that a ranking only needs one column of an array.
+
+import datetime
+import hashlib
+import sys
+
+import numpy as np
+
+from aggregate_steam_spy import get_steam_database_filename
+from analyze_steam_database import build_release_calendar, get_steam_database
+from derived_data_cache import get_cache_key, load_or_compute_with_key
+from steam_query import get_daily_calendar, get_release_day_numbers
+
+ENTITY_KEYS = ['developers', 'publishers']
+
+METRICS = ['releases', 'num_games', 'recommendations', 'mean_metacritic', 'median_price']
+
+
+def encode_entities(steam_database, app_ids, key='publishers'):
+    # Output: the names of the entities, sorted, and the CSR index (indptr, game_positions) from entities to games
+
+    entity_ids = {}
+    pair_entities = []
+    pair_games = []
+
+    for game_position, app_id in enumerate(app_ids):
+        names = steam_database[app_id].get(key)
+        if names is None:
+            continue
+
+        # The same name may be listed twice for a game, e.g. with trailing whitespace.
+        for name in {name.strip() for name in names if name is not None and len(name.strip()) > 0}:
+            pair_entities.append(entity_ids.setdefault(name, len(entity_ids)))
+            pair_games.append(game_position)
+
+    entity_names = np.array(list(entity_ids.keys()), dtype=object)
+    num_entities = len(entity_names)
+
+    # Re-number the entities in alphabetical order, so that the output does not depend on the order of the games.
+    alphabetical_order = np.argsort(entity_names.astype(str), kind='stable')
+    new_ids = np.empty(num_entities, dtype=np.int64)
+    new_ids[alphabetical_order] = np.arange(num_entities)
+
+    pair_entities = new_ids[np.array(pair_entities, dtype=np.int64)]
+    pair_games = np.array(pair_games, dtype=np.int64)
+
+    order = np.lexsort((pair_games, pair_entities))
+    game_positions = pair_games[order]
+
+    indptr = np.zeros(num_entities + 1, dtype=np.int64)
+    np.cumsum(np.bincount(pair_entities, minlength=num_entities), out=indptr[1:])
+
+    return entity_names[alphabetical_order], indptr, game_positions
+
+
+def get_release_years(daily_calendar, app_ids):
+    # Output: the release year of each game, or -1 if the release date is unknown or in the future
+    day_numbers = get_release_day_numbers(daily_calendar, app_ids)
+
+    is_known = ~np.isnan(day_numbers)
+    years = np.full(len(app_ids), -1, dtype=np.int64)
+    years[is_known] = day_numbers[is_known].astype('datetime64[D]').astype('datetime64[Y]').astype(np.int64) + 1970
+
+    return years
+
+
+def get_numeric_values(steam_database, app_ids, key):
+    return np.array(
+        [np.nan if steam_database[app_id][key] is None else float(steam_database[app_id][key]) for app_id in app_ids],
+        dtype=np.float64,
+    )
+
+
+def get_prices(steam_database, app_ids):
+    # Free games count as a price of zero, rather than as missing prices, which would bias medians upwards.
+    prices = get_numeric_values(steam_database, app_ids, 'price_overview')
+
+    is_free = np.array([bool(steam_database[app_id]['is_free']) for app_id in app_ids], dtype=bool)
+    prices[is_free & np.isnan(prices)] = 0.0
+
+    return prices
+
+
+def compute_segment_sums(segment_ids, values, num_segments):
+    # Output: the sum and the number of the valid values of each segment. Missing values are NaN.
+    is_valid = ~np.isnan(values)
+
+    sums = np.bincount(segment_ids[is_valid], weights=values[is_valid], minlength=num_segments)
+    counts = np.bincount(segment_ids[is_valid], minlength=num_segments)
+
+    return sums, counts
+
+
+def compute_segment_medians(segment_ids, values, num_segments):
+    # Objective: compute the median of the valid values of each segment, with a single sort of all the values
+    is_valid = ~np.isnan(values)
+    segment_ids = segment_ids[is_valid]
+    values = values[is_valid]
+
+    order = np.lexsort((values, segment_ids))
+    sorted_values = values[order]
+
+    counts = np.bincount(segment_ids, minlength=num_segments)
+    starts = np.cumsum(counts) - counts
+
+    medians = np.full(num_segments, np.nan)
+    has_values = counts > 0
+    lower = starts[has_values] + (counts[has_values] - 1) // 2
+    upper = starts[has_values] + counts[has_values] // 2
+    medians[has_values] = (sorted_values[lower] + sorted_values[upper]) / 2
+
+    return medians
+
+
+def build_entity_index(steam_database, key='publishers', daily_calendar=None):
+    # If the daily calendar is not provided, it is built from the release dates of the database, as for queries.
+    if daily_calendar is None:
+        daily_calendar = build_release_calendar(steam_database, granularity='day')
+
+    app_ids = np.array(list(steam_database.keys()))
+
+    entity_names, indptr, game_positions = encode_entities(steam_database, app_ids, key)
+    num_entities = len(entity_names)
+
+    # For each (entity, game) pair, the entity
+    pair_entities = np.repeat(np.arange(num_entities), np.diff(indptr))
+
+    index = {
+        'key': key,
+        'app_ids': app_ids,
+        'entity_names': entity_names,
+        'entity_ids': {name: entity_id for entity_id, name in enumerate(entity_names)},
+        'indptr': indptr,
+        'game_positions': game_positions,
+        'num_games': np.diff(indptr),
+    }
+
+    prices = get_prices(steam_database, app_ids)
+    index['median_price'] = compute_segment_medians(pair_entities, prices[game_positions], num_entities)
+
+    metacritic_sums, metacritic_counts = compute_segment_sums(
+        pair_entities,
+        get_numeric_values(steam_database, app_ids, 'metacritic')[game_positions],
+        num_entities,
+    )
+    with np.errstate(invalid='ignore', divide='ignore'):
+        index['mean_metacritic'] = np.where(metacritic_counts > 0, metacritic_sums / metacritic_counts, np.nan)
+
+    recommendation_sums, _ = compute_segment_sums(
+        pair_entities,
+        get_numeric_values(steam_database, app_ids, 'recommendations')[game_positions],
+        num_entities,
+    )
+    index['recommendations'] = recommendation_sums.astype(np.int64)
+
+    # Release counts per year, as a matrix of shape (entities, years), and suffix sums over years, i.e. the number of
+    # releases since each year, with an extra column of zeros, so that releases between two years are a difference.
+    years = get_release_years(daily_calendar, app_ids)[game_positions]
+    is_known = years >= 0
+    first_year = int(years[is_known].min()) if np.any(is_known) else 0
+    num_years = int(years[is_known].max()) - first_year + 1 if np.any(is_known) else 0
+
+    release_counts = np.bincount(
+        pair_entities[is_known] * num_years + (years[is_known] - first_year),
+        minlength=num_entities * num_years,
+    ).reshape(num_entities, num_years)
+
+    releases_since = np.zeros((num_entities, num_years + 1), dtype=np.int64)
+    releases_since[:, :num_years] = np.cumsum(release_counts[:, ::-1], axis=1)[:, ::-1]
+
+    index['first_year'] = first_year
+    index['release_counts'] = release_counts
+    index['releases_since'] = releases_since
+
+    return index
+
+
+def get_year_column(index, year):
+    # Output: the column of releases_since for the year, clipped to the years of the index
+    num_years = index['release_counts'].shape[1]
+
+    return int(np.clip(year - index['first_year'], 0, num_years))
+
+
+def get_metric_values(index, metric='releases', since=None, until=None):
+    if metric != 'releases':
+        return index[metric]
+
+    releases_since = index['releases_since']
+
+    start = 0 if since is None else get_year_column(index, since)
+    end = releases_since.shape[1] - 1 if until is None else get_year_column(index, until + 1)
+
+    return releases_since[:, start] - releases_since[:, max(start, end)]
+
+
+def get_top_entities(index, metric='releases', n=100, since=None, until=None, min_games=1):
+    # Input: since and until are inclusive years, only used for the number of releases.
+    # Output: a list of (name, value, number of games) sorted by decreasing value, then by name
+
+    values = np.asarray(get_metric_values(index, metric, since, until), dtype=np.float64)
+
+    candidates = np.flatnonzero((index['num_games'] >= min_games) & ~np.isnan(values))
+    n = min(n, len(candidates))
+    if n == 0:
+        return []
+
+    # Partial sort: only the top n entities are sorted. Ties at the n-th value are all kept before sorting.
+    candidate_values = values[candidates]
+    threshold = np.partition(candidate_values, len(candidates) - n)[len(candidates) - n]
+    candidates = candidates[candidate_values >= threshold]
+
+    # Entities are numbered in alphabetical order, so that the ID breaks ties by name.
+    order = np.lexsort((candidates, -values[candidates]))[:n]
+    top_entities = candidates[order]
+
+    return [
+        (index['entity_names'][entity_id], values[entity_id].item(), int(index['num_games'][entity_id]))
+        for entity_id in top_entities
+    ]
+
+
+def get_entity_summary(index, name):
+    entity_id = index['entity_ids'][name]
+
+    start = index['indptr'][entity_id]
+    end = index['indptr'][entity_id + 1]
+    game_positions = index['game_positions'][start:end]
+
+    release_counts = index['release_counts'][entity_id]
+    releases_per_year = {
+        index['first_year'] + offset: int(count) for offset, count in enumerate(release_counts) if count > 0
+    }
+
+    summary = {
+        'name': name,
+        'app_ids': list(index['app_ids'][game_positions]),
+        'num_games': int(index['num_games'][entity_id]),
+        'releases_per_year': releases_per_year,
+        'median_price': float(index['median_price'][entity_id]),
+        'mean_metacritic': float(index['mean_metacritic'][entity_id]),
+        'recommendations': int(index['recommendations'][entity_id]),
+    }
+
+    return summary
+
+
+def compute_entity_index(key='publishers'):
+    steam_database, _, _ = get_steam_database(verbosity=False)
+
+    return build_entity_index(steam_database, key=key, daily_calendar=get_daily_calendar(steam_database))
+
+
+def load_entity_index(key='publishers', use_cache=True, verbose=False):
+    # The index is cached, keyed by steamspy.json and by the code which builds it, so that rankings are read from
+    # precomputed arrays, without loading the database. The current date is part of the key, because future releases
+    # are left out of the release counts.
+    code_functions = [
+        compute_entity_index,
+        build_entity_index,
+        encode_entities,
+        get_daily_calendar,
+        get_release_years,
+        get_numeric_values,
+        get_prices,
+        compute_segment_sums,
+        compute_segment_medians,
+    ]
+
+    if not use_cache:
+        return compute_entity_index(key)
+
+    hasher = hashlib.sha256()
+    hasher.update(get_cache_key([get_steam_database_filename()], code_functions).encode('utf8'))
+    hasher.update(datetime.date.today().isoformat().encode('utf8'))
+
+    index = load_or_compute_with_key(
+        'entity_index_' + key,
+        hasher.hexdigest()[:16],
+        lambda: compute_entity_index(key),
+        verbose=verbose,
+    )
+
+    return index
+
+
+def main(args):
+    index = load_entity_index(key=args.key)
+
+    if args.entity is not None:
+        summary = get_entity_summary(index, args.entity)
+        for field, value in summary.items():
+            print('{}: {}'.format(field, value))
+        return summary
+
+    top_entities = get_top_entities(
+        index,
+        metric=args.metric,
+        n=args.top,
+        since=args.since,
+        until=args.until,
+        min_games=args.min_games,
+    )
+
+    print('#{} = {}'.format(args.key, len(index['entity_names'])))
+    for rank, (name, value, num_games) in enumerate(top_entities, start=1):
+        print('{:>4}\t{:>12g}\t{:>6} games\t{}'.format(rank, value, num_games, name))
+
+    return top_entities
+
+
+if __name__ == '__main__':
+    from cli import main as cli_main
+
+    cli_main(['entities'] + sys.argv[1:])
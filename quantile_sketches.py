@@ -0,0 +1,325 @@
+# Objective: mergeable quantile sketches, so that monthly medians can be updated as new apps are aggregated, without
+# keeping every value in memory, and without scanning the whole database again.
+#
+# The sketch is a stack of compactors, as in KLL. An item stored at level h stands for 2^h values. When a level holds
+# more than k items, they are sorted and every other item is promoted to the next level. Each such compaction at level h
+# shifts ranks by at most 2^h, which is tracked, so that every sketch knows its worst-case rank error.
+# Reference: Karnin, Lang, Liberty, "Optimal Quantile Approximation in Streams", FOCS 2016.
+#
+# Sketches are plain dicts of lists, so that they can be saved as JSON next to the database.
+
+import datetime
+import hashlib
+import json
+import math
+
+import numpy as np
+import steampi.json_utils
+
+SKETCH_KEYWORDS = ['price_overview', 'achievements', 'metacritic', 'recommendations']
+
+
+def get_monthly_sketches_filename():
+    monthly_sketches_filename = steampi.json_utils.get_data_path() + 'monthly_sketches.json'
+
+    return monthly_sketches_filename
+
+
+def get_sketch_capacity(accuracy=0.01, max_count=10**6):
+    # The rank error is at most (number of levels) * n / k, and there are at most log2(max_count) + 1 levels.
+    num_levels = math.log2(max_count) + 1
+
+    return int(math.ceil(num_levels / accuracy))
+
+
+def create_sketch(capacity):
+    sketch = {
+        'k': capacity,
+        'n': 0,
+        'levels': [[]],
+        'num_compactions': [0],
+        'max_rank_error': 0,
+    }
+
+    return sketch
+
+
+def compress_sketch(sketch):
+    k = sketch['k']
+
+    h = 0
+    while h < len(sketch['levels']):
+        level = sketch['levels'][h]
+
+        if len(level) > k:
+            level = sorted(level)
+
+            # Keep one item at the current level if there is an odd number of items, so that weights add up.
+            kept_items = [level.pop()] if len(level) % 2 == 1 else []
+
+            # Alternate between even and odd items from one compaction to the next, so that errors tend to cancel out.
+            offset = sketch['num_compactions'][h] % 2
+            sketch['num_compactions'][h] += 1
+
+            promoted_items = level[offset::2]
+
+            if h + 1 == len(sketch['levels']):
+                sketch['levels'].append([])
+                sketch['num_compactions'].append(0)
+            sketch['levels'][h + 1].extend(promoted_items)
+            sketch['levels'][h] = kept_items
+            sketch['max_rank_error'] += 2**h
+
+        h += 1
+
+    return sketch
+
+
+def update_sketch(sketch, values):
+    values = [float(v) for v in values]
+
+    sketch['levels'][0].extend(values)
+    sketch['n'] += len(values)
+
+    return compress_sketch(sketch)
+
+
+def merge_sketches(sketch, other_sketch):
+    merged_sketch = create_sketch(max(sketch['k'], other_sketch['k']))
+
+    num_levels = max(len(sketch['levels']), len(other_sketch['levels']))
+    merged_sketch['levels'] = [[] for _ in range(num_levels)]
+    merged_sketch['num_compactions'] = [0] * num_levels
+    for current_sketch in [sketch, other_sketch]:
+        for h, level in enumerate(current_sketch['levels']):
+            merged_sketch['levels'][h].extend(level)
+            merged_sketch['num_compactions'][h] += current_sketch['num_compactions'][h]
+
+    merged_sketch['n'] = sketch['n'] + other_sketch['n']
+    merged_sketch['max_rank_error'] = sketch['max_rank_error'] + other_sketch['max_rank_error']
+
+    return compress_sketch(merged_sketch)
+
+
+def get_rank_error_bound(sketch):
+    # Compactions shift ranks by at most max_rank_error, and the answer of get_quantile() may overshoot the target rank
+    # by less than the weight of one item, i.e. 2^h for the top level h.
+    if sketch['max_rank_error'] == 0:
+        return 0
+
+    top_level = max(h for h, level in enumerate(sketch['levels']) if len(level) > 0)
+
+    return sketch['max_rank_error'] + 2**top_level
+
+
+def get_quantile(sketch, q=0.5):
+    if sketch['n'] == 0:
+        return np.nan
+
+    if sketch['max_rank_error'] == 0:
+        # Nothing has been compacted yet: the sketch holds every value, so the answer is exact, as with np.median().
+        return float(np.quantile(sketch['levels'][0], q))
+
+    values = np.concatenate([np.asarray(level, dtype=np.float64) for level in sketch['levels']])
+    weights = np.concatenate(
+        [np.full(len(level), 2**h, dtype=np.float64) for h, level in enumerate(sketch['levels'])],
+    )
+
+    order = np.argsort(values, kind='stable')
+    cumulative_weights = np.cumsum(weights[order])
+
+    rank = q * sketch['n']
+    index = min(np.searchsorted(cumulative_weights, rank, side='left'), len(values) - 1)
+
+    return float(values[order][index])
+
+
+def create_monthly_sketches(accuracy=0.01, max_count=10**6):
+    # 'app_digests' maps each month to the digest of every sketched game released that month, so that changed or
+    # removed games are detected without keeping their values. 'app_id_hashes' maps each keyword and month to a hash of
+    # the appIDs whose value is sketched, so that the games of a month can be checked without listing them.
+    monthly_sketches = {
+        'k': get_sketch_capacity(accuracy, max_count),
+        'app_digests': {},
+        'app_id_hashes': {keyword: {} for keyword in SKETCH_KEYWORDS},
+        'sketches': {keyword: {} for keyword in SKETCH_KEYWORDS},
+    }
+
+    return monthly_sketches
+
+
+def get_sketched_values(game):
+    return [None if game[keyword] is None else int(game[keyword]) for keyword in SKETCH_KEYWORDS]
+
+
+def get_app_digest(game):
+    # The digest covers the raw release date, so that the date of a game is only parsed if the game is new or changed.
+    release_info = game['release_date']
+    data = json.dumps([release_info['is_released'], release_info['date'], get_sketched_values(game)])
+
+    return hashlib.blake2b(data.encode('utf8'), digest_size=8).hexdigest()
+
+
+def get_app_id_hash(app_id):
+    return int.from_bytes(hashlib.blake2b(str(app_id).encode('utf8'), digest_size=8).digest(), 'big')
+
+
+def get_app_ids_hash(app_ids):
+    # The XOR of the hashes of appIDs does not depend on their order, and can be updated one appID at a time.
+    app_ids_hash = 0
+    for app_id in app_ids:
+        app_ids_hash ^= get_app_id_hash(app_id)
+
+    return app_ids_hash
+
+
+def get_release_month_key(game):
+    # Output: the release month, e.g. '2019-08-01', or None if the game is not released or its date cannot be parsed
+
+    # Imported here, because analyze_steam_database relies on this module to read medians from sketches.
+    from analyze_steam_database import parse_release_date
+
+    release_info = game['release_date']
+    if not release_info['is_released']:
+        return None
+
+    release_date = parse_release_date(release_info['date'])
+    if release_date is None:
+        return None
+
+    return datetime.date(release_date.year, release_date.month, 1).isoformat()
+
+
+def update_monthly_sketches(monthly_sketches, steam_database, verbose=False):
+    # Objective: update the per-month sketches with the current database, i.e. every game which is aggregated.
+    #
+    # Games which have not been seen yet are added to the sketches of their month. Values cannot be removed from a
+    # sketch, so that the months of games whose digest has changed, or which have left the database, are rebuilt from
+    # the current values of their games. Games which are not released yet, or whose release date cannot be parsed, are
+    # not sketched, so that they are added once they are released.
+
+    app_digests = monthly_sketches['app_digests']
+
+    previous_month_keys = {}
+    for month_key, month_digests in app_digests.items():
+        for app_id in month_digests:
+            previous_month_keys[app_id] = month_key
+
+    # Games which are new or changed, as a dict appID -> (month, digest)
+    new_games = {}
+    rebuilt_months = set()
+    for app_id, game in steam_database.items():
+        digest = get_app_digest(game)
+
+        previous_month_key = previous_month_keys.pop(app_id, None)
+        if previous_month_key is not None:
+            if app_digests[previous_month_key][app_id] == digest:
+                continue
+            del app_digests[previous_month_key][app_id]
+            rebuilt_months.add(previous_month_key)
+
+        month_key = get_release_month_key(game)
+        if month_key is not None:
+            new_games[app_id] = (month_key, digest)
+
+    # Games which have left the database
+    for app_id, previous_month_key in previous_month_keys.items():
+        del app_digests[previous_month_key][app_id]
+        rebuilt_months.add(previous_month_key)
+
+    for month_key in rebuilt_months:
+        for keyword in SKETCH_KEYWORDS:
+            monthly_sketches['sketches'][keyword].pop(month_key, None)
+            monthly_sketches['app_id_hashes'][keyword].pop(month_key, None)
+
+        # The unchanged games of a rebuilt month are sketched again.
+        for app_id, digest in app_digests.pop(month_key, {}).items():
+            new_games[app_id] = (month_key, digest)
+
+    # Values to add, per month and per keyword
+    added_values = {}
+    for app_id, (month_key, digest) in new_games.items():
+        app_digests.setdefault(month_key, {})[app_id] = digest
+
+        month_values = added_values.setdefault(month_key, [[] for _ in SKETCH_KEYWORDS])
+        for keyword, keyword_values, value in zip(SKETCH_KEYWORDS, month_values, get_sketched_values(steam_database[app_id])):
+            if value is not None:
+                keyword_values.append(value)
+
+                app_id_hashes = monthly_sketches['app_id_hashes'][keyword]
+                app_id_hashes[month_key] = app_id_hashes.get(month_key, 0) ^ get_app_id_hash(app_id)
+
+    for month_key, month_values in added_values.items():
+        for keyword, values in zip(SKETCH_KEYWORDS, month_values):
+            if len(values) == 0:
+                continue
+
+            keyword_sketches = monthly_sketches['sketches'][keyword]
+            if month_key not in keyword_sketches:
+                keyword_sketches[month_key] = create_sketch(monthly_sketches['k'])
+            update_sketch(keyword_sketches[month_key], values)
+
+    if verbose:
+        print(
+            '{} games added to the monthly sketches, and {} months rebuilt.'.format(
+                len(new_games),
+                len(rebuilt_months),
+            ),
+        )
+
+    return monthly_sketches
+
+
+def load_monthly_sketches(accuracy=0.01):
+    # Sketches saved without the digest of each game, by a previous version, are rebuilt from scratch.
+    try:
+        monthly_sketches = steampi.json_utils.load_json_data(get_monthly_sketches_filename())
+    except (FileNotFoundError, json.JSONDecodeError):
+        monthly_sketches = None
+
+    if monthly_sketches is None or 'app_digests' not in monthly_sketches:
+        monthly_sketches = create_monthly_sketches(accuracy)
+
+    return monthly_sketches
+
+
+def update_and_save_monthly_sketches(steam_database, accuracy=0.01, verbose=True):
+    monthly_sketches = load_monthly_sketches(accuracy)
+
+    monthly_sketches = update_monthly_sketches(monthly_sketches, steam_database, verbose)
+
+    steampi.json_utils.save_json_data(get_monthly_sketches_filename(), monthly_sketches)
+
+    return monthly_sketches
+
+
+def get_monthly_quantiles(monthly_sketches, keyword, months, q=0.5, app_ids_per_month=None):
+    # Output: one quantile per month, or None if a month is missing from the sketches
+    #
+    # If the appIDs of each month are provided, the sketches are only used if they hold exactly these games. Otherwise,
+    # e.g. for a subset of games selected by a query, None is returned, so that exact quantiles are computed instead.
+
+    if keyword not in SKETCH_KEYWORDS:
+        return None
+
+    keyword_sketches = monthly_sketches['sketches'][keyword]
+
+    month_keys = [month.isoformat() for month in months]
+    if any(month_key not in keyword_sketches for month_key in month_keys):
+        return None
+
+    if app_ids_per_month is not None:
+        # Only the games with a value for the keyword are expected, as in analyze_steam_database.get_x_y_time_series().
+        # Counts are compared first, because they are free, then the hashes of the appIDs.
+        for month_key, app_ids in zip(month_keys, app_ids_per_month):
+            if len(app_ids) != keyword_sketches[month_key]['n']:
+                return None
+
+        app_id_hashes = monthly_sketches['app_id_hashes'][keyword]
+        for month_key, app_ids in zip(month_keys, app_ids_per_month):
+            if get_app_ids_hash(app_ids) != app_id_hashes.get(month_key):
+                return None
+
+    quantiles = [get_quantile(keyword_sketches[month_key], q) for month_key in month_keys]
+
+    return quantiles
@@ -0,0 +1,233 @@
+# Objective: find the games which are the most similar to a given game, e.g. "games like Portal".
+#
+# Each game is a sparse vector of categories and genres, optionally with TF-IDF features of its store description, as
+# aggregated in aggregate.json. Vectors are L2-normalized, so that the cosine similarity is a dot product. A batch of
+# queries is then answered with one sparse matrix product, and np.argpartition() to select the top-k games.
+# For large catalogs, an approximate nearest-neighbor index can be built with pynndescent.
+
+import json
+import sys
+
+import numpy as np
+import scipy.sparse
+
+from analyze_steam_database import get_steam_database
+from build_tag_map import preprocess_data
+
+
+def normalize_rows(matrix):
+    matrix = scipy.sparse.csr_matrix(matrix, dtype=np.float32)
+
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+
+    return scipy.sparse.diags(1 / norms).dot(matrix).tocsr().astype(np.float32)
+
+
+def get_text_vectors(steam_database, aggregate, max_text_features=2**15):
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    texts = [aggregate.get(app_id, {}).get('text', '') for app_id in steam_database]
+
+    vectorizer = TfidfVectorizer(
+        max_features=max_text_features,
+        stop_words='english',
+        sublinear_tf=True,
+        dtype=np.float32,
+    )
+
+    return vectorizer.fit_transform(texts)
+
+
+def build_app_vectors(steam_database, categories_dict, genres_dict, aggregate=None, text_weight=1.0):
+    # Output: a sparse matrix with one L2-normalized row per game
+
+    tag_joint_game_matrix, _ = preprocess_data(steam_database, categories_dict, genres_dict)
+
+    # Duplicate tags are counted once.
+    tag_vectors = scipy.sparse.csr_matrix(tag_joint_game_matrix.T, dtype=np.float32)
+    tag_vectors.data[:] = 1
+    vectors = normalize_rows(tag_vectors)
+
+    if aggregate is not None:
+        # Tags and text weigh the same, unless text_weight says otherwise.
+        text_vectors = normalize_rows(get_text_vectors(steam_database, aggregate))
+        vectors = normalize_rows(scipy.sparse.hstack([vectors, text_weight * text_vectors], format='csr'))
+
+    return vectors
+
+
+def build_similarity_index(vectors, app_ids, names, use_approximate_index=False, n_neighbors=30, seed=0):
+    index = {
+        'vectors': normalize_rows(vectors),
+        'app_ids': np.array(app_ids),
+        'names': list(names),
+        'row_by_app_id': {str(app_id): row for row, app_id in enumerate(app_ids)},
+        'row_by_name': {},
+        'approximate_index': None,
+    }
+
+    for row, name in enumerate(names):
+        index['row_by_name'].setdefault(str(name).lower(), row)
+
+    if use_approximate_index:
+        # Imported lazily: pynndescent pulls in numba, which is slow to load, and slower to compile at first use.
+        from pynndescent import NNDescent
+
+        approximate_index = NNDescent(
+            index['vectors'],
+            metric='cosine',
+            n_neighbors=n_neighbors,
+            random_state=seed,
+            low_memory=True,
+        )
+        approximate_index.prepare()
+        index['approximate_index'] = approximate_index
+
+    return index
+
+
+def query_top_k(index, rows, k=10, batch_size=256):
+    # Output: for each query row, the rows of the k most similar games, sorted by decreasing cosine similarity, and
+    # the similarities. The query game itself is excluded.
+
+    rows = np.asarray(rows, dtype=np.int64)
+    vectors = index['vectors']
+    num_games = vectors.shape[0]
+    k = min(k, num_games - 1)
+
+    neighbor_rows = np.zeros((len(rows), k), dtype=np.int64)
+    similarities = np.zeros((len(rows), k), dtype=np.float32)
+
+    # The dense block of scores is batch_size x num_games, which bounds memory usage.
+    for start in range(0, len(rows), batch_size):
+        end = min(start + batch_size, len(rows))
+        batch_rows = rows[start:end]
+        batch_positions = np.arange(len(batch_rows))
+
+        scores = (vectors[batch_rows] @ vectors.T).toarray()
+        scores[batch_positions, batch_rows] = -np.inf
+
+        top_rows = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = scores[batch_positions[:, None], top_rows]
+
+        order = np.argsort(-top_scores, axis=1, kind='stable')
+        neighbor_rows[start:end] = np.take_along_axis(top_rows, order, axis=1)
+        similarities[start:end] = np.take_along_axis(top_scores, order, axis=1)
+
+    return neighbor_rows, similarities
+
+
+def query_top_k_approximate(index, rows, k=10):
+    rows = np.asarray(rows, dtype=np.int64)
+
+    # Ask for one more neighbor, because the query game is usually its own nearest neighbor.
+    candidate_rows, distances = index['approximate_index'].query(index['vectors'][rows], k=k + 1)
+
+    neighbor_rows = np.zeros((len(rows), k), dtype=np.int64)
+    similarities = np.zeros((len(rows), k), dtype=np.float32)
+
+    for i, row in enumerate(rows):
+        is_other_game = candidate_rows[i] != row
+        neighbor_rows[i] = candidate_rows[i][is_other_game][:k]
+        similarities[i] = 1 - distances[i][is_other_game][:k]
+
+    return neighbor_rows, similarities
+
+
+def resolve_queries(index, queries):
+    # Queries are either appIDs or names. Names are matched without case, exactly if possible, else as a substring.
+    # Output: the row of each query, or None if the query is unknown
+
+    rows = []
+    for query in queries:
+        query = str(query)
+
+        if query in index['row_by_app_id']:
+            row = index['row_by_app_id'][query]
+        elif query.lower() in index['row_by_name']:
+            row = index['row_by_name'][query.lower()]
+        else:
+            row = next(
+                (row for name, row in index['row_by_name'].items() if query.lower() in name),
+                None,
+            )
+
+        rows.append(row)
+
+    return rows
+
+
+def get_similar_games(index, queries, k=10):
+    # Output: dict query -> list of (appID, name, cosine similarity), or None if the query is unknown
+
+    rows = resolve_queries(index, queries)
+    known_rows = [row for row in rows if row is not None]
+
+    if len(known_rows) == 0:
+        neighbor_rows, similarities = [], []
+    elif index['approximate_index'] is not None:
+        neighbor_rows, similarities = query_top_k_approximate(index, known_rows, k)
+    else:
+        neighbor_rows, similarities = query_top_k(index, known_rows, k)
+
+    results = {}
+    position = 0
+    for query, row in zip(queries, rows):
+        if row is None:
+            results[query] = None
+            continue
+
+        results[query] = [
+            (str(index['app_ids'][j]), index['names'][j], float(similarity))
+            for j, similarity in zip(neighbor_rows[position], similarities[position])
+        ]
+        position += 1
+
+    return results
+
+
+def load_aggregate(aggregate_filename='aggregate.json'):
+    try:
+        with open(aggregate_filename) as f:
+            aggregate = json.load(f)
+    except FileNotFoundError:
+        print('{} not found: text features are ignored.'.format(aggregate_filename))
+        aggregate = None
+
+    return aggregate
+
+
+def main(args):
+    steam_database, all_categories_dict, all_genres_dict = get_steam_database(verbosity=False)
+
+    aggregate = load_aggregate(args.text_filename) if args.use_text else None
+
+    vectors = build_app_vectors(steam_database, all_categories_dict, all_genres_dict, aggregate)
+
+    index = build_similarity_index(
+        vectors,
+        list(steam_database.keys()),
+        [game['name'] for game in steam_database.values()],
+        use_approximate_index=args.approximate,
+    )
+
+    results = get_similar_games(index, args.queries, k=args.k)
+
+    for query, similar_games in results.items():
+        if similar_games is None:
+            print('Game not found: {}'.format(query))
+            continue
+
+        row = resolve_queries(index, [query])[0]
+        print('\nGames similar to {} ({}):'.format(index['names'][row], index['app_ids'][row]))
+        for app_id, name, similarity in similar_games:
+            print('{:.3f}\t{}\t{}'.format(similarity, app_id, name))
+
+    return results
+
+
+if __name__ == '__main__':
+    from cli import main as cli_main
+
+    cli_main(['similar'] + sys.argv[1:])
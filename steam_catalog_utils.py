@@ -4,6 +4,21 @@ import time
 import steampi.json_utils
 
 
+def parse_steam_catalog(data):
+    parsed_steam_catalog = {}
+
+    # noinspection SpellCheckingInspection
+    for app in data['applist']['apps']:
+        # noinspection SpellCheckingInspection
+        app_id = str(app['appid'])
+        app_name = app['name']
+
+        parsed_steam_catalog[app_id] = {}
+        parsed_steam_catalog[app_id]['name'] = app_name
+
+    return parsed_steam_catalog
+
+
 def download_steam_catalog():
     url = 'https://api.steampowered.com/ISteamApps/GetAppList/v0002/'
     (data, status_code) = steampi.json_utils.download_json_data(url)
@@ -12,14 +27,7 @@ def download_steam_catalog():
     downloaded_steam_catalog = {}
 
     if success_flag:
-        # noinspection SpellCheckingInspection
-        for app in data['applist']['apps']:
-            # noinspection SpellCheckingInspection
-            app_id = str(app['appid'])
-            app_name = app['name']
-
-            downloaded_steam_catalog[app_id] = {}
-            downloaded_steam_catalog[app_id]['name'] = app_name
+        downloaded_steam_catalog = parse_steam_catalog(data)
 
     return downloaded_steam_catalog, success_flag, status_code
 
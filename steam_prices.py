@@ -0,0 +1,201 @@
+# Objective: refresh the prices of the whole catalog in a few hundred requests, rather than with one request per game.
+#
+# The appdetails endpoint of the store returns 'price_overview' for many comma-separated appIDs at once, when the
+# request is filtered with filters=price_overview. Prices are fetched for one or several country codes, and written to
+# a price table, i.e. a CSV file with one row per (appID, country code).
+
+import csv
+import datetime
+import sys
+import time
+
+import steampi.json_utils
+
+from appdetails_download import QUERY_RATE_LIMIT, WAIT_TIME, download_appdetails
+from steam_spy import get_previously_seen_app_ids_of_games, load_text_file
+
+PRICE_TABLE_COLUMNS = [
+    'appid',
+    'country_code',
+    'currency',
+    'initial',
+    'final',
+    'discount_percent',
+    'is_available',
+    'refreshed_on',
+]
+
+SUCCESSFUL_STATUS_CODE = 200
+
+
+def is_retryable(status_code):
+    # Too many requests, or an error of the server. Other errors, e.g. 400 for a bad country code, are not transient.
+    return status_code == 429 or (status_code is not None and status_code >= 500)
+
+
+def get_price_table_filename():
+    price_table_filename = steampi.json_utils.get_data_path() + 'prices.csv'
+
+    return price_table_filename
+
+
+def split_into_batches(app_ids, batch_size=100):
+    batches = []
+    for start in range(0, len(app_ids), batch_size):
+        end = start + batch_size
+        batches.append(app_ids[start:end])
+
+    return batches
+
+
+def parse_price_response(data, country_code, refreshed_on):
+    # Output: the rows of the price table. Apps without a price, e.g. free games, have empty prices. Apps for which the
+    # store did not succeed, e.g. apps which are not sold in the country anymore, are marked as unavailable, with empty
+    # prices, so that their previous prices are not shown as current.
+    rows = []
+
+    for app_id, response in data.items():
+        is_available = bool(response.get('success'))
+
+        # The store returns an empty list, instead of a dict, if there is no price.
+        price_overview = (response.get('data') or {}) if is_available else {}
+        price_overview = price_overview.get('price_overview', {})
+
+        rows.append(
+            {
+                'appid': str(app_id),
+                'country_code': country_code,
+                'currency': price_overview.get('currency'),
+                'initial': price_overview.get('initial'),
+                'final': price_overview.get('final'),
+                'discount_percent': price_overview.get('discount_percent'),
+                'is_available': is_available,
+                'refreshed_on': refreshed_on,
+            },
+        )
+
+    return rows
+
+
+def refresh_prices(
+    app_ids,
+    country_codes=None,
+    batch_size=100,
+    base_url=None,
+    query_rate_limit=QUERY_RATE_LIMIT,
+    wait_time=WAIT_TIME,
+    sleep_function=time.sleep,
+    max_retries=3,
+    verbose=True,
+):
+    # Output: the rows of the price table, the number of requests, and the batches which failed, as a list of
+    # (country code, appIDs, status code)
+    #
+    # A batch is retried at most max_retries times, after a wait, if the store throttles requests or fails. Batches
+    # which fail otherwise, e.g. with a bad country code, are skipped, and their previous prices are kept.
+
+    if country_codes is None:
+        country_codes = ['us']
+
+    refreshed_on = datetime.date.today().isoformat()
+
+    rows = []
+    failed_batches = []
+    query_count = 0
+    num_requests = 0
+
+    for country_code in country_codes:
+        for batch in split_into_batches(list(app_ids), batch_size):
+            if query_count >= query_rate_limit:
+                if verbose:
+                    print('Query limit {} reached. Wait for {} sec'.format(query_rate_limit, wait_time))
+                sleep_function(wait_time)
+                query_count = 0
+
+            data, status_code = download_appdetails(batch, ['price_overview'], country_code, base_url)
+            query_count += 1
+            num_requests += 1
+
+            num_retries = 0
+            while status_code != SUCCESSFUL_STATUS_CODE and is_retryable(status_code) and num_retries < max_retries:
+                if verbose:
+                    print('HTTP response {}. Wait for {} sec'.format(status_code, wait_time))
+                sleep_function(wait_time)
+                query_count = 0
+
+                data, status_code = download_appdetails(batch, ['price_overview'], country_code, base_url)
+                query_count += 1
+                num_requests += 1
+                num_retries += 1
+
+            if status_code != SUCCESSFUL_STATUS_CODE or data is None:
+                if verbose:
+                    print(
+                        'HTTP response {} for {} appIDs starting with {} (cc={}). Skipped.'.format(
+                            status_code,
+                            len(batch),
+                            batch[0],
+                            country_code,
+                        ),
+                    )
+                failed_batches.append((country_code, batch, status_code))
+                continue
+
+            rows += parse_price_response(data, country_code, refreshed_on)
+
+    return rows, num_requests, failed_batches
+
+
+def load_price_table(filename=None):
+    if filename is None:
+        filename = get_price_table_filename()
+
+    try:
+        with open(filename, newline='', encoding='utf8') as f:
+            rows = list(csv.DictReader(f))
+    except FileNotFoundError:
+        rows = []
+
+    return rows
+
+
+def save_price_table(rows, filename=None):
+    # New rows replace the previous rows of the same (appID, country code). Other previous rows are kept.
+    if filename is None:
+        filename = get_price_table_filename()
+
+    table = {(row['appid'], row['country_code']): row for row in load_price_table(filename)}
+    table.update({(row['appid'], row['country_code']): row for row in rows})
+
+    sorted_rows = [table[key] for key in sorted(table, key=lambda key: (int(key[0]), key[1]))]
+
+    with open(filename, 'w', newline='', encoding='utf8') as f:
+        writer = csv.DictWriter(f, fieldnames=PRICE_TABLE_COLUMNS)
+        writer.writeheader()
+        writer.writerows(sorted_rows)
+
+    return sorted_rows
+
+
+def main(args):
+    app_ids = sorted(load_text_file(get_previously_seen_app_ids_of_games()), key=int)
+
+    rows, num_requests, failed_batches = refresh_prices(
+        app_ids,
+        country_codes=args.country_code if len(args.country_code) > 0 else None,
+        batch_size=args.batch_size,
+    )
+
+    save_price_table(rows)
+
+    print('{} prices refreshed with {} requests, saved to {}'.format(len(rows), num_requests, get_price_table_filename()))
+    if len(failed_batches) > 0:
+        print('{} batches failed, and their previous prices were kept'.format(len(failed_batches)))
+
+    return rows
+
+
+if __name__ == '__main__':
+    from cli import main as cli_main
+
+    cli_main(['prices'] + sys.argv[1:])
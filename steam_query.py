@@ -0,0 +1,291 @@
+# Objective: answer ad-hoc questions about the aggregated database, e.g. free Linux games with controller support,
+# released since 2016, with a Metacritic score of at least 80.
+#
+# Each boolean flag, category and genre is stored as a bitmap, i.e. an array of bits packed into bytes, with one bit
+# per game. Each numeric column is stored as an array of values sorted once, so that a range filter is solved with a
+# binary search. A conjunctive query is then the intersection of bitmaps.
+
+import datetime
+import sys
+
+import numpy as np
+
+from analyze_steam_database import build_release_calendar, get_steam_calendar, get_steam_database
+
+NUMERIC_COLUMNS = [
+    'price_overview',
+    'metacritic',
+    'recommendations',
+    'achievements',
+    'dlc',
+    'required_age',
+    'release_date',
+]
+
+FLAG_COLUMNS = [
+    'is_free',
+    'windows_support',
+    'mac_support',
+    'linux_support',
+    'controller_support',
+    'demos',
+    'ext_user_account_notice',
+    'drm_support',
+    'is_released',
+]
+
+
+def convert_to_day_number(date):
+    if isinstance(date, str):
+        date = datetime.date.fromisoformat(date)
+
+    return np.datetime64(datetime.date(date.year, date.month, date.day), 'D').astype(
+        np.int64,
+    )
+
+
+def get_release_day_numbers(daily_calendar, app_ids):
+    # Release dates are parsed in the same way as for the plots, i.e. read from the daily calendar of
+    # analyze_steam_database.get_steam_calendar(). Unparsed or future release dates are missing.
+    release_day_by_app_id = {}
+    for release_date, app_ids_released_that_day in daily_calendar.items():
+        day_number = convert_to_day_number(release_date)
+        for app_id in app_ids_released_that_day:
+            release_day_by_app_id[app_id] = day_number
+
+    return np.array(
+        [release_day_by_app_id.get(app_id, np.nan) for app_id in app_ids],
+        dtype=np.float64,
+    )
+
+
+def get_daily_calendar(steam_database, use_cache=True):
+    # The daily calendar is cached by analyze_steam_database, so it should only be read from the cache if the database
+    # was loaded from the aggregated files, e.g. with get_steam_database().
+    return get_steam_calendar(steam_database, use_cache=use_cache, granularity='day', remove_current_period=False)
+
+
+def get_flag_value(game, flag):
+    if flag == 'is_released':
+        value = game['release_date']['is_released']
+    elif flag in ['windows_support', 'mac_support', 'linux_support']:
+        value = game['platforms'][flag.split('_')[0]]
+    elif flag == 'drm_support':
+        value = game['drm_notice'] is not None
+    else:
+        value = game[flag]
+
+    return bool(value)
+
+
+def build_numeric_column(values):
+    values = np.asarray(values, dtype=np.float64)
+
+    # NaN values are sorted last, and excluded from binary searches
+    order = np.argsort(values, kind='stable')
+    num_valid = int(np.count_nonzero(~np.isnan(values)))
+
+    column = {
+        'values': values,
+        'order': order,
+        'sorted_values': values[order][:num_valid],
+    }
+
+    return column
+
+
+def build_bitmaps_from_lists(lists_of_ids, num_games):
+    # Objective: build one bitmap per ID, e.g. per category, from the list of IDs of each game
+
+    positions = np.repeat(
+        np.arange(num_games),
+        [len(ids) for ids in lists_of_ids],
+    )
+    ids = np.fromiter(
+        (int(i) for ids in lists_of_ids for i in ids),
+        dtype=np.int64,
+        count=len(positions),
+    )
+
+    # Sort the (game, ID) pairs by ID once, so that the games of each ID are contiguous
+    order = np.argsort(ids, kind='stable')
+    unique_ids, starts = np.unique(ids[order], return_index=True)
+    ends = np.append(starts[1:], len(order))
+
+    bitmaps = {}
+    for current_id, start, end in zip(unique_ids, starts, ends):
+        mask = np.zeros(num_games, dtype=bool)
+        mask[positions[order[start:end]]] = True
+        bitmaps[int(current_id)] = np.packbits(mask)
+
+    return bitmaps
+
+
+def build_query_index(steam_database, daily_calendar=None):
+    # If the daily calendar is not provided, e.g. for a database which does not come from the aggregated files, it is
+    # built from the release dates of the database.
+    if daily_calendar is None:
+        daily_calendar = build_release_calendar(steam_database, granularity='day')
+
+    app_ids = np.array(list(steam_database.keys()))
+    num_games = len(app_ids)
+
+    index = {
+        'app_ids': app_ids,
+        'num_games': num_games,
+        'universe': np.packbits(np.ones(num_games, dtype=bool)),
+        'numeric': {},
+        'flags': {},
+    }
+
+    for column in NUMERIC_COLUMNS:
+        if column == 'release_date':
+            values = get_release_day_numbers(daily_calendar, app_ids)
+        else:
+            values = [
+                np.nan if steam_database[app_id][column] is None else float(steam_database[app_id][column])
+                for app_id in app_ids
+            ]
+        index['numeric'][column] = build_numeric_column(values)
+
+    for flag in FLAG_COLUMNS:
+        mask = np.array(
+            [get_flag_value(steam_database[app_id], flag) for app_id in app_ids],
+            dtype=bool,
+        )
+        index['flags'][flag] = np.packbits(mask)
+
+    index['categories'] = build_bitmaps_from_lists(
+        [steam_database[app_id]['categories'] for app_id in app_ids],
+        num_games,
+    )
+    index['genres'] = build_bitmaps_from_lists(
+        [steam_database[app_id]['genres'] for app_id in app_ids],
+        num_games,
+    )
+
+    return index
+
+
+def get_range_bitmap(index, column, minimum=None, maximum=None):
+    # Bounds are inclusive. Games with a missing value never match.
+
+    numeric_column = index['numeric'][column]
+    sorted_values = numeric_column['sorted_values']
+
+    if column == 'release_date':
+        minimum = None if minimum is None else convert_to_day_number(minimum)
+        maximum = None if maximum is None else convert_to_day_number(maximum)
+
+    lower = 0 if minimum is None else np.searchsorted(sorted_values, minimum, side='left')
+    upper = len(sorted_values) if maximum is None else np.searchsorted(sorted_values, maximum, side='right')
+
+    mask = np.zeros(index['num_games'], dtype=bool)
+    mask[numeric_column['order'][lower:upper]] = True
+
+    return np.packbits(mask)
+
+
+def get_empty_bitmap(index):
+    return np.zeros_like(index['universe'])
+
+
+def query_app_ids(
+    index,
+    flags=None,
+    categories=None,
+    genres=None,
+    ranges=None,
+):
+    # Input:
+    # - flags: dict flag -> bool, e.g. {'is_free': True, 'linux_support': True}
+    # - categories, genres: lists of IDs which the games must all have
+    # - ranges: dict column -> (minimum, maximum), with inclusive bounds and None for no bound,
+    #           e.g. {'metacritic': (80, None), 'release_date': ('2016-01-01', None)}
+    # Output: the list of matching appIDs
+
+    if flags is None:
+        flags = {}
+    if categories is None:
+        categories = []
+    if genres is None:
+        genres = []
+    if ranges is None:
+        ranges = {}
+
+    bitmaps = [index['universe']]
+
+    for flag, expected_value in flags.items():
+        bitmap = index['flags'][flag]
+        if not expected_value:
+            # The universe is used to mask the padding bits of the last byte.
+            bitmap = np.bitwise_and(np.invert(bitmap), index['universe'])
+        bitmaps.append(bitmap)
+
+    for categorie in categories:
+        bitmaps.append(index['categories'].get(int(categorie), get_empty_bitmap(index)))
+
+    for genre in genres:
+        bitmaps.append(index['genres'].get(int(genre), get_empty_bitmap(index)))
+
+    for column, (minimum, maximum) in ranges.items():
+        bitmaps.append(get_range_bitmap(index, column, minimum, maximum))
+
+    result = np.bitwise_and.reduce(bitmaps)
+
+    positions = np.flatnonzero(np.unpackbits(result, count=index['num_games']))
+
+    # Plain str appIDs, rather than NumPy strings
+    return index['app_ids'][positions].tolist()
+
+
+def parse_ranges(min_arguments, max_arguments, since=None, until=None):
+    ranges = {}
+
+    for arguments, bound_index in [(min_arguments, 0), (max_arguments, 1)]:
+        for argument in arguments:
+            column, value = argument.split('=')
+            if column != 'release_date':
+                value = float(value)
+            bounds = list(ranges.get(column, (None, None)))
+            bounds[bound_index] = value
+            ranges[column] = tuple(bounds)
+
+    if since is not None or until is not None:
+        bounds = list(ranges.get('release_date', (None, None)))
+        if since is not None:
+            bounds[0] = since
+        if until is not None:
+            bounds[1] = until
+        ranges['release_date'] = tuple(bounds)
+
+    return ranges
+
+
+def main(args):
+    steam_database, _, _ = get_steam_database(verbosity=False)
+
+    index = build_query_index(steam_database, get_daily_calendar(steam_database))
+
+    flags = {flag: True for flag in args.flag}
+    flags.update({flag: False for flag in args.no_flag})
+
+    app_ids = query_app_ids(
+        index,
+        flags=flags,
+        categories=args.categorie,
+        genres=args.genre,
+        ranges=parse_ranges(args.min, args.max, args.since, args.until),
+    )
+
+    print('#games = {}'.format(len(app_ids)))
+    for app_id in app_ids[: args.limit]:
+        print('{}\t{}'.format(app_id, steam_database[app_id]['name']))
+
+    return app_ids
+
+
+if __name__ == '__main__':
+    from cli import main as cli_main
+
+    cli_main(['query'] + sys.argv[1:])
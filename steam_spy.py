@@ -1,11 +1,13 @@
 import logging
+import os
 import pathlib
 import time
 
 import steampi.api
 import steampi.json_utils
-import steamspypi
 
+from appdetails_download import update_app_details
+from profiling import profiled_entry_point
 from steam_catalog_utils import load_steam_catalog
 
 
@@ -21,6 +23,13 @@ def get_previously_seen_app_ids_of_non_games():
     return log_filename
 
 
+def get_quarantined_app_ids_filename():
+    # AppIDs whose app details are bad, e.g. truncated files, as found by profile_corpus.py
+    log_filename = steampi.json_utils.get_data_path() + 'quarantined_appIDs.txt'
+
+    return log_filename
+
+
 def load_text_file(file_name):
     try:
         with open(file_name) as f:
@@ -31,6 +40,41 @@ def load_text_file(file_name):
     return file_content
 
 
+def get_app_details_file_stats(app_id):
+    # Output: the size and the modification time of the app details file, or None if there is no such file
+    try:
+        stats = os.stat(steampi.api.get_appdetails_filename(app_id))
+    except FileNotFoundError:
+        return None
+
+    return stats.st_size, stats.st_mtime_ns
+
+
+def load_quarantined_app_ids():
+    # Each line is an appID, followed by the size and the modification time of its file when it was scanned. An appID
+    # is released as soon as its file changes, e.g. after a new download, without waiting for the next scan.
+    #
+    # Caveat: contrary to load_text_file(), a missing file is not created, because it only exists after a scan.
+    try:
+        with open(get_quarantined_app_ids_filename()) as f:
+            entries = [line.split() for line in f]
+    except FileNotFoundError:
+        entries = []
+
+    quarantined_app_ids = set()
+    for entry in entries:
+        if len(entry) == 0:
+            continue
+
+        app_id = entry[0]
+        if len(entry) >= 3 and get_app_details_file_stats(app_id) != (int(entry[1]), int(entry[2])):
+            continue
+
+        quarantined_app_ids.add(app_id)
+
+    return quarantined_app_ids
+
+
 def load_previously_seen_app_ids(include_faulty_app_ids=True):
     previously_seen_app_ids = set()
 
@@ -48,19 +92,24 @@ def load_previously_seen_app_ids(include_faulty_app_ids=True):
     return previously_seen_app_ids
 
 
+@profiled_entry_point('scrape')
 def scrape_steam_data(
     import_my_own_steam_catalog=True,
     try_again_faulty_app_ids=False,
     allow_to_overwrite_existing_app_details=False,
     focus_on_probable_games=False,
+    request_profile='full',
 ):
+    # With a request profile other than 'full', e.g. 'refresh', the app details of every previously seen game are
+    # refreshed, i.e. only the fields of the profile are downloaded, and merged into the stored app details. The catalog
+    # is not needed, so that games which are missing from the current catalog are refreshed as well.
     logging.basicConfig(level=logging.DEBUG)
     logging.getLogger('requests').setLevel(logging.DEBUG)
-    log = logging.getLogger(__name__)
 
-    query_rate_limit = 200  # Number of queries which can be successfully issued during a 4-minute time window
-    wait_time = (4 * 60) + 10  # 4 minutes plus a cushion
-    successful_status_code = 200  # Status code for a successful HTTP response
+    if request_profile != 'full':
+        previously_seen_games = sorted(load_text_file(get_previously_seen_app_ids_of_games()), key=int)
+        download_app_details_of_app_ids(previously_seen_games, request_profile=request_profile)
+        return
 
     query_count = 0
 
@@ -72,6 +121,8 @@ def scrape_steam_data(
         if query_status_code is not None:
             query_count += 1
     else:
+        import steamspypi
+
         steam_catalog = steamspypi.load()
 
     all_app_ids = list(steam_catalog.keys())
@@ -96,10 +147,33 @@ def scrape_steam_data(
 
     unseen_app_ids = sorted(unseen_app_ids, key=int)
 
+    download_app_details_of_app_ids(
+        unseen_app_ids,
+        query_count=query_count,
+        allow_to_overwrite_existing_app_details=allow_to_overwrite_existing_app_details,
+    )
+
+
+@profiled_entry_point('download', count_items=len)
+def download_app_details_of_app_ids(
+    app_ids,
+    query_count=0,
+    allow_to_overwrite_existing_app_details=False,
+    request_profile='full',
+):
+    # With a request profile other than 'full', the app details are refreshed, and the logs of appIDs are left as-is.
+    log = logging.getLogger(__name__)
+
+    query_rate_limit = 200  # Number of queries which can be successfully issued during a 4-minute time window
+    wait_time = (4 * 60) + 10  # 4 minutes plus a cushion
+    successful_status_code = 200  # Status code for a successful HTTP response
+
+    is_refresh = request_profile != 'full'
+
     success_filename = get_previously_seen_app_ids_of_games()
     error_filename = get_previously_seen_app_ids_of_non_games()
 
-    for appID in unseen_app_ids:
+    for appID in app_ids:
         if query_count >= query_rate_limit:
             log.info(
                 "query count is %d ; limit %d reached. Wait for %d sec",
@@ -110,7 +184,9 @@ def scrape_steam_data(
             time.sleep(wait_time)
             query_count = 0
 
-        if allow_to_overwrite_existing_app_details:
+        if is_refresh:
+            (_, is_success, query_status_code) = update_app_details(appID, request_profile)
+        elif allow_to_overwrite_existing_app_details:
             (
                 loaded_app_details,
                 is_success,
@@ -137,10 +213,17 @@ def scrape_steam_data(
             time.sleep(wait_time)
             query_count = 0
 
-            (_, is_success, query_status_code) = steampi.api.load_app_details(appID)
+            if is_refresh:
+                (_, is_success, query_status_code) = update_app_details(appID, request_profile)
+            else:
+                (_, is_success, query_status_code) = steampi.api.load_app_details(appID)
             if query_status_code is not None:
                 query_count += 1
 
+        if is_refresh:
+            # The appID is already logged. If the game was removed from the store, its app details are kept.
+            continue
+
         appid_log_file_name = success_filename
         if (query_status_code is not None) and not is_success:
             if not (query_status_code == successful_status_code):
@@ -150,6 +233,8 @@ def scrape_steam_data(
         with open(appid_log_file_name, "a") as f:
             f.write(appID + '\n')
 
+    return app_ids
+
 
 if __name__ == '__main__':
     print('Scraping data from the web')
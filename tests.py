@@ -1,7 +1,35 @@
+import datetime
+import os
+import subprocess
+import sys
+import tempfile
 import unittest
+import unittest.mock
+
+import numpy as np
 
 import analyze_steam_database
+import app_details_extraction
+import benchmark_embeddings
+import benchmark_similar_games
+import benchmark_stages
+import build_game_map
 import build_tag_map
+import cli
+import compact_records
+import derived_data_cache
+import generate_synthetic_corpus
+import embedding_cache
+import label_placement
+import pipeline
+import profile_corpus
+import profiling
+import publisher_analytics
+import quantile_sketches
+import similar_games
+import steam_query
+import time_series_engine
+import time_series_export
 import steam_catalog_utils
 
 
@@ -15,6 +43,1623 @@ class TestAnalyzeSteamDatabaseMethods(unittest.TestCase):
         assert analyze_steam_database.main()
 
 
+def get_toy_steam_database(num_games=60):
+    steam_database = {}
+    for i in range(num_games):
+        app_id = str(10 * (i + 1))
+        steam_database[app_id] = {
+            'name': 'Game ' + app_id,
+            'steam_appid': int(app_id),
+            'required_age': 18 * (i % 5 == 0),
+            'is_free': bool(i % 7 == 0),
+            'developers': ['Developer ' + str(i % 4)],
+            'publishers': ['Publisher ' + str(i % 3)],
+            'price_overview': None if i % 7 == 0 else 499 + 100 * (i % 10),
+            'platforms': {'windows': True, 'mac': bool(i % 2), 'linux': bool(i % 3 == 0)},
+            'metacritic': 60 + (i % 30) if i % 4 == 0 else None,
+            'categories': [2] if i % 2 else [1, 2],
+            'genres': [1, 23] if i % 3 else [23],
+            'recommendations': 10 * i,
+            'achievements': i % 12,
+            'release_date': {
+                'date': '{} {}, {}'.format(
+                    ['Jan', 'Mar', 'Jun', 'Sep'][i % 4],
+                    1 + i % 28,
+                    2015 + i % 4,
+                ),
+                'is_released': bool(i % 11 != 0),
+            },
+            'dlc': i % 3,
+            'demos': bool(i % 5 == 0),
+            'controller_support': bool(i % 2 == 0),
+            'drm_notice': 'Denuvo' if i % 6 == 0 else None,
+            'ext_user_account_notice': bool(i % 8 == 0),
+        }
+
+    steam_database = analyze_steam_database.fill_in_platform_support(steam_database)
+    steam_database = analyze_steam_database.fill_in_drm_support(steam_database)
+
+    return steam_database
+
+
+class TestRenderPlotJobsMethods(unittest.TestCase):
+    def test_render_plot_jobs(self):
+        steam_database = get_toy_steam_database()
+        release_calendar, _ = analyze_steam_database.build_steam_calendar(steam_database)
+        release_calendar = analyze_steam_database.simplify_calendar(release_calendar)
+
+        plot_jobs = [
+            analyze_steam_database.compute_time_series_for_numeric_variable_of_interest(
+                release_calendar,
+            ),
+            analyze_steam_database.compute_time_series_for_numeric_variable_of_interest(
+                release_calendar,
+                steam_database,
+                'Median',
+                'price_overview',
+            ),
+            analyze_steam_database.compute_time_series_for_numeric_variable_of_interest(
+                release_calendar,
+                steam_database,
+                'Sum',
+                'drm_support',
+            ),
+        ]
+
+        current_dir = os.getcwd()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            os.chdir(temp_dir)
+            try:
+                rendered = analyze_steam_database.render_plot_jobs(plot_jobs, num_workers=2)
+                for base_plot_filename in rendered:
+                    full_plot_filename = analyze_steam_database.get_full_plot_filename(
+                        base_plot_filename,
+                    )
+                    assert os.path.exists(full_plot_filename)
+            finally:
+                os.chdir(current_dir)
+
+        assert rendered == [plot_job['base_plot_filename'] for plot_job in plot_jobs]
+
+
+class TestConfidenceIntervalMethods(unittest.TestCase):
+    def test_get_mean_and_confidence_interval(self):
+        rng = np.random.default_rng(0)
+        x_list = [list(rng.integers(0, 100, size=n)) for n in [1, 5, 17, 40]]
+
+        (mean, lb, ub) = analyze_steam_database.get_mean_and_confidence_interval(x_list)
+
+        for i, xi in enumerate(x_list):
+            sig = np.std(xi) / np.sqrt(len(xi))
+            assert np.isclose(mean[i], np.mean(xi))
+            assert np.isclose(ub[i], np.mean(xi) + 1.95996398454 * sig)
+            assert np.isclose(lb[i], np.mean(xi) - 1.95996398454 * sig)
+
+        x_list = [[0, 1, 1], [1] * 10, [0] * 4 + [1]]
+        (mean, lb, ub) = analyze_steam_database.get_mean_and_confidence_interval(
+            x_list,
+            is_variable_of_interest_numeric=False,
+        )
+        assert np.all((lb >= 0) & (lb <= mean) & (mean <= ub) & (ub <= 1))
+
+    def test_get_median_and_bootstrap_confidence_interval(self):
+        rng = np.random.default_rng(1)
+        x_list = [list(rng.exponential(scale=10, size=n)) for n in [1, 2, 30, 101]]
+        (values, offsets) = analyze_steam_database.flatten_feature_list(x_list)
+
+        num_resamples = 4000
+        (
+            median,
+            lb,
+            ub,
+        ) = analyze_steam_database.get_median_and_bootstrap_confidence_interval_from_segments(
+            values,
+            offsets,
+            num_resamples=num_resamples,
+            seed=0,
+        )
+
+        for i, xi in enumerate(x_list):
+            assert np.isclose(median[i], np.median(xi))
+
+            # Compare with an explicit bootstrap
+            resamples = rng.choice(xi, size=(num_resamples, len(xi)), replace=True)
+            expected_lb, expected_ub = np.percentile(np.median(resamples, axis=1), [2.5, 97.5])
+            tolerance = 0.1 * (np.max(xi) - np.min(xi)) + 1e-9
+            assert abs(lb[i] - expected_lb) <= tolerance
+            assert abs(ub[i] - expected_ub) <= tolerance
+
+
+class TestDerivedDataCacheMethods(unittest.TestCase):
+    def test_load_or_compute(self):
+        current_dir = os.getcwd()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            os.chdir(temp_dir)
+            try:
+                os.mkdir('data')
+                input_filename = 'data/input.txt'
+                with open(input_filename, 'w') as f:
+                    f.write('1')
+
+                num_calls = []
+
+                def compute_function():
+                    num_calls.append(1)
+                    with open(input_filename) as f:
+                        return int(f.read())
+
+                for _ in range(2):
+                    data = derived_data_cache.load_or_compute(
+                        'toy',
+                        [input_filename],
+                        compute_function,
+                    )
+                    assert data == 1
+                assert len(num_calls) == 1
+
+                with open(input_filename, 'w') as f:
+                    f.write('2')
+
+                data = derived_data_cache.load_or_compute(
+                    'toy',
+                    [input_filename],
+                    compute_function,
+                )
+                assert data == 2
+                assert len(num_calls) == 2
+                assert len(os.listdir(derived_data_cache.get_cache_folder())) == 1
+            finally:
+                os.chdir(current_dir)
+
+
+class TestCliMethods(unittest.TestCase):
+    def test_get_parser(self):
+        args = cli.get_parser().parse_args(['analyze', '--num-workers', '2'])
+        assert args.func == cli.run_analyze
+        assert args.num_workers == 2
+
+    def test_lazy_imports(self):
+        snippet = (
+            'import sys, cli; cli.load_subsystem("tag-map"); '
+            'assert "umap" not in sys.modules; '
+            'assert "matplotlib" not in sys.modules'
+        )
+        subprocess.run([sys.executable, '-c', snippet], check=True)
+
+        snippet = 'import sys, cli; cli.load_subsystem("aggregate"); assert "numpy" not in sys.modules'
+        subprocess.run([sys.executable, '-c', snippet], check=True)
+
+
+class TestTimeSeriesExportMethods(unittest.TestCase):
+    def test_export_and_incremental_rendering(self):
+        steam_database = get_toy_steam_database()
+        release_calendar = analyze_steam_database.build_release_calendar(steam_database)
+
+        plot_jobs = analyze_steam_database.compute_durante_request(
+            release_calendar,
+            steam_database,
+        )
+        plot_jobs.append(
+            analyze_steam_database.compute_time_series_for_numeric_variable_of_interest(
+                release_calendar,
+                steam_database,
+                'Average',
+                'price_overview',
+            ),
+        )
+
+        current_dir = os.getcwd()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            os.chdir(temp_dir)
+            try:
+                all_time_series = time_series_export.export_plot_jobs(plot_jobs)
+                assert 'lb' in all_time_series['average_price']
+                assert os.path.exists('exports/average_price.csv')
+                columnar_data = np.load('exports/time_series.npz')
+                assert np.allclose(
+                    columnar_data['average_price/values'],
+                    plot_jobs[-1]['y_list'],
+                )
+
+                rendered = analyze_steam_database.render_plot_jobs_incrementally(
+                    plot_jobs,
+                    num_workers=1,
+                )
+                assert len(rendered) == len(plot_jobs)
+
+                rendered = analyze_steam_database.render_plot_jobs_incrementally(
+                    plot_jobs,
+                    num_workers=1,
+                )
+                assert len(rendered) == 0
+
+                plot_jobs[0]['chosen_title'] = 'New title'
+                rendered = analyze_steam_database.render_plot_jobs_incrementally(
+                    plot_jobs,
+                    num_workers=1,
+                )
+                assert rendered == [plot_jobs[0]['base_plot_filename']]
+            finally:
+                os.chdir(current_dir)
+
+
+class TestTimeSeriesEngineMethods(unittest.TestCase):
+    def test_get_period_start(self):
+        date = datetime.date(2019, 8, 15)  # Thursday
+        expected = {
+            'day': datetime.date(2019, 8, 15),
+            'week': datetime.date(2019, 8, 12),
+            'month': datetime.date(2019, 8, 1),
+            'quarter': datetime.date(2019, 7, 1),
+            'year': datetime.date(2019, 1, 1),
+        }
+        for granularity in time_series_engine.GRANULARITIES:
+            assert time_series_engine.get_period_start(date, granularity) == expected[granularity]
+
+    def test_build_multi_granularity_series(self):
+        rng = np.random.default_rng(0)
+        dates = [
+            datetime.date(2018, 1, 1) + datetime.timedelta(days=int(i))
+            for i in rng.integers(0, 700, size=500)
+        ]
+        values = rng.integers(0, 2, size=len(dates))
+        today = datetime.date(2019, 11, 20)
+
+        all_series = time_series_engine.build_multi_granularity_series(
+            dates,
+            values,
+            today=today,
+        )
+
+        for granularity, series in all_series.items():
+            assert series['counts'].sum() == len(dates)
+            assert series['sums'].sum() == values.sum()
+            assert series['is_partial'][-1]
+            assert not series['is_partial'][0]
+
+        series = all_series['month']
+        assert len(series['periods']) == 23
+        rolling_mean = time_series_engine.compute_rolling_mean(series, window=3)
+        for i in range(len(series['periods'])):
+            lower = max(0, i - 2)
+            expected = series['sums'][lower:i + 1].sum() / series['counts'][lower:i + 1].sum()
+            assert np.isclose(rolling_mean[i], expected)
+
+        complete_series = time_series_engine.drop_partial_periods(series)
+        assert len(complete_series['periods']) == 22
+
+    def test_compute_release_trends(self):
+        steam_database = get_toy_steam_database()
+        released_app_ids = [app_id for app_id in steam_database if steam_database[app_id]['release_date']['is_released']]
+        daily_calendar = analyze_steam_database.build_release_calendar(steam_database, granularity='day')
+        today = datetime.date(2019, 9, 20)
+
+        release_series, app_ids = analyze_steam_database.compute_release_series(daily_calendar, today=today)
+        assert sorted(release_series) == sorted(analyze_steam_database.CHARTED_GRANULARITIES)
+
+        # The monthly calendar is read from the monthly series, as from simplify_calendar().
+        monthly_calendar = time_series_engine.group_by_period(release_series['month'], app_ids)
+        expected_calendar = analyze_steam_database.build_release_calendar(steam_database)
+        assert sorted(monthly_calendar) == sorted(expected_calendar)
+        for month in expected_calendar:
+            assert sorted(monthly_calendar[month]) == sorted(expected_calendar[month])
+
+        plot_jobs = analyze_steam_database.compute_release_trends(release_series, app_ids, steam_database)
+        plot_jobs = {plot_job['base_plot_filename']: plot_job for plot_job in plot_jobs}
+
+        assert sorted(plot_jobs) == [
+            'num_releases_per_quarter',
+            'num_releases_per_week',
+            'num_releases_per_year',
+            'rolling_average_price',
+            'rolling_proportion_drm_support',
+        ]
+
+        assert sum(plot_jobs['num_releases_per_week']['y_list']) == len(released_app_ids)
+        assert sum(plot_jobs['num_releases_per_quarter']['y_list']) == len(released_app_ids)
+        assert sum(plot_jobs['num_releases_per_year']['y_list']) == len(released_app_ids)
+        assert plot_jobs['num_releases_per_year']['x_list'] == [datetime.date(year, 1, 1) for year in range(2015, 2019)]
+
+        # Periods which are not over yet are dropped: July 2018 and later, the third quarter of 2018, the year 2018.
+        release_series, app_ids = analyze_steam_database.compute_release_series(
+            daily_calendar,
+            today=datetime.date(2018, 7, 15),
+        )
+        release_dates = [steam_database[app_id]['release_date']['date'] for app_id in released_app_ids]
+        num_releases_in_2018 = len([date for date in release_dates if date.endswith('2018')])
+        num_releases_in_september_2018 = len([date for date in release_dates if date.endswith('2018') and 'Sep' in date])
+        assert release_series['quarter']['counts'].sum() == len(released_app_ids) - num_releases_in_september_2018
+        assert release_series['year']['counts'].sum() == len(released_app_ids) - num_releases_in_2018
+        monthly_calendar = time_series_engine.group_by_period(release_series['month'], app_ids)
+        assert max(monthly_calendar) == datetime.date(2017, 6, 1)
+        assert sum(len(month_app_ids) for month_app_ids in monthly_calendar.values()) == (
+            len(released_app_ids) - num_releases_in_september_2018
+        )
+
+        # Trailing means over 16 months, i.e. from June 2017 to September 2018, computed from every game of these months.
+        release_series, app_ids = analyze_steam_database.compute_release_series(daily_calendar, today=today)
+        plot_jobs = analyze_steam_database.compute_release_trends(release_series, app_ids, steam_database, window=16)
+        price_job, drm_job = plot_jobs[-2:]
+        assert price_job['x_list'][-1] == drm_job['x_list'][-1] == datetime.date(2018, 9, 1)
+        # In the toy database, games are released in January 2015, March 2016, June 2017 and September 2018.
+        recent_app_ids = [
+            app_id for app_id in released_app_ids if steam_database[app_id]['release_date']['date'][:3] in ['Jun', 'Sep']
+        ]
+        recent_prices = [
+            steam_database[app_id]['price_overview'] / 100
+            for app_id in recent_app_ids
+            if steam_database[app_id]['price_overview'] is not None
+        ]
+        assert np.isclose(price_job['y_list'][-1], np.mean(recent_prices))
+        recent_drm = [steam_database[app_id]['drm_support'] for app_id in recent_app_ids]
+        assert np.isclose(drm_job['y_list'][-1], np.mean(recent_drm))
+
+    def test_simplify_calendar(self):
+        release_calendar = {
+            datetime.datetime(2019, 8, 15): ['10'],
+            datetime.datetime(2019, 8, 16): ['20'],
+            datetime.datetime(2019, 9, 1): ['30'],
+        }
+        monthly_calendar = analyze_steam_database.simplify_calendar(release_calendar)
+        assert monthly_calendar == {
+            datetime.date(2019, 8, 1): ['10', '20'],
+            datetime.date(2019, 9, 1): ['30'],
+        }
+        assert release_calendar[datetime.datetime(2019, 8, 15)] == ['10']
+
+
+class TestSteamQueryMethods(unittest.TestCase):
+    def test_query_app_ids(self):
+        steam_database = get_toy_steam_database()
+        index = steam_query.build_query_index(steam_database)
+
+        app_ids = steam_query.query_app_ids(
+            index,
+            flags={'linux_support': True, 'controller_support': True, 'is_free': False},
+            genres=[23],
+            ranges={'metacritic': (70, None), 'release_date': ('2015-01-15', None)},
+        )
+
+        release_calendar, _ = analyze_steam_database.build_steam_calendar(steam_database)
+        released_since_mid_january = {
+            app_id
+            for release_date, released_app_ids in release_calendar.items()
+            if release_date >= datetime.datetime(2015, 1, 15)
+            for app_id in released_app_ids
+        }
+        expected_app_ids = [
+            app_id
+            for app_id, game in steam_database.items()
+            if game['platforms']['linux']
+            and game['controller_support']
+            and not game['is_free']
+            and 23 in game['genres']
+            and game['metacritic'] is not None
+            and game['metacritic'] >= 70
+            and app_id in released_since_mid_january
+        ]
+
+        assert len(expected_app_ids) > 0
+        assert app_ids == expected_app_ids
+        assert all(type(app_id) is str for app_id in app_ids)
+
+        # With a daily calendar, e.g. the cached one, release dates are not parsed again.
+        daily_calendar = analyze_steam_database.build_release_calendar(steam_database, granularity='day')
+        with unittest.mock.patch.object(analyze_steam_database, 'build_steam_calendar') as build_steam_calendar:
+            index = steam_query.build_query_index(steam_database, daily_calendar)
+            publisher_analytics.build_entity_index(steam_database, daily_calendar=daily_calendar)
+        assert not build_steam_calendar.called
+        assert steam_query.query_app_ids(index, ranges={'release_date': ('2015-01-15', None)}) == [
+            app_id for app_id in steam_database if app_id in released_since_mid_january
+        ]
+
+
+class TestQuantileSketchesMethods(unittest.TestCase):
+    def test_get_quantile(self):
+        rng = np.random.default_rng(0)
+        values = rng.lognormal(mean=5, sigma=2, size=20000).round()
+
+        accuracy = 0.05
+        capacity = quantile_sketches.get_sketch_capacity(accuracy, max_count=len(values))
+
+        # Sketches are updated with chunks of values, then merged
+        sketch = quantile_sketches.create_sketch(capacity)
+        other_sketch = quantile_sketches.create_sketch(capacity)
+        for chunk in np.array_split(values[:12000], 7):
+            quantile_sketches.update_sketch(sketch, chunk)
+        quantile_sketches.update_sketch(other_sketch, values[12000:])
+        sketch = quantile_sketches.merge_sketches(sketch, other_sketch)
+
+        assert sketch['n'] == len(values)
+        assert sketch['max_rank_error'] > 0
+
+        rank_error_bound = quantile_sketches.get_rank_error_bound(sketch)
+        assert rank_error_bound <= accuracy * len(values)
+
+        sorted_values = np.sort(values)
+        for q in [0.1, 0.5, 0.9]:
+            estimate = quantile_sketches.get_quantile(sketch, q)
+            lowest_rank = np.searchsorted(sorted_values, estimate, side='left')
+            highest_rank = np.searchsorted(sorted_values, estimate, side='right')
+            target_rank = q * len(values)
+            rank_error = max(0, lowest_rank - target_rank, target_rank - highest_rank)
+            assert rank_error <= rank_error_bound
+
+    def test_update_monthly_sketches(self):
+        steam_database = get_toy_steam_database()
+
+        # The sketches are updated with the database as it grows, as when data is aggregated.
+        monthly_sketches = quantile_sketches.create_monthly_sketches()
+        games = list(steam_database.items())
+        for num_games in [25, len(games)]:
+            quantile_sketches.update_monthly_sketches(monthly_sketches, dict(games[:num_games]))
+
+        def assert_sketched_medians_are_exact(steam_database, release_calendar, expect_sketches_to_be_used=True):
+            for keyword in ['price_overview', 'achievements']:
+                exact_plot_job = analyze_steam_database.compute_time_series_for_numeric_variable_of_interest(
+                    release_calendar,
+                    steam_database,
+                    'Median',
+                    keyword,
+                )
+                with unittest.mock.patch.object(
+                    quantile_sketches,
+                    'get_quantile',
+                    wraps=quantile_sketches.get_quantile,
+                ) as get_quantile:
+                    sketched_plot_job = analyze_steam_database.compute_time_series_for_numeric_variable_of_interest(
+                        release_calendar,
+                        steam_database,
+                        'Median',
+                        keyword,
+                        monthly_sketches=monthly_sketches,
+                    )
+                assert get_quantile.called == expect_sketches_to_be_used
+                assert np.allclose(exact_plot_job['y_list'], sketched_plot_job['y_list'])
+
+        release_calendar = analyze_steam_database.build_release_calendar(steam_database)
+        assert_sketched_medians_are_exact(steam_database, release_calendar)
+
+        # A subset of games, e.g. selected by a query, falls back to exact medians.
+        restricted_calendar = analyze_steam_database.restrict_calendar_to_app_ids(release_calendar, list(steam_database)[:45])
+        assert_sketched_medians_are_exact(steam_database, restricted_calendar, expect_sketches_to_be_used=False)
+
+        # Games whose values change, or which leave the database, are replaced in the sketches.
+        steam_database = {app_id: dict(game) for app_id, game in steam_database.items()}
+        app_ids = list(steam_database)
+        steam_database[app_ids[1]]['price_overview'] = 99999
+        steam_database[app_ids[2]]['achievements'] = 500
+        del steam_database[app_ids[3]]
+        quantile_sketches.update_monthly_sketches(monthly_sketches, steam_database)
+        assert all(app_ids[3] not in month_digests for month_digests in monthly_sketches['app_digests'].values())
+
+        release_calendar = analyze_steam_database.build_release_calendar(steam_database)
+        assert_sketched_medians_are_exact(steam_database, release_calendar)
+
+        # Without any change, no release date is parsed again.
+        with unittest.mock.patch.object(
+            analyze_steam_database,
+            'parse_release_date',
+            wraps=analyze_steam_database.parse_release_date,
+        ) as parse_release_date:
+            quantile_sketches.update_monthly_sketches(monthly_sketches, steam_database)
+        assert not parse_release_date.called
+
+        # The same number of games, but not the same games, falls back to exact medians.
+        x, y_raw = analyze_steam_database.get_x_y_time_series(release_calendar, steam_database, 'price_overview')
+        assert quantile_sketches.get_monthly_quantiles(monthly_sketches, 'price_overview', x, app_ids_per_month=y_raw)
+        y_raw[0] = y_raw[0][:-1] + ['123456789']
+        assert quantile_sketches.get_monthly_quantiles(monthly_sketches, 'price_overview', x, app_ids_per_month=y_raw) is None
+
+
+def get_toy_categories_and_genres():
+    categories_dict = {'1': 'Multi-player', '2': 'Single-player', '9': 'Co-op'}
+    genres_dict = {'1': 'Action', '23': 'Indie', '25': 'Adventure'}
+
+    return categories_dict, genres_dict
+
+
+class TestPreprocessDataMethods(unittest.TestCase):
+    def test_preprocess_data(self):
+        steam_database = get_toy_steam_database()
+        categories_dict, genres_dict = get_toy_categories_and_genres()
+
+        joint_matrix, tags_list = build_tag_map.preprocess_data(
+            steam_database,
+            categories_dict,
+            genres_dict,
+        )
+
+        assert joint_matrix.dtype == np.uint8
+        assert joint_matrix.shape == (len(tags_list), len(steam_database))
+        assert tags_list == sorted(list(categories_dict.values()) + list(genres_dict.values()))
+
+        # Reference: the former dense construction, with a linear scan of the list of tags
+        expected_matrix = np.zeros(joint_matrix.shape)
+        for j, app_id in enumerate(steam_database):
+            current_tags = [
+                categories_dict[str(i)] for i in steam_database[app_id]['categories'] if str(i) in categories_dict
+            ]
+            current_tags += [genres_dict[str(i)] for i in steam_database[app_id]['genres'] if str(i) in genres_dict]
+            for tag in current_tags:
+                expected_matrix[tags_list.index(tag)][j] += 1
+
+        assert np.array_equal(joint_matrix.toarray(), expected_matrix)
+
+
+def get_toy_tag_joint_game_matrix(num_tags=40, num_games=2000, seed=0):
+    import scipy.sparse
+
+    rng = np.random.default_rng(seed)
+    tag_frequencies = rng.uniform(0.01, 0.5, size=num_tags)
+    dense_matrix = rng.random((num_tags, num_games)) < tag_frequencies[:, None]
+
+    return scipy.sparse.csr_matrix(dense_matrix, dtype=np.uint8)
+
+
+def get_toy_clustered_tag_joint_game_matrix(num_tags=40, num_games=2000, seed=0, num_clusters=5):
+    # Tags and games belong to clusters, and a game is more likely to have the tags of its cluster, so that the map
+    # has a structure, which a small change of the games does not upset.
+    import scipy.sparse
+
+    rng = np.random.default_rng(seed)
+    tag_clusters = np.arange(num_tags) % num_clusters
+    game_clusters = rng.integers(num_clusters, size=num_games)
+    tag_probabilities = np.where(tag_clusters[:, None] == game_clusters[None, :], 0.4, 0.05)
+    dense_matrix = rng.random((num_tags, num_games)) < tag_probabilities
+
+    return scipy.sparse.csr_matrix(dense_matrix, dtype=np.uint8)
+
+
+class TestTagCorrelationDistancesMethods(unittest.TestCase):
+    def test_compute_tag_correlation_distances(self):
+        from scipy.spatial.distance import pdist, squareform
+
+        joint_matrix = get_toy_tag_joint_game_matrix()
+        distances = build_tag_map.compute_tag_correlation_distances(joint_matrix)
+
+        expected_distances = squareform(
+            pdist(joint_matrix.toarray().astype(float), metric='correlation'),
+        )
+        assert np.allclose(distances, expected_distances)
+
+    def test_compute_tag_map(self):
+        import scipy.sparse
+        from scipy.spatial import procrustes
+
+        joint_matrix = get_toy_clustered_tag_joint_game_matrix()
+
+        current_dir = os.getcwd()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            os.chdir(temp_dir)
+            try:
+                embedding = build_tag_map.compute_tag_map(joint_matrix, 't-SNE')
+                assert embedding.shape == (joint_matrix.shape[0], 2)
+                # One file for the distances, and one for the layout
+                assert len(os.listdir(derived_data_cache.get_cache_folder())) == 2
+
+                assert np.array_equal(build_tag_map.compute_tag_map(joint_matrix, 't-SNE'), embedding)
+
+                # A few more games: the layout is warm-started, and stays close to the previous one. For reference,
+                # the disparity of a cold start is about 0.7 for these games.
+                new_joint_matrix = scipy.sparse.hstack(
+                    [joint_matrix, get_toy_clustered_tag_joint_game_matrix(num_games=100, seed=1)],
+                ).tocsr()
+                new_embedding = build_tag_map.compute_tag_map(new_joint_matrix, 't-SNE')
+                assert new_embedding.shape == embedding.shape
+                _, _, disparity = procrustes(embedding, new_embedding)
+                assert disparity < 0.05
+            finally:
+                os.chdir(current_dir)
+
+
+class TestEmbeddingCacheMethods(unittest.TestCase):
+    def test_align_layout(self):
+        rng = np.random.default_rng(0)
+        labels = [str(i) for i in range(20)]
+        previous_embedding = rng.normal(size=(20, 2))
+        previous_layout = {'labels': np.array(labels), 'embedding': previous_embedding}
+
+        angle = 1.0
+        rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+        embedding = previous_embedding @ rotation + 5
+
+        aligned_embedding = embedding_cache.align_layout(embedding, previous_layout, labels)
+        assert np.allclose(aligned_embedding, previous_embedding)
+
+    def test_load_or_compute_embedding(self):
+        rng = np.random.default_rng(0)
+        points = rng.normal(size=(30, 2))
+        labels = ['tag {}'.format(i) for i in range(30)]
+        parameters = {'embedding_name': 'toy'}
+
+        def get_distances(points):
+            return np.linalg.norm(points[:, None] - points[None, :], axis=2)
+
+        inits = []
+
+        def get_compute_function(points):
+            def compute_function(init):
+                inits.append(init)
+                return points + rng.normal(scale=0.01, size=points.shape)
+
+            return compute_function
+
+        current_dir = os.getcwd()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            os.chdir(temp_dir)
+            try:
+                distances = get_distances(points)
+                embedding, status = embedding_cache.load_or_compute_embedding(
+                    'toy', distances, labels, parameters, get_compute_function(points),
+                )
+                assert status == 'cold'
+
+                same_embedding, status = embedding_cache.load_or_compute_embedding(
+                    'toy', distances, labels, parameters, get_compute_function(points),
+                )
+                assert status == 'hit'
+                assert np.array_equal(same_embedding, embedding)
+                assert len(inits) == 1
+
+                # A new tag, and slightly different distances
+                new_points = np.vstack([points, points[:1] + 0.01])
+                new_labels = labels + ['new tag']
+                _, status = embedding_cache.load_or_compute_embedding(
+                    'toy', get_distances(new_points) * 1.001, new_labels, parameters, get_compute_function(new_points),
+                )
+                assert status == 'warm'
+                assert np.allclose(inits[-1][:30], embedding)
+
+                _, status = embedding_cache.load_or_compute_embedding(
+                    'toy', get_distances(new_points) * 2, new_labels, parameters, get_compute_function(new_points),
+                )
+                assert status == 'cold'
+            finally:
+                os.chdir(current_dir)
+
+
+class TestLabelPlacementMethods(unittest.TestCase):
+    def test_place_labels(self):
+        rng = np.random.default_rng(0)
+        num_labels = 3000
+        points = rng.random((num_labels, 2))
+        labels = ['tag {}'.format(i) for i in range(num_labels)]
+        priorities = np.zeros(num_labels)
+        priorities[:10] = 1
+
+        placement = label_placement.place_labels(points, labels, priorities=priorities)
+
+        is_visible = placement['is_visible']
+        assert is_visible[:10].all()
+        assert 0 < is_visible.sum() < num_labels
+
+        # Rebuild the boxes of visible labels, and check that no two of them overlap.
+        widths = 0.007 * np.array([len(label) for label in labels])
+        left_fractions = np.array(
+            [{'left': 0, 'center': 0.5, 'right': 1}[ha] for ha in placement['horizontal_alignments']],
+        )
+        bottom_fractions = np.array(
+            [{'bottom': 0, 'center': 0.5, 'top': 1}[va] for va in placement['vertical_alignments']],
+        )
+        x_min = (placement['x'] - left_fractions * widths)[is_visible]
+        y_min = (placement['y'] - bottom_fractions * 0.018)[is_visible]
+        x_max = x_min + widths[is_visible]
+        y_max = y_min + 0.018
+
+        overlaps = (
+            (x_min[:, None] < x_max[None, :] - 1e-12)
+            & (x_min[None, :] < x_max[:, None] - 1e-12)
+            & (y_min[:, None] < y_max[None, :] - 1e-12)
+            & (y_min[None, :] < y_max[:, None] - 1e-12)
+        )
+        np.fill_diagonal(overlaps, False)
+        assert not overlaps.any()
+
+    def test_place_labels_without_hiding(self):
+        points = np.array([[0.5, 0.5], [0.5, 0.5], [0.5, 0.5]])
+        labels = ['a', 'b', 'c']
+
+        placement = label_placement.place_labels(points, labels, hide_colliding_labels=False)
+        assert placement['is_visible'].all()
+
+
+class TestBuildGameMapMethods(unittest.TestCase):
+    def test_build_game_feature_matrix(self):
+        steam_database = get_toy_steam_database()
+        categories_dict, genres_dict = get_toy_categories_and_genres()
+
+        features, feature_names = build_game_map.build_game_feature_matrix(
+            steam_database,
+            categories_dict,
+            genres_dict,
+            numeric_features=build_game_map.NUMERIC_FEATURES,
+        )
+
+        num_tags = len(categories_dict) + len(genres_dict)
+        assert features.shape == (len(steam_database), num_tags + len(build_game_map.NUMERIC_FEATURES))
+        assert feature_names[num_tags:] == build_game_map.NUMERIC_FEATURES
+        assert np.isfinite(features.toarray()).all()
+
+        primary_genres, genre_names = build_game_map.get_primary_genres(steam_database, genres_dict)
+        assert genre_names == ['Action', 'Adventure', 'Indie']
+        assert list(primary_genres[:3]) == [2, 0, 0]
+
+    def test_rasterize_embedding(self):
+        rng = np.random.default_rng(0)
+        num_games = 100000
+        embedding = rng.normal(size=(num_games, 2))
+        categories = rng.integers(-1, 5, size=num_games)
+
+        raster = build_game_map.rasterize_embedding(embedding, categories, num_categories=5, bins=64)
+
+        assert raster['density'].shape == (64, 64)
+        # Only a few outliers are outside of the extent.
+        assert raster['density'].sum() > 0.98 * num_games
+        assert raster['dominant_categories'].min() >= -1
+        assert raster['dominant_categories'].max() < 5
+
+        # A pixel with games of a single categorie
+        embedding = np.array([[0.0, 0.0], [0.0, 0.0], [1.0, 1.0]])
+        raster = build_game_map.rasterize_embedding(embedding, [3, 3, 1], num_categories=4, bins=2)
+        assert raster['dominant_categories'][0, 0] == 3
+        assert raster['dominant_categories'][1, 1] == 1
+        assert raster['dominant_categories'][0, 1] == -1
+
+    def test_plot_game_map(self):
+        steam_database = get_toy_steam_database()
+        categories_dict, genres_dict = get_toy_categories_and_genres()
+
+        features, _ = build_game_map.build_game_feature_matrix(steam_database, categories_dict, genres_dict)
+        embedding = build_game_map.compute_game_embedding(features, embedding_name='SVD')
+        assert embedding.shape == (len(steam_database), 2)
+
+        primary_genres, genre_names = build_game_map.get_primary_genres(steam_database, genres_dict)
+        raster = build_game_map.rasterize_embedding(embedding, primary_genres, len(genre_names), bins=32)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            plot_filename = os.path.join(temp_dir, 'game_map.png')
+            build_game_map.plot_game_map(raster, plot_filename, category_names=genre_names)
+            assert os.path.exists(plot_filename)
+
+
+class TestSimilarGamesMethods(unittest.TestCase):
+    def test_query_top_k(self):
+        vectors = benchmark_similar_games.generate_synthetic_vectors(2000)
+        index = similar_games.build_similarity_index(vectors, np.arange(2000), ['Game {}'.format(i) for i in range(2000)])
+
+        query_rows = np.arange(0, 2000, 7)
+        neighbor_rows, similarities = similar_games.query_top_k(index, query_rows, k=10, batch_size=64)
+
+        dense_vectors = vectors.toarray()
+        dense_vectors /= np.linalg.norm(dense_vectors, axis=1, keepdims=True)
+        expected_scores = dense_vectors[query_rows] @ dense_vectors.T
+        expected_scores[np.arange(len(query_rows)), query_rows] = -np.inf
+        expected_similarities = -np.sort(-expected_scores, axis=1)[:, :10]
+
+        # Ties are broken arbitrarily, so neighbors are compared through their similarities.
+        assert np.allclose(similarities, expected_similarities, atol=1e-5)
+        assert not (neighbor_rows == query_rows[:, None]).any()
+        assert np.allclose(
+            np.take_along_axis(expected_scores, neighbor_rows, axis=1),
+            similarities,
+            atol=1e-5,
+        )
+
+    def test_get_similar_games(self):
+        steam_database = get_toy_steam_database()
+        categories_dict, genres_dict = get_toy_categories_and_genres()
+        aggregate = {
+            app_id: {'text': 'A puzzle game with portals' if i % 2 else 'A racing game with cars'}
+            for i, app_id in enumerate(steam_database)
+        }
+
+        vectors = similar_games.build_app_vectors(steam_database, categories_dict, genres_dict, aggregate)
+        assert np.allclose(np.sqrt(vectors.multiply(vectors).sum(axis=1)), 1)
+
+        index = similar_games.build_similarity_index(
+            vectors,
+            list(steam_database.keys()),
+            [game['name'] for game in steam_database.values()],
+        )
+
+        assert similar_games.resolve_queries(index, ['20', 'game 30', 'Game 4', 'Unknown']) == [1, 2, 3, None]
+
+        results = similar_games.get_similar_games(index, ['20', 'Unknown'], k=5)
+        assert results['Unknown'] is None
+        assert len(results['20']) == 5
+        assert '20' not in [app_id for app_id, _, _ in results['20']]
+        # Games 20 and 60 share their tags and their description.
+        assert results['20'][0][2] > 0.999
+
+
+class TestBenchmarkEmbeddingsMethods(unittest.TestCase):
+    def test_benchmark_embeddings(self):
+        results = benchmark_embeddings.benchmark_embeddings(
+            sizes=[(60, 1000)],
+            backends=['PCA', 't-SNE'],
+            measure_memory=False,
+            verbose=False,
+        )
+
+        assert [result['backend'] for result in results] == ['distances', 'PCA', 't-SNE']
+        for result in results[1:]:
+            assert 'error' not in result
+            assert 0 <= result['trustworthiness'] <= 1
+            assert 0 <= result['neighborhood_preservation'] <= 1
+
+    def test_compute_neighborhood_preservation(self):
+        rng = np.random.default_rng(0)
+        points = rng.normal(size=(50, 2))
+        distances = np.linalg.norm(points[:, None] - points[None, :], axis=2)
+
+        assert benchmark_embeddings.compute_neighborhood_preservation(distances, points) == 1
+        assert benchmark_embeddings.compute_neighborhood_preservation(distances, rng.normal(size=(50, 2))) < 0.5
+
+
+class TestGenerateSyntheticCorpusMethods(unittest.TestCase):
+    def test_generate_synthetic_corpus(self):
+        import aggregate_steam_spy
+        import steampi.api
+        import steam_spy
+
+        today = datetime.date(2020, 6, 15)
+
+        current_dir = os.getcwd()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            os.chdir(temp_dir)
+            try:
+                counts = generate_synthetic_corpus.generate_synthetic_corpus(num_apps=500, today=today, verbose=False)
+                assert sum(counts[outcome] for outcome in generate_synthetic_corpus.OUTCOMES) == 500
+                assert counts['faulty'] > 0
+
+                with self.assertRaises(FileExistsError):
+                    generate_synthetic_corpus.generate_synthetic_corpus(num_apps=500, today=today, verbose=False)
+
+                steam_catalog, _, status_code = steam_catalog_utils.load_steam_catalog()
+                assert len(steam_catalog) == 500
+                assert status_code is None
+
+                successful_app_ids = steam_spy.load_text_file(steam_spy.get_previously_seen_app_ids_of_games())
+                faulty_app_ids = steam_spy.load_text_file(steam_spy.get_previously_seen_app_ids_of_non_games())
+                assert len(successful_app_ids) + len(faulty_app_ids) + counts['not_scraped'] == 500
+                assert successful_app_ids.isdisjoint(faulty_app_ids)
+
+                app_details = [steampi.api.load_app_details(app_id)[0] for app_id in sorted(successful_app_ids)]
+                assert None in app_details
+                assert {} in app_details
+
+                steam_database, categories, genres = aggregate_steam_spy.aggregate_steam_data(verbose=False)
+                assert len(steam_database) == counts['game']
+
+                release_calendar, weird_release_dates = analyze_steam_database.build_steam_calendar(steam_database)
+                assert len(weird_release_dates) > 0
+                assert sum(len(app_ids) for app_ids in release_calendar.values()) > 0.9 * len(steam_database)
+                assert max(release_calendar.keys()).date() <= today
+
+                # The same seed gives the same corpus.
+                expected_game = steam_database[next(iter(steam_database))]
+                generate_synthetic_corpus.generate_synthetic_corpus(
+                    num_apps=500,
+                    today=today,
+                    overwrite=True,
+                    verbose=False,
+                )
+                steam_database, _, _ = aggregate_steam_spy.aggregate_steam_data(verbose=False)
+                assert steam_database[next(iter(steam_database))] == expected_game
+            finally:
+                os.chdir(current_dir)
+
+
+class TestBenchmarkStagesMethods(unittest.TestCase):
+    def test_benchmark_stages(self):
+        results = benchmark_stages.benchmark_stages(num_apps=1000, measure_memory=False, num_repeats=1, verbose=False)
+
+        assert list(results['stages'].keys()) == [stage_name for stage_name, _ in benchmark_stages.STAGES]
+        assert results['stages']['catalog_parsing']['num_items'] == 1000
+        assert results['stages']['aggregation']['num_items'] > 0
+
+        # The same results are no regression, whereas a slower stage is.
+        assert benchmark_stages.compare_to_baseline(results, results) == []
+
+        slower_results = {'num_apps': 1000, 'stages': {'aggregation': {'time_s': 10.0, 'peak_memory_mb': np.nan}}}
+        baseline = {'num_apps': 1000, 'stages': {'aggregation': {'time_s': 1.0, 'peak_memory_mb': np.nan}}}
+        assert benchmark_stages.compare_to_baseline(slower_results, baseline) == [('aggregation', 'time_s', 1.0, 10.0)]
+
+        # The stored baseline, read by default, covers every stage.
+        stored_baseline = benchmark_stages.load_results(benchmark_stages.get_baseline_filename())
+        assert list(stored_baseline['stages'].keys()) == list(results['stages'].keys())
+        assert benchmark_stages.get_parser().parse_args([]).baseline_filename == benchmark_stages.get_baseline_filename()
+
+
+class TestProfilingMethods(unittest.TestCase):
+    def test_profile_stage(self):
+        # Outside of a profiled run, stages do nothing.
+        with profiling.profile_stage('ignored') as stage:
+            stage['num_items'] = 1
+        assert not profiling.is_profiling()
+
+        current_dir = os.getcwd()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            os.chdir(temp_dir)
+            try:
+                profiling.start_run('test', trace_memory=True)
+                with profiling.profile_stage('outer'):
+                    with profiling.profile_stage('inner') as stage:
+                        data = np.ones(2**20)
+                        stage['num_items'] = len(data)
+                    del data
+                report = profiling.finish_run(verbose=False)
+
+                assert not profiling.is_profiling()
+                assert [stage['path'] for stage in report['stages']] == ['outer/inner', 'outer']
+                inner_stage, outer_stage = report['stages']
+                assert inner_stage['num_items'] == 2**20
+                # The peak of the outer stage includes the peak of the inner stage.
+                assert inner_stage['peak_memory_mb'] >= 8
+                assert outer_stage['peak_memory_mb'] >= inner_stage['peak_memory_mb']
+                assert outer_stage['duration_s'] >= inner_stage['duration_s']
+                assert len(os.listdir(profiling.get_profile_folder())) == 1
+            finally:
+                os.chdir(current_dir)
+
+    def test_profiled_cli_run(self):
+        import json
+
+        current_dir = os.getcwd()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            os.chdir(temp_dir)
+            try:
+                counts = generate_synthetic_corpus.generate_synthetic_corpus(num_apps=300, verbose=False)
+                cli.main(['--profile', '--profile-memory', '--cprofile', 'aggregate', '--quiet'])
+
+                filenames = sorted(os.listdir(profiling.get_profile_folder()))
+                assert [os.path.splitext(filename)[1] for filename in filenames] == ['.json', '.pstats']
+
+                with open(profiling.get_profile_folder() + filenames[0], encoding='utf8') as f:
+                    report = json.load(f)
+
+                stages = {stage['path']: stage for stage in report['stages']}
+                assert stages['aggregate/extraction']['num_items'] == counts['game']
+                assert stages['aggregate/save']['peak_memory_mb'] > 0
+                assert 'aggregate' in stages
+                assert len(report['top_functions']) > 0
+            finally:
+                os.chdir(current_dir)
+
+
+def run_toy_stage(stage_name, stage):
+    # A stage of the toy pipeline, which concatenates its inputs into each of its outputs
+    if stage.get('fail'):
+        raise RuntimeError(stage_name)
+
+    content = stage_name
+    for filename in stage['inputs']:
+        with open(filename, encoding='utf8') as f:
+            content += '|' + f.read()
+
+    for filename in stage['outputs']:
+        with open(filename, 'w', encoding='utf8') as f:
+            f.write(content)
+
+    return True
+
+
+class TestPipelineMethods(unittest.TestCase):
+    def test_get_stage_code_filenames(self):
+        # The code of a stage includes the modules which its subcommand imports, directly or not.
+        code_filenames = {
+            stage_name: {os.path.basename(filename) for filename in pipeline.get_stage_code_filenames(stage)}
+            for stage_name, stage in pipeline.get_stages().items()
+        }
+        assert {'app_details_extraction.py', 'aggregate_game_text_descriptions.py', 'quantile_sketches.py'}.issubset(
+            code_filenames['aggregate'],
+        )
+        assert {'time_series_engine.py', 'quantile_sketches.py', 'compact_records.py'}.issubset(code_filenames['analyze'])
+        assert 'numpy.py' not in code_filenames['analyze']
+
+        # A change to an imported module changes the fingerprint of the stage.
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with open(os.path.join(temp_dir, 'toy_stage.py'), 'w') as f:
+                f.write('import os\n\n\ndef main():\n    from toy_helper import helper\n')
+            with open(os.path.join(temp_dir, 'toy_helper.py'), 'w') as f:
+                f.write('def helper():\n    return 1\n')
+
+            code_filenames = sorted(pipeline.get_local_imports(os.path.join(temp_dir, 'toy_stage.py')))
+            assert code_filenames == [os.path.join(temp_dir, 'toy_helper.py')]
+
+            stage = {'inputs': [], 'outputs': []}
+            fingerprint = pipeline.compute_stage_fingerprint(stage, code_filenames)
+            with open(os.path.join(temp_dir, 'toy_helper.py'), 'w') as f:
+                f.write('def helper():\n    return 2\n')
+            assert pipeline.compute_stage_fingerprint(stage, code_filenames) != fingerprint
+
+    def test_run_pipeline(self):
+        stages = {
+            'a': {'inputs': ['source.txt'], 'outputs': ['a.txt']},
+            'b': {'inputs': ['a.txt'], 'outputs': ['b.txt']},
+            'c': {'inputs': ['a.txt'], 'outputs': ['c.txt']},
+            'd': {'inputs': ['b.txt', 'c.txt'], 'outputs': ['d.txt']},
+        }
+
+        assert pipeline.get_dependencies(stages) == {'a': set(), 'b': {'a'}, 'c': {'a'}, 'd': {'b', 'c'}}
+
+        def run(**kwargs):
+            return pipeline.run_pipeline(
+                stages=stages,
+                run_function=run_toy_stage,
+                max_workers=2,
+                use_code_fingerprint=False,
+                verbose=False,
+                **kwargs,
+            )
+
+        current_dir = os.getcwd()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            os.chdir(temp_dir)
+            try:
+                with open('source.txt', 'w', encoding='utf8') as f:
+                    f.write('v1')
+
+                assert set(run(dry_run=True).values()) == {'to-run'}
+                assert set(run().values()) == {'done'}
+                with open('d.txt', encoding='utf8') as f:
+                    assert f.read() == 'd|b|a|v1|c|a|v1'
+                assert set(run().values()) == {'up-to-date'}
+
+                # A missing output, or a forced stage, is run again, but not the stages after it, whose inputs are the same.
+                os.remove('c.txt')
+                assert run() == {'a': 'up-to-date', 'b': 'up-to-date', 'c': 'done', 'd': 'up-to-date'}
+                assert run(force=['b']) == {'a': 'up-to-date', 'b': 'done', 'c': 'up-to-date', 'd': 'up-to-date'}
+
+                # A change of the source is propagated to every stage.
+                with open('source.txt', 'w', encoding='utf8') as f:
+                    f.write('v2')
+                assert set(run().values()) == {'done'}
+
+                # A failed stage blocks the stages after it, and is run again next time.
+                with open('source.txt', 'w', encoding='utf8') as f:
+                    f.write('v3')
+                stages['c']['fail'] = True
+                assert run() == {'a': 'done', 'b': 'done', 'c': 'failed', 'd': 'blocked'}
+                del stages['c']['fail']
+                assert run() == {'a': 'up-to-date', 'b': 'up-to-date', 'c': 'done', 'd': 'done'}
+            finally:
+                os.chdir(current_dir)
+
+    def test_run_pipeline_with_synthetic_corpus(self):
+        import steam_spy
+
+        current_dir = os.getcwd()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            os.chdir(temp_dir)
+            try:
+                generate_synthetic_corpus.generate_synthetic_corpus(num_apps=300, verbose=False)
+
+                assert 'profile-corpus' in pipeline.get_dependencies(pipeline.get_stages())['aggregate']
+
+                statuses = pipeline.run_pipeline(stage_names=['profile-corpus', 'aggregate'], verbose=False)
+                assert statuses == {'profile-corpus': 'done', 'aggregate': 'done'}
+                assert os.path.exists('aggregate.json')
+                assert os.path.exists(steam_spy.get_quarantined_app_ids_filename())
+
+                statuses = pipeline.run_pipeline(stage_names=['profile-corpus', 'aggregate'], verbose=False)
+                assert statuses == {'profile-corpus': 'up-to-date', 'aggregate': 'up-to-date'}
+            finally:
+                os.chdir(current_dir)
+
+
+class TestAppDetailsExtractionMethods(unittest.TestCase):
+    def test_run_extractors(self):
+        import aggregate_game_text_descriptions
+        import aggregate_steam_spy
+
+        current_dir = os.getcwd()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            os.chdir(temp_dir)
+            try:
+                generate_synthetic_corpus.generate_synthetic_corpus(num_apps=500, verbose=False)
+
+                expected_steam_data = aggregate_steam_spy.aggregate_steam_data(verbose=False)
+                aggregate_game_text_descriptions.aggregate_game_descriptions_from_steam_data('separate.json', verbose=False)
+
+                # An extractor of a few appIDs, in any order, which are then read in the order of integers.
+                selected_app_ids = sorted(expected_steam_data[0], key=int)[:3]
+                read_app_ids = []
+                counting_extractor = {
+                    'app_ids': selected_app_ids[::-1],
+                    'update': lambda app_id, _: read_app_ids.append(app_id),
+                    'finalize': lambda: len(read_app_ids),
+                }
+
+                extractors = {
+                    'steam_data': aggregate_steam_spy.get_steam_data_extractor(verbose=False),
+                    'text': aggregate_game_text_descriptions.get_game_description_extractor('fused.json', verbose=False),
+                    'count': counting_extractor,
+                }
+                app_ids = app_details_extraction.get_extraction_order(extractors)
+                assert app_ids == sorted(app_ids, key=int)
+                assert len(app_ids) == len(set(app_ids))
+
+                outputs = app_details_extraction.run_extractors(extractors)
+                assert outputs['steam_data'] == expected_steam_data
+                assert outputs['count'] == 3
+                assert read_app_ids == selected_app_ids
+
+                with open('separate.json', 'rb') as f, open('fused.json', 'rb') as g:
+                    assert f.read() == g.read()
+            finally:
+                os.chdir(current_dir)
+
+
+class TestCompactRecordsMethods(unittest.TestCase):
+    def test_app_record(self):
+        import pickle
+
+        steam_database = get_toy_steam_database()
+        compact_database = compact_records.compact_steam_database(steam_database)
+
+        for app_id, game in steam_database.items():
+            record = compact_database[app_id]
+            assert record == game
+            assert list(record.items()) == list(game.items())
+            assert pickle.loads(pickle.dumps(record)) == game
+        assert not hasattr(record, '__dict__')
+
+        # Repeated lists are shared, and boolean keys added later are packed.
+        assert compact_database['10'].developers is compact_database['50'].developers
+        record = compact_records.AppRecord(game)
+        record['is_new'] = True
+        record['note'] = 'extra'
+        record['platforms'] = {'windows': True, 'mac': False, 'linux': False, 'steamos': True}
+        record['is_free'] = 'unknown'
+        assert record['is_new'] and record['note'] == 'extra' and record['is_free'] == 'unknown'
+        assert record['platforms']['steamos']
+        assert list(record)[-2:] == ['is_new', 'note']
+
+        del record['is_new'], record['metacritic'], record['platforms']
+        assert 'is_new' not in record and 'metacritic' not in record and 'platforms' not in record
+        with self.assertRaises(KeyError):
+            record['metacritic']
+        assert len(record) == len(game) - 2 + 1
+
+        # The analysis gives the same results with compact records.
+        for database in [steam_database, compact_database]:
+            database = analyze_steam_database.fill_in_categorie(database, 'single_player', 2)
+            database = analyze_steam_database.fill_in_genre(database, 'indie', 23)
+        assert compact_database['20']['single_player'] and compact_database['20'] == steam_database['20']
+        assert (
+            analyze_steam_database.build_steam_calendar(compact_database)[0]
+            == analyze_steam_database.build_steam_calendar(steam_database)[0]
+        )
+        app_ids = [
+            steam_query.query_app_ids(steam_query.build_query_index(database), flags={'linux_support': True}, genres=[23])
+            for database in [steam_database, compact_database]
+        ]
+        assert app_ids[0] == app_ids[1]
+
+    def test_load_compact_steam_database(self):
+        import json
+
+        steam_database = get_toy_steam_database()
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            filename = os.path.join(temp_dir, 'steamspy.json')
+            with open(filename, 'w', encoding='utf8') as f:
+                json.dump(steam_database, f)
+
+            compact_database = compact_records.load_compact_steam_database(filename)
+
+        assert all(isinstance(record, compact_records.AppRecord) for record in compact_database.values())
+        assert compact_records.to_plain_steam_database(compact_database) == steam_database
+
+
+class TestPublisherAnalyticsMethods(unittest.TestCase):
+    def test_build_entity_index(self):
+        steam_database = get_toy_steam_database()
+        steam_database['10']['publishers'] = ['Publisher 0', 'Publisher 0 ', 'Publisher 1']
+        steam_database['20']['developers'] = None
+
+        index = publisher_analytics.build_entity_index(steam_database, key='publishers')
+        assert list(index['entity_names']) == ['Publisher 0', 'Publisher 1', 'Publisher 2']
+
+        release_calendar, _ = analyze_steam_database.build_steam_calendar(steam_database)
+        release_years = {app_id: date.year for date, app_ids in release_calendar.items() for app_id in app_ids}
+
+        for name in index['entity_names']:
+            app_ids = [app_id for app_id, game in steam_database.items() if name in game['publishers']]
+            summary = publisher_analytics.get_entity_summary(index, name)
+
+            assert sorted(summary['app_ids']) == sorted(app_ids)
+            # Free games count as a price of zero.
+            prices = [
+                0 if steam_database[app_id]['is_free'] else steam_database[app_id]['price_overview'] for app_id in app_ids
+            ]
+            assert summary['median_price'] == np.median(prices)
+            scores = [steam_database[app_id]['metacritic'] for app_id in app_ids]
+            assert np.isclose(summary['mean_metacritic'], np.mean([score for score in scores if score is not None]))
+            assert summary['recommendations'] == sum(steam_database[app_id]['recommendations'] for app_id in app_ids)
+
+            years = [release_years[app_id] for app_id in app_ids if app_id in release_years]
+            assert summary['releases_per_year'] == {year: years.count(year) for year in set(years)}
+
+        # Rankings by releases between two years, inclusive, match a count per entity.
+        for since, until in [(2016, None), (2016, 2017), (None, 2015), (2030, None)]:
+            top_entities = publisher_analytics.get_top_entities(index, 'releases', n=2, since=since, until=until)
+            expected_counts = {
+                name: sum(
+                    name in steam_database[app_id]['publishers']
+                    and (since is None or year >= since)
+                    and (until is None or year <= until)
+                    for app_id, year in release_years.items()
+                )
+                for name in index['entity_names']
+            }
+            expected_top_entities = sorted(expected_counts.items(), key=lambda item: (-item[1], item[0]))[:2]
+            assert [(name, value) for name, value, _ in top_entities] == expected_top_entities
+
+        # The names listed twice for the same game count once.
+        top_entities = publisher_analytics.get_top_entities(index, 'recommendations', n=10, min_games=21)
+        assert [name for name, _, _ in top_entities] == ['Publisher 1']
+
+        index = publisher_analytics.build_entity_index(steam_database, key='developers')
+        assert index['num_games'].sum() == len(steam_database) - 1
+
+        # A publisher of free games only has a median price of zero.
+        steam_database['10']['publishers'] = ['Free Publisher']
+        index = publisher_analytics.build_entity_index(steam_database, key='publishers')
+        assert publisher_analytics.get_entity_summary(index, 'Free Publisher')['median_price'] == 0
+
+    def test_load_entity_index(self):
+        import aggregate_steam_spy
+
+        current_dir = os.getcwd()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            os.chdir(temp_dir)
+            try:
+                generate_synthetic_corpus.generate_synthetic_corpus(num_apps=300, verbose=False)
+                aggregate_steam_spy.main(verbose=False)
+
+                index = publisher_analytics.load_entity_index('publishers')
+                expected_top_entities = publisher_analytics.get_top_entities(index, 'num_games', n=5)
+                assert len(os.listdir(derived_data_cache.get_cache_folder())) > 0
+
+                # The second call is served by the cache, without loading the database.
+                with unittest.mock.patch.object(publisher_analytics, 'get_steam_database') as get_steam_database:
+                    index = publisher_analytics.load_entity_index('publishers')
+                    get_steam_database.assert_not_called()
+                assert publisher_analytics.get_top_entities(index, 'num_games', n=5) == expected_top_entities
+            finally:
+                os.chdir(current_dir)
+
+
+class TestProfileCorpusMethods(unittest.TestCase):
+    def test_profile_corpus(self):
+        import json
+
+        import aggregate_steam_spy
+        import steampi.api
+        import steam_spy
+
+        current_dir = os.getcwd()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            os.chdir(temp_dir)
+            try:
+                counts = generate_synthetic_corpus.generate_synthetic_corpus(num_apps=1000, verbose=False)
+                steam_database, _, _ = aggregate_steam_spy.aggregate_steam_data(verbose=False)
+
+                # Truncate the app details of a game, and empty those of another one.
+                truncated_app_id, emptied_app_id = list(steam_database)[:2]
+                original_app_details, _, _ = steampi.api.load_app_details(truncated_app_id)
+                with open(steampi.api.get_appdetails_filename(truncated_app_id), 'r+', encoding='utf8') as f:
+                    f.truncate(50)
+                open(steampi.api.get_appdetails_filename(emptied_app_id), 'w').close()
+                with self.assertRaises(json.JSONDecodeError):
+                    aggregate_steam_spy.aggregate_steam_data(verbose=False)
+
+                # The same profile is obtained with a pool of processes, and with chunks of any size.
+                profile = profile_corpus.profile_corpus(num_workers=2, chunk_size=64, verbose=False)
+                assert profile == profile_corpus.profile_corpus(num_workers=1, chunk_size=1000, verbose=False)
+
+                assert profile['bad_files']['invalid_json'] == [truncated_app_id]
+                assert profile['bad_files']['empty_file'] == [emptied_app_id]
+                assert profile['statuses']['empty_dict'] == counts['empty_dict']
+                assert profile['statuses']['null'] == counts['null']
+                assert profile['num_files'] == sum(profile['statuses'].values())
+
+                name_stats = profile['key_paths']['name']
+                assert name_stats['types'] == {'str': name_stats['num_documents']}
+                categorie_id_stats = profile['key_paths']['categories[].id']
+                assert categorie_id_stats['types'] == {'int': categorie_id_stats['num_values']}
+                assert 0 < profile['key_paths']['metacritic.score']['coverage'] < 1
+
+                # Once bad files are quarantined, the aggregation skips them.
+                quarantined_app_ids = profile_corpus.save_quarantine(profile)
+                assert steam_spy.load_quarantined_app_ids() == set(quarantined_app_ids)
+                new_steam_database, _, _ = aggregate_steam_spy.aggregate_steam_data(verbose=False)
+                assert set(steam_database).difference(new_steam_database) == {truncated_app_id, emptied_app_id}
+
+                # A file which changes after the scan, e.g. after a new download, is released from the quarantine.
+                with open(steampi.api.get_appdetails_filename(truncated_app_id), 'w', encoding='utf8') as f:
+                    json.dump(original_app_details, f)
+                assert steam_spy.load_quarantined_app_ids() == set(quarantined_app_ids).difference({truncated_app_id})
+                new_steam_database, _, _ = aggregate_steam_spy.aggregate_steam_data(verbose=False)
+                assert set(steam_database).difference(new_steam_database) == {emptied_app_id}
+
+                profile_filename = profile_corpus.save_profile(profile)
+                with open(profile_filename, encoding='utf8') as f:
+                    assert json.load(f) == profile
+            finally:
+                os.chdir(current_dir)
+
+
+def start_stub_store(get_response):
+    # Objective: serve the appdetails endpoint locally. get_response() is called with the query parameters of each
+    # request, and returns the status code and the JSON payload.
+    import http.server
+    import json
+    import threading
+    import urllib.parse
+
+    requests = []
+
+    class StubStoreHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            parameters = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+            requests.append({key: values[0] for key, values in parameters.items()})
+
+            status_code, payload = get_response(requests[-1])
+            body = json.dumps(payload).encode('utf8')
+
+            self.send_response(status_code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StubStoreHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    base_url = 'http://127.0.0.1:{}/api/appdetails'.format(server.server_address[1])
+
+    return server, base_url, requests
+
+
+class TestSteamPricesMethods(unittest.TestCase):
+    def test_get_appdetails_url(self):
+        import appdetails_download
+
+        url = appdetails_download.get_appdetails_url(['10', '20'], filters=['price_overview'], country_code='fr')
+        assert url == 'https://store.steampowered.com/api/appdetails?appids=10,20&filters=price_overview&cc=fr'
+        assert appdetails_download.get_appdetails_url(10).endswith('/appdetails?appids=10')
+
+    def test_refresh_prices(self):
+        import steam_prices
+
+        # Every third app is free, i.e. data is an empty list, and every fifth app is not sold in the country.
+        # The store throttles the first request for fr, always rejects the country code xx, and always fails for jp.
+        def get_response(parameters):
+            if parameters['cc'] == 'fr' and not throttled:
+                throttled.append(True)
+                return 429, None
+            if parameters['cc'] == 'xx':
+                return 400, None
+            if parameters['cc'] == 'jp':
+                return 503, None
+
+            response = {}
+            for app_id in parameters['appids'].split(','):
+                if int(app_id) % 5 == 0:
+                    response[app_id] = {'success': False}
+                elif int(app_id) % 3 == 0:
+                    response[app_id] = {'success': True, 'data': []}
+                else:
+                    price_overview = {
+                        'currency': parameters['cc'].upper(),
+                        'initial': int(app_id) * 10,
+                        'final': int(app_id) * 5,
+                        'discount_percent': 50,
+                    }
+                    response[app_id] = {'success': True, 'data': {'price_overview': price_overview}}
+            return 200, response
+
+        throttled = []
+        server, base_url, requests = start_stub_store(get_response)
+
+        app_ids = [str(app_id) for app_id in range(1, 251)]
+        sleeps = []
+        try:
+            rows, num_requests, failed_batches = steam_prices.refresh_prices(
+                app_ids,
+                country_codes=['us', 'fr'],
+                batch_size=100,
+                base_url=base_url,
+                query_rate_limit=3,
+                wait_time=7,
+                sleep_function=sleeps.append,
+                verbose=False,
+            )
+
+            # 3 batches per country code, plus the throttled request which is retried
+            assert num_requests == len(requests) == 2 * 3 + 1
+            assert all(parameters['filters'] == 'price_overview' for parameters in requests)
+            assert [len(parameters['appids'].split(',')) for parameters in requests[:3]] == [100, 100, 50]
+            # One wait once the quota is reached, and one wait after the throttled request
+            assert sleeps == [7, 7]
+            assert failed_batches == []
+
+            # Persistent errors are retried a bounded number of times, only if they are transient, then skipped.
+            sleeps.clear()
+            _, num_requests, failed_batches = steam_prices.refresh_prices(
+                app_ids,
+                country_codes=['xx', 'jp'],
+                base_url=base_url,
+                wait_time=7,
+                sleep_function=sleeps.append,
+                max_retries=2,
+                verbose=False,
+            )
+            assert num_requests == 3 + 3 * (1 + 2)
+            assert sleeps == [7] * (3 * 2)
+            assert [(country_code, status_code) for country_code, _, status_code in failed_batches] == [
+                ('xx', 400),
+                ('xx', 400),
+                ('xx', 400),
+                ('jp', 503),
+                ('jp', 503),
+                ('jp', 503),
+            ]
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        # Apps which are not sold in the country are marked as unavailable, without any price.
+        assert len(rows) == 2 * len(app_ids)
+        rows_by_key = {(row['appid'], row['country_code']): row for row in rows}
+        assert rows_by_key[('7', 'fr')]['currency'] == 'FR'
+        assert rows_by_key[('7', 'fr')]['final'] == 35
+        assert rows_by_key[('9', 'us')]['final'] is None
+        assert rows_by_key[('9', 'us')]['is_available']
+        assert rows_by_key[('10', 'us')]['final'] is None
+        assert not rows_by_key[('10', 'us')]['is_available']
+
+        current_dir = os.getcwd()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            os.chdir(temp_dir)
+            try:
+                os.mkdir('data')
+                steam_prices.save_price_table(rows)
+
+                # A refresh for one country replaces the rows of this country, and keeps the others.
+                new_row = dict(rows_by_key[('7', 'us')], final=1)
+                steam_prices.save_price_table([new_row])
+                saved_rows = steam_prices.load_price_table()
+                assert len(saved_rows) == len(rows)
+                saved_rows_by_key = {(row['appid'], row['country_code']): row for row in saved_rows}
+                assert saved_rows_by_key[('7', 'us')]['final'] == '1'
+                assert saved_rows_by_key[('7', 'fr')]['final'] == '35'
+                assert saved_rows_by_key[('9', 'us')]['final'] == ''
+
+                # The price of an app which is no longer sold is not kept as current.
+                steam_prices.save_price_table(steam_prices.parse_price_response({'7': {'success': False}}, 'us', 'today'))
+                saved_rows_by_key = {(row['appid'], row['country_code']): row for row in steam_prices.load_price_table()}
+                assert saved_rows_by_key[('7', 'us')]['final'] == ''
+                assert saved_rows_by_key[('7', 'us')]['is_available'] == 'False'
+            finally:
+                os.chdir(current_dir)
+
+
+class TestFilteredAppDetailsMethods(unittest.TestCase):
+    def test_update_app_details(self):
+        import json
+        from unittest import mock
+
+        import aggregate_steam_spy
+        import appdetails_download
+        import steampi.api
+        import steam_spy
+
+        # Filtered requests return some fields of the refresh profile, without any price, or an empty list for every
+        # third appID. Other requests return a complete document.
+        def get_response(parameters):
+            app_id = parameters['appids']
+            if 'filters' not in parameters:
+                app_details = dict(full_app_details, name='Full game {}'.format(app_id), steam_appid=int(app_id))
+            elif int(app_id) % 3 == 0:
+                app_details = []
+            else:
+                app_details = {'recommendations': {'total': int(app_id)}, 'achievements': {'total': 3}}
+            return 200, {app_id: {'success': True, 'data': app_details}}
+
+        full_app_details = {}
+
+        server, base_url, requests = start_stub_store(get_response)
+
+        current_dir = os.getcwd()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            os.chdir(temp_dir)
+            try:
+                generate_synthetic_corpus.generate_synthetic_corpus(num_apps=60, verbose=False)
+
+                with open(steam_spy.get_previously_seen_app_ids_of_games()) as f:
+                    game_app_ids = [line.strip() for line in f]
+
+                stored_app_details = {}
+                for app_id in game_app_ids:
+                    with open(steampi.api.get_appdetails_filename(app_id), encoding='utf8') as f:
+                        stored_app_details[app_id] = json.load(f)
+                valid_app_ids = [app_id for app_id, app_details in stored_app_details.items() if app_details]
+                assert 0 < len(valid_app_ids) < len(game_app_ids)
+                full_app_details.update(stored_app_details[valid_app_ids[0]])
+
+                # The refresh neither needs the catalog, nor focuses on appIDs ending with a zero.
+                os.remove(steam_catalog_utils.get_json_filename_for_steam_catalog())
+                assert not all(app_id.endswith('0') for app_id in game_app_ids)
+
+                with mock.patch.object(appdetails_download, 'APPDETAILS_URL', base_url):
+                    steam_spy.scrape_steam_data(focus_on_probable_games=True, request_profile='refresh')
+
+                # One request per game, filtered unless there was no valid stored document.
+                assert sorted(parameters['appids'] for parameters in requests) == sorted(game_app_ids)
+                filtered_app_ids = [parameters['appids'] for parameters in requests if 'filters' in parameters]
+                assert filtered_app_ids == sorted(valid_app_ids, key=int)
+                assert requests[0]['filters'] == ','.join(appdetails_download.REQUEST_PROFILES['refresh'])
+
+                for app_id in game_app_ids:
+                    app_details, _, _ = steampi.api.load_app_details(app_id)
+                    if app_id not in valid_app_ids:
+                        assert app_details['name'] == 'Full game {}'.format(app_id)
+                        continue
+
+                    # An empty response leaves the document as-is. Otherwise, requested fields are replaced, missing
+                    # removable fields are removed, and other fields, e.g. the release date, are kept.
+                    expected_app_details = dict(stored_app_details[app_id])
+                    if int(app_id) % 3 != 0:
+                        expected_app_details.pop('price_overview', None)
+                        expected_app_details.pop('metacritic', None)
+                        expected_app_details['recommendations'] = {'total': int(app_id)}
+                        expected_app_details['achievements'] = {'total': 3}
+                    assert app_details == expected_app_details
+                    assert 'release_date' in app_details
+
+                # The refreshed corpus can be aggregated.
+                steam_database, _, _ = aggregate_steam_spy.aggregate_steam_data(verbose=False)
+                for app_id in valid_app_ids:
+                    if stored_app_details[app_id]['type'] == 'game' and int(app_id) % 3 != 0:
+                        assert steam_database[app_id]['recommendations'] == int(app_id)
+                        assert steam_database[app_id]['price_overview'] is None
+
+                # The logs of appIDs are not modified by a refresh.
+                with open(steam_spy.get_previously_seen_app_ids_of_games()) as f:
+                    assert [line.strip() for line in f] == game_app_ids
+            finally:
+                os.chdir(current_dir)
+                server.shutdown()
+                server.server_close()
+
+    def test_download_filtered_app_details(self):
+        import appdetails_download
+
+        def get_response(parameters):
+            return 200, {parameters['appids']: {'success': True, 'data': []}}
+
+        server, base_url, _ = start_stub_store(get_response)
+        try:
+            app_details, is_success, status_code = appdetails_download.download_filtered_app_details(
+                '10',
+                'refresh',
+                base_url,
+            )
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        assert (app_details, is_success, status_code) == ({}, True, 200)
+
+
 class TestBuildTagMapMethods(unittest.TestCase):
     def test_main(self):
         assert build_tag_map.main()
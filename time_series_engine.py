@@ -0,0 +1,253 @@
+# Objective: aggregate dated values at several granularities, and compute rolling windows with prefix sums
+
+import datetime
+
+import numpy as np
+
+GRANULARITIES = ['day', 'week', 'month', 'quarter', 'year']
+
+
+def convert_to_days(dates):
+    # Convert a list of datetime.date or datetime.datetime to an array of days
+    return np.array(
+        [np.datetime64(datetime.date(d.year, d.month, d.day), 'D') for d in dates],
+        dtype='datetime64[D]',
+    )
+
+
+def get_period_starts(days, granularity='month'):
+    # Objective: map each day to the first day of its period. Weeks are ISO weeks, which start on Mondays.
+
+    days = np.asarray(days, dtype='datetime64[D]')
+
+    if granularity == 'day':
+        period_starts = days
+    elif granularity == 'week':
+        # 1970-01-01 was a Thursday, i.e. weekday 3 if Monday is 0.
+        day_numbers = days.astype(np.int64)
+        weekdays = (day_numbers + 3) % 7
+        period_starts = (day_numbers - weekdays).astype('datetime64[D]')
+    elif granularity == 'month':
+        period_starts = days.astype('datetime64[M]').astype('datetime64[D]')
+    elif granularity == 'quarter':
+        month_numbers = days.astype('datetime64[M]').astype(np.int64)
+        period_starts = (
+            (month_numbers - month_numbers % 3)
+            .astype('datetime64[M]')
+            .astype('datetime64[D]')
+        )
+    elif granularity == 'year':
+        period_starts = days.astype('datetime64[Y]').astype('datetime64[D]')
+    else:
+        raise ValueError('Unknown granularity: {}'.format(granularity))
+
+    return period_starts
+
+
+def get_period_start(date, granularity='month'):
+    day = np.datetime64(datetime.date(date.year, date.month, date.day), 'D')
+    period_start = get_period_starts(np.array([day]), granularity)[0]
+
+    return period_start.astype(datetime.date)
+
+
+def get_next_period_starts(period_starts, granularity='month'):
+    period_starts = np.asarray(period_starts, dtype='datetime64[D]')
+
+    if granularity == 'day':
+        next_period_starts = period_starts + 1
+    elif granularity == 'week':
+        next_period_starts = period_starts + 7
+    elif granularity == 'month':
+        next_period_starts = (period_starts.astype('datetime64[M]') + 1).astype(
+            'datetime64[D]',
+        )
+    elif granularity == 'quarter':
+        next_period_starts = (period_starts.astype('datetime64[M]') + 3).astype(
+            'datetime64[D]',
+        )
+    elif granularity == 'year':
+        next_period_starts = (period_starts.astype('datetime64[Y]') + 1).astype(
+            'datetime64[D]',
+        )
+    else:
+        raise ValueError('Unknown granularity: {}'.format(granularity))
+
+    return next_period_starts
+
+
+def get_period_range(first_period_start, last_period_start, granularity='month'):
+    # Objective: list every period between two periods, so that periods without any data are not skipped
+
+    if granularity in ['day', 'week']:
+        step = 1 if granularity == 'day' else 7
+        period_range = np.arange(
+            first_period_start,
+            last_period_start + 1,
+            step,
+            dtype='datetime64[D]',
+        )
+    elif granularity in ['month', 'quarter']:
+        step = 1 if granularity == 'month' else 3
+        period_range = np.arange(
+            first_period_start.astype('datetime64[M]'),
+            last_period_start.astype('datetime64[M]') + 1,
+            step,
+        ).astype('datetime64[D]')
+    elif granularity == 'year':
+        period_range = np.arange(
+            first_period_start.astype('datetime64[Y]'),
+            last_period_start.astype('datetime64[Y]') + 1,
+        ).astype('datetime64[D]')
+    else:
+        raise ValueError('Unknown granularity: {}'.format(granularity))
+
+    return period_range
+
+
+def aggregate_by_period(days, values=None, granularity='month', today=None):
+    # Objective: count and sum values per period, on a regular grid of periods.
+    # The period which contains today, and any later period, is flagged as partial.
+    # The index of the period of each item is kept, so that other values of the same items can be aggregated later.
+
+    days = np.asarray(days, dtype='datetime64[D]')
+    if values is None:
+        values = np.ones(len(days))
+    values = np.asarray(values, dtype=np.float64)
+
+    if today is None:
+        today = datetime.date.today()
+    today = np.datetime64(datetime.date(today.year, today.month, today.day), 'D')
+
+    if len(days) == 0:
+        return {
+            'periods': np.array([], dtype='datetime64[D]'),
+            'counts': np.array([], dtype=np.int64),
+            'sums': np.array([]),
+            'is_partial': np.array([], dtype=bool),
+            'period_indices': np.array([], dtype=np.int64),
+        }
+
+    period_starts = get_period_starts(days, granularity)
+
+    periods = get_period_range(period_starts.min(), period_starts.max(), granularity)
+    period_indices = np.searchsorted(periods, period_starts)
+
+    counts = np.bincount(period_indices, minlength=len(periods))
+    sums = np.bincount(period_indices, weights=values, minlength=len(periods))
+
+    is_partial = get_next_period_starts(periods, granularity) > today
+
+    series = {
+        'periods': periods,
+        'counts': counts,
+        'sums': sums,
+        'is_partial': is_partial,
+        'period_indices': period_indices,
+    }
+
+    return series
+
+
+def build_multi_granularity_series(
+    dates,
+    values=None,
+    granularities=None,
+    today=None,
+):
+    # Objective: convert the dates once, then aggregate at every granularity with vectorized operations only
+
+    if granularities is None:
+        granularities = GRANULARITIES
+
+    days = convert_to_days(dates)
+
+    all_series = {}
+    for granularity in granularities:
+        all_series[granularity] = aggregate_by_period(days, values, granularity, today)
+
+    return all_series
+
+
+def compute_rolling_sum(values, window):
+    # Trailing sums over the last window entries, in O(n), thanks to prefix sums.
+    # The first (window - 1) entries are sums over fewer entries.
+
+    values = np.asarray(values, dtype=np.float64)
+
+    prefix_sums = np.zeros(len(values) + 1)
+    np.cumsum(values, out=prefix_sums[1:])
+
+    upper = np.arange(1, len(values) + 1)
+    lower = np.maximum(upper - window, 0)
+
+    return prefix_sums[upper] - prefix_sums[lower]
+
+
+def compute_rolling_mean(series, window=3, min_count=1):
+    # Trailing mean of the underlying values, e.g. the price of games released during the last 3 months, or the
+    # proportion of games with a given feature if values are booleans. Each value has the same weight, so periods
+    # with more releases weigh more.
+
+    rolling_sums = compute_rolling_sum(series['sums'], window)
+    rolling_counts = compute_rolling_sum(series['counts'], window)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rolling_mean = np.where(
+            rolling_counts >= min_count,
+            rolling_sums / rolling_counts,
+            np.nan,
+        )
+
+    return rolling_mean
+
+
+def aggregate_values(series, values):
+    # Objective: count and sum other values of the same items, without converting their dates again.
+    # Missing values, i.e. NaN, are skipped, e.g. the price of free games.
+
+    values = np.asarray(values, dtype=np.float64)
+    is_defined = ~np.isnan(values)
+
+    num_periods = len(series['periods'])
+    period_indices = series['period_indices'][is_defined]
+
+    # Items of dropped periods have indices past the last period, and are cut off.
+    counts = np.bincount(period_indices, minlength=num_periods)[:num_periods]
+    sums = np.bincount(period_indices, weights=values[is_defined], minlength=num_periods)[:num_periods]
+
+    value_series = {
+        'periods': series['periods'],
+        'counts': counts,
+        'sums': sums,
+        'is_partial': series['is_partial'],
+        'period_indices': series['period_indices'],
+    }
+
+    return value_series
+
+
+def group_by_period(series, items):
+    # Output: a dict period start (datetime.date) -> list of items, for each period with at least one item
+
+    period_starts = series['periods'].astype(datetime.date).tolist()
+    num_periods = len(period_starts)
+
+    groups = {}
+    for item, period_index in zip(items, series['period_indices'].tolist()):
+        if period_index < num_periods:
+            groups.setdefault(period_starts[period_index], []).append(item)
+
+    return groups
+
+
+def drop_partial_periods(series):
+    # Partial periods are the last ones, so that the period index of each item still points to the same period, or
+    # past the last period if the period of the item was dropped.
+    is_complete = ~series['is_partial']
+
+    complete_series = {key: value[is_complete] for key, value in series.items() if key != 'period_indices'}
+    if 'period_indices' in series:
+        complete_series['period_indices'] = series['period_indices']
+
+    return complete_series
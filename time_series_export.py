@@ -0,0 +1,168 @@
+import csv
+import hashlib
+import json
+import pathlib
+
+import numpy as np
+
+CONFIDENCE_INTERVAL_KEYS = ['mean', 'lb', 'ub']
+
+
+def get_export_folder():
+    output_folder = 'exports/'
+    pathlib.Path(output_folder).mkdir(parents=True, exist_ok=True)
+
+    return output_folder
+
+
+def get_plot_manifest_filename():
+    output_folder = 'plots/'
+    pathlib.Path(output_folder).mkdir(parents=True, exist_ok=True)
+
+    return output_folder + 'manifest.json'
+
+
+def convert_to_json_compatible_list(values):
+    # NaN is not valid JSON, so it is replaced with None
+    return [None if np.isnan(v) else float(v) for v in np.asarray(values, dtype=float)]
+
+
+def convert_plot_job_to_time_series(plot_job):
+    time_series = {
+        'title': plot_job['chosen_title'],
+        'ylabel': plot_job['chosen_ylabel'],
+        'dates': [date.isoformat() for date in plot_job['x_list']],
+        'values': convert_to_json_compatible_list(plot_job['y_list']),
+    }
+
+    confidence_interval_data = plot_job['confidence_interval_data']
+    if confidence_interval_data:
+        for key in CONFIDENCE_INTERVAL_KEYS:
+            time_series[key] = convert_to_json_compatible_list(
+                confidence_interval_data[key],
+            )
+
+    return time_series
+
+
+def export_time_series_to_csv(csv_filename, time_series):
+    columns = ['dates', 'values'] + [
+        key for key in CONFIDENCE_INTERVAL_KEYS if key in time_series
+    ]
+
+    with open(csv_filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['date', 'value'] + columns[2:])
+        for row in zip(*[time_series[column] for column in columns]):
+            writer.writerow(['' if v is None else v for v in row])
+
+    return
+
+
+def export_plot_jobs(plot_jobs, output_folder=None):
+    # Objective: write every time series, with confidence intervals if any, without rendering any figure:
+    # - one CSV file per time series,
+    # - one JSON file with every time series,
+    # - one columnar NumPy archive, with arrays named after the time series, e.g. 'num_releases/values'.
+
+    if output_folder is None:
+        output_folder = get_export_folder()
+
+    all_time_series = {}
+    columnar_data = {}
+
+    for plot_job in plot_jobs:
+        base_name = plot_job['base_plot_filename']
+        time_series = convert_plot_job_to_time_series(plot_job)
+        all_time_series[base_name] = time_series
+
+        export_time_series_to_csv(output_folder + base_name + '.csv', time_series)
+
+        columnar_data[base_name + '/dates'] = np.array(
+            [np.datetime64(date, 'D') for date in plot_job['x_list']],
+            dtype='datetime64[D]',
+        )
+        columnar_data[base_name + '/values'] = np.asarray(
+            plot_job['y_list'],
+            dtype=float,
+        )
+        if plot_job['confidence_interval_data']:
+            for key in CONFIDENCE_INTERVAL_KEYS:
+                columnar_data[base_name + '/' + key] = np.asarray(
+                    plot_job['confidence_interval_data'][key],
+                    dtype=float,
+                )
+
+    with open(output_folder + 'time_series.json', 'w', encoding='utf8') as f:
+        json.dump(all_time_series, f)
+
+    np.savez_compressed(output_folder + 'time_series.npz', **columnar_data)
+
+    return all_time_series
+
+
+def get_plot_job_fingerprint(plot_job, style_fingerprint=''):
+    # Objective: hash everything which has an impact on the rendered figure: data, labels, and styling code
+
+    plot_settings = {
+        key: value
+        for key, value in plot_job.items()
+        if key not in ['x_list', 'y_list', 'confidence_interval_data']
+    }
+
+    hasher = hashlib.sha256()
+    hasher.update(style_fingerprint.encode('utf8'))
+    hasher.update(json.dumps(plot_settings, sort_keys=True, default=str).encode('utf8'))
+    hasher.update(json.dumps(convert_plot_job_to_time_series(plot_job)).encode('utf8'))
+
+    return hasher.hexdigest()
+
+
+def load_plot_manifest(manifest_filename=None):
+    if manifest_filename is None:
+        manifest_filename = get_plot_manifest_filename()
+
+    try:
+        with open(manifest_filename, encoding='utf8') as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        manifest = {}
+
+    return manifest
+
+
+def save_plot_manifest(manifest, manifest_filename=None):
+    if manifest_filename is None:
+        manifest_filename = get_plot_manifest_filename()
+
+    with open(manifest_filename, 'w', encoding='utf8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    return True
+
+
+def select_plot_jobs_to_render(
+    plot_jobs,
+    manifest,
+    get_full_plot_filename,
+    style_fingerprint='',
+):
+    # Objective: only keep figures which are missing, or whose data or styling changed since they were rendered
+
+    selected_plot_jobs = []
+    fingerprints = {}
+
+    for plot_job in plot_jobs:
+        base_name = plot_job['base_plot_filename']
+        fingerprint = get_plot_job_fingerprint(plot_job, style_fingerprint)
+        fingerprints[base_name] = fingerprint
+
+        is_up_to_date = (
+            manifest.get(base_name) == fingerprint
+            and pathlib.Path(get_full_plot_filename(base_name)).exists()
+        )
+
+        if not is_up_to_date:
+            selected_plot_jobs.append(plot_job)
+
+    return selected_plot_jobs, fingerprints